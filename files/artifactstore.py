@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+
+# THIS FILE MANANGED BY PUPPET.
+''' artifactstore.py
+
+    Content-addressed store for large or binary configs, kept outside
+    the git repos. A job with "artifact_store" set (in its section or
+    DEFAULT) writes each output file of at least "artifact_min_size"
+    bytes (default 1 MiB), or with a NUL byte near its start, to the
+    store as zlib-compressed chunks named by their sha256. The repo
+    gets a small JSON pointer file in its place, listing the chunks,
+    so history grows by a few hundred bytes per version rather than by
+    the whole file, and chunks shared between versions or devices are
+    stored once.
+
+    Chunks end at line ends picked by a hash of the line (see
+    split()), so inserting or deleting lines only changes the chunks
+    around the edit, not every chunk after it. Data without line ends,
+    such as most binaries, is cut every CHUNK_SIZE bytes.
+
+    From the command line:
+
+      artifactstore.py restore --store DIR [-o OUT] POINTER...
+          Write the content behind pointer files (or directories of
+          them; "-" reads a pointer from stdin, as from `git show
+          REV:path`) to stdout or under OUT.
+      artifactstore.py gc --store DIR [--min-age HOURS] REPO...
+          Delete chunks that no pointer in any commit, or in the
+          worktree, of the REPOs refers to.'''
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import zlib
+from argparse import ArgumentParser
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import mkstemp
+from threading import Lock, local
+from time import time
+
+MAGIC = 'confcollect-artifact'
+CHUNK_SIZE = 1024 * 1024      # bytes; the largest chunk
+MIN_CHUNK = 64 * 1024         # bytes; no line ends looked at before this
+LINE_MASK = 0x1fff            # a line ends a chunk 1 time in 8192
+MIN_SIZE = 1024 * 1024
+LEVEL = 6
+POINTER_MAX = 1024 * 1024     # bytes; larger blobs are not pointers
+BINARY_PEEK = 8000            # bytes checked for NUL, as git does
+MIN_AGE = 24.                 # hours before gc may delete a new chunk
+
+# First byte of a stored chunk
+ZLIB = b'Z'
+STORED = b'-'  # compression did not help
+
+_CURRENT = local()
+_STORES = {}
+_STORES_LOCK = Lock()
+
+
+def pointer_bytes(pointer):
+    '''Serialize a pointer as its file content, MAGIC first.'''
+    keys = [MAGIC, 'sha256', 'size', 'chunks']
+    return (json.dumps(OrderedDict((key, pointer[key]) for key in keys),
+                       indent=1) + '\n').encode()
+
+
+def read_pointer(data):
+    '''The pointer dict in data (bytes), or None if data is not one.'''
+    if len(data) > POINTER_MAX or MAGIC.encode() not in data[:200]:
+        return None
+    try:
+        pointer = json.loads(data.decode('utf-8'))
+    except ValueError:
+        return None
+    if not isinstance(pointer, dict) or pointer.get(MAGIC) != 1:
+        return None
+    return pointer
+
+
+def is_binary(fname):
+    '''True when fname has a NUL byte near its start.'''
+    with open(fname, 'rb') as filep:
+        return b'\0' in filep.read(BINARY_PEEK)
+
+
+class ArtifactStore():
+    '''Chunks under root/chunks/<2 hex digits>/<sha256>.'''
+
+    def __init__(self, root, chunk_size=CHUNK_SIZE, level=LEVEL,
+                 min_chunk=MIN_CHUNK, mask=LINE_MASK):
+        self.root = os.path.realpath(root)
+        self.chunk_dir = os.path.join(self.root, 'chunks')
+        self.chunk_size = chunk_size
+        self.min_chunk = min_chunk
+        self.mask = mask
+        self.level = level
+        self.lock = Lock()
+        self.stats = {'files': 0, 'bytes': 0, 'chunks_new': 0,
+                      'chunks_reused': 0, 'stored_bytes': 0}
+
+    def chunk_path(self, digest):
+        '''Where the chunk with digest lives.'''
+        return os.path.join(self.chunk_dir, digest[:2], digest)
+
+    def put_chunk(self, data):
+        '''Store data, unless a chunk with the same content is there
+        already. Return its digest.'''
+        digest = hashlib.sha256(data).hexdigest()
+        fname = self.chunk_path(digest)
+        try:
+            os.utime(fname)  # in use again; keep gc's hands off it
+        except FileNotFoundError:
+            pass
+        else:
+            with self.lock:
+                self.stats['chunks_reused'] += 1
+            return digest
+
+        packed = zlib.compress(data, self.level)
+        packed = ZLIB + packed if len(packed) < len(data) else STORED + data
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        fdesc, tmpname = mkstemp(dir=os.path.dirname(fname),
+                                 prefix='.%s.' % digest[:8], suffix='.tmp')
+        try:
+            with os.fdopen(fdesc, 'wb') as filep:
+                filep.write(packed)
+            os.replace(tmpname, fname)
+        except BaseException:
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            raise
+        with self.lock:
+            self.stats['chunks_new'] += 1
+            self.stats['stored_bytes'] += len(packed)
+        return digest
+
+    def get_chunk(self, digest):
+        '''The content of a chunk. Raise ValueError if it is damaged.'''
+        with open(self.chunk_path(digest), 'rb') as filep:
+            packed = filep.read()
+        data = zlib.decompress(packed[1:]) if packed[:1] == ZLIB \
+            else packed[1:]
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError('chunk %s is damaged' % digest)
+        return data
+
+    def cut(self, data):
+        '''Where the chunk starting data ends: after the first line,
+        past min_chunk bytes, whose crc32 has no bits of mask set.
+        None if there is no such line in the first chunk_size bytes.'''
+        end = data.find(b'\n', self.min_chunk - 1, self.chunk_size)
+        while end != -1:
+            start = data.rfind(b'\n', 0, end) + 1
+            if not zlib.crc32(data[start:end]) & self.mask:
+                return end + 1
+            end = data.find(b'\n', end + 1, self.chunk_size)
+        return None
+
+    def split(self, filep):
+        '''Yield the chunks of the binary file filep. Boundaries only
+        depend on the content since the previous one, so they line up
+        again shortly after an edit.'''
+        data = b''
+        eof = False
+        while data or not eof:
+            if not eof and len(data) < self.chunk_size:
+                more = filep.read(self.chunk_size)
+                eof = not more
+                data += more
+                continue
+            end = self.cut(data) or self.chunk_size
+            yield data[:end]
+            data = data[end:]
+
+    def put_file(self, fname):
+        '''Store the content of fname in chunks; return its pointer.'''
+        digest = hashlib.sha256()
+        chunks = []
+        size = 0
+        with open(fname, 'rb') as filep:
+            for data in self.split(filep):
+                digest.update(data)
+                size += len(data)
+                chunks.append(self.put_chunk(data))
+        with self.lock:
+            self.stats['files'] += 1
+            self.stats['bytes'] += size
+        return {MAGIC: 1, 'sha256': digest.hexdigest(), 'size': size,
+                'chunks': chunks}
+
+    def restore(self, pointer, filep):
+        '''Write the content behind pointer to the binary file filep.
+        Raise ValueError if it does not match the pointer.'''
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in pointer['chunks']:
+            data = self.get_chunk(chunk)
+            digest.update(data)
+            size += len(data)
+            filep.write(data)
+        if size != pointer['size'] or digest.hexdigest() != pointer['sha256']:
+            raise ValueError('content does not match pointer %s' %
+                             pointer['sha256'])
+
+    def chunks(self):
+        '''Yield (digest, path) of every stored chunk.'''
+        if not os.path.isdir(self.chunk_dir):
+            return
+        for prefix in sorted(os.listdir(self.chunk_dir)):
+            dirname = os.path.join(self.chunk_dir, prefix)
+            for name in sorted(os.listdir(dirname)):
+                if not name.startswith('.'):
+                    yield name, os.path.join(dirname, name)
+
+    def gc(self, referenced, min_age=MIN_AGE, dry_run=False):
+        '''Delete chunks not in referenced and older than min_age
+        hours. Return (chunks kept, chunks removed, bytes freed).'''
+        cutoff = time() - min_age * 3600.
+        kept = removed = freed = 0
+        for digest, fname in self.chunks():
+            stat = os.stat(fname)
+            if digest in referenced or stat.st_mtime > cutoff:
+                kept += 1
+                continue
+            removed += 1
+            freed += stat.st_size
+            if not dry_run:
+                os.unlink(fname)
+        return kept, removed, freed
+
+
+def open_store(root):
+    '''The ArtifactStore for root, shared by every job of the run.'''
+    key = os.path.realpath(root)
+    with _STORES_LOCK:
+        if key not in _STORES:
+            _STORES[key] = ArtifactStore(key)
+        return _STORES[key]
+
+
+def stats():
+    '''Counters summed over the stores used this run, or None.'''
+    with _STORES_LOCK:
+        stores = list(_STORES.values())
+    if not stores:
+        return None
+    return dict((key, sum(store.stats[key] for store in stores))
+                for key in stores[0].stats)
+
+
+def pop_store(kwargs):
+    '''Remove the artifact settings from a job's kwargs and return
+    (store root, min size), or None. Raise ValueError on bad ones.'''
+    root = kwargs.pop('artifact_store', None)
+    min_size = kwargs.pop('artifact_min_size', MIN_SIZE)
+    if root is None:
+        return None
+    if not isinstance(min_size, int) or min_size < 0:
+        raise ValueError('artifact_min_size must be a whole number of '
+                         'bytes')
+    return root, min_size
+
+
+@contextmanager
+def job_store(settings):
+    '''Make settings (from pop_store()) the current job's.'''
+    previous = getattr(_CURRENT, 'settings', None)
+    _CURRENT.settings = settings
+    try:
+        yield
+    finally:
+        _CURRENT.settings = previous
+
+
+def store_for(fname, size):
+    '''The ArtifactStore the current job puts fname (of size bytes) in,
+    or None when fname belongs in the repo as it is.'''
+    settings = getattr(_CURRENT, 'settings', None)
+    if settings is None:
+        return None
+    root, min_size = settings
+    if size < min_size and not is_binary(fname):
+        return None
+    return open_store(root)
+
+
+# Command line ######################################################
+
+def git_pointers(repo_dir):
+    '''Yield the pointers in every blob of repo_dir's object database
+    (all commits, reachable or not) small enough to be one.'''
+    check = subprocess.run(
+        ['git', '-C', repo_dir, 'cat-file', '--batch-all-objects',
+         '--batch-check=%(objectname) %(objecttype) %(objectsize)'],
+        stdout=subprocess.PIPE, check=True).stdout.decode()
+    blobs = [line.split()[0] for line in check.splitlines()
+             if line.split()[1] == 'blob' and
+             int(line.split()[2]) <= POINTER_MAX]
+    if not blobs:
+        return
+    with subprocess.Popen(['git', '-C', repo_dir, 'cat-file', '--batch'],
+                          stdin=subprocess.PIPE,
+                          stdout=subprocess.PIPE) as proc:
+        # One object at a time, so neither pipe can fill up
+        for name in blobs:
+            proc.stdin.write(name.encode() + b'\n')
+            proc.stdin.flush()
+            header = proc.stdout.readline().split()
+            data = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)  # newline after each object
+            pointer = read_pointer(data)
+            if pointer is not None:
+                yield pointer
+        proc.stdin.close()
+
+
+def tree_pointers(top):
+    '''Yield (path, pointer) for the pointer files under top (a file or
+    directory), skipping .git.'''
+    if not os.path.isdir(top):
+        walk = [(os.path.dirname(top), [], [os.path.basename(top)])]
+    else:
+        walk = os.walk(top)
+    for root, dirs, files in walk:
+        if '.git' in dirs:
+            dirs.remove('.git')
+        for name in files:
+            fname = os.path.join(root, name)
+            if os.path.getsize(fname) > POINTER_MAX:
+                continue
+            with open(fname, 'rb') as filep:
+                pointer = read_pointer(filep.read())
+            if pointer is not None:
+                yield fname, pointer
+
+
+def restore_cmd(args):
+    '''Write the content behind pointers to stdout or under --output.'''
+    store = ArtifactStore(args.store)
+    pointers = []
+    for top in args.pointers:
+        if top == '-':
+            pointer = read_pointer(sys.stdin.buffer.read())
+            if pointer is None:
+                sys.exit('stdin is not an artifact pointer')
+            pointers.append(('stdin', pointer))
+        else:
+            base = top if os.path.isdir(top) else os.path.dirname(top)
+            pointers.extend((os.path.relpath(fname, base), pointer)
+                            for fname, pointer in tree_pointers(top))
+    if args.output in (None, '-'):
+        if len(pointers) != 1:
+            sys.exit('found %i pointers; give --output DIR to restore '
+                     'more than one' % len(pointers))
+        store.restore(pointers[0][1], sys.stdout.buffer)
+        return
+
+    for relpath, pointer in pointers:
+        dest = os.path.join(args.output, relpath)
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        with open(dest, 'wb') as filep:
+            store.restore(pointer, filep)
+        print('%s (%i bytes)' % (dest, pointer['size']))
+
+
+def gc_cmd(args):
+    '''Delete the chunks no pointer in args.repos refers to.'''
+    referenced = set()
+    for repo_dir in args.repos:
+        for pointer in git_pointers(repo_dir):
+            referenced.update(pointer['chunks'])
+        for _, pointer in tree_pointers(repo_dir):
+            referenced.update(pointer['chunks'])
+    kept, removed, freed = ArtifactStore(args.store).gc(
+        referenced, args.min_age, args.dry_run)
+    print('%s %i chunks (%.1f MiB); kept %i.' % (
+        'Would remove' if args.dry_run else 'Removed', removed,
+        freed / 1048576., kept))
+
+
+def get_arguments():
+    '''Get/set command-line options'''
+    parser = ArgumentParser()
+    sub = parser.add_subparsers(dest='command')
+
+    restore = sub.add_parser('restore', help='Write out stored content.')
+    restore.add_argument('--store', required=True,
+                         help='Artifact store directory.')
+    restore.add_argument('-o', '--output', default=None,
+                         help='Directory to restore into; stdout (one '
+                         'pointer only) by default.')
+    restore.add_argument('pointers', nargs='+', metavar='POINTER',
+                         help='Pointer file, directory, or - for stdin.')
+    restore.set_defaults(func=restore_cmd)
+
+    gc = sub.add_parser('gc', help='Delete unreferenced chunks.')
+    gc.add_argument('--store', required=True,
+                    help='Artifact store directory.')
+    gc.add_argument('--min-age', type=float, default=MIN_AGE,
+                    help='Keep chunks younger than this many hours, '
+                    'which a running getconfs may be about to point to. '
+                    'Default: %g.' % MIN_AGE)
+    gc.add_argument('-n', '--dry-run', action='store_true',
+                    help='Only say what would be removed.')
+    gc.add_argument('repos', nargs='+', metavar='REPO',
+                    help='Every git repo pointing into the store.')
+    gc.set_defaults(func=gc_cmd)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a command is required')
+    return args
+
+
+def main():
+    '''Run a command.'''
+    args = get_arguments()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
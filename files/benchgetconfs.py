@@ -0,0 +1,1493 @@
+#!/usr/bin/env python3
+''' benchgetconfs.py
+
+    Benchmarks for getconfs internals. Not deployed by Puppet; run by
+    hand from a checkout, e.g.
+
+        python3 files/benchgetconfs.py farm --jobs 1000 --threads 8 32
+
+    Each case runs in a child interpreter so peak RSS is measured per
+    case rather than accumulated across cases. These only measure;
+    correctness checks are in tests/ (python3 -m pytest tests).'''
+
+import json
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from os import listdir, path
+from resource import getrusage, RUSAGE_SELF
+
+sys.path.insert(0, path.dirname(path.abspath(__file__)))
+
+
+def peak_rss_kib():
+    '''Peak resident set size of this process, in KiB (Linux).'''
+    return getrusage(RUSAGE_SELF).ru_maxrss
+
+
+def run_case(argv):
+    '''Run one benchmark case in a child interpreter and return the
+    dict it prints as JSON.'''
+    output = subprocess.check_output(
+        [sys.executable, path.abspath(__file__), 'case'] + argv)
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def print_table(header, rows):
+    '''Print rows of dicts as an aligned text table.'''
+    widths = [max(len(str(col)), *[len(str(row[col])) for row in rows])
+              for col in header]
+    print('  '.join(str(col).rjust(wid) for col, wid in zip(header, widths)))
+    for row in rows:
+        print('  '.join(str(row[col]).rjust(wid)
+                        for col, wid in zip(header, widths)))
+
+
+# Startup #########################################################
+
+def startup_case(args):
+    '''Time a fresh interpreter from start to its first job dispatch,
+    importing every collector up front (eager) or through the registry
+    (lazy).'''
+    from collectregistry import COLLECTORS, DEFAULT_COLLECTOR
+
+    here = path.dirname(path.abspath(__file__))
+    imports = ''
+    if args.mode == 'eager':
+        modules = {module for _, module, _ in COLLECTORS}
+        modules.add(DEFAULT_COLLECTOR[0])
+        imports = ''.join('import %s; ' % name for name in sorted(modules))
+    code = ('import sys; sys.path.insert(0, %r); %s'
+            'import getconfs; '
+            'getconfs.get_collector({"device_type": %r})' % (
+                here, imports, args.device_type))
+
+    times = []
+    for _ in range(args.njobs):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', code])
+        times.append(time.time() - start)
+    times.sort()
+    return {'mode': args.mode,
+            'device_type': args.device_type,
+            'runs': args.njobs,
+            'median_ms': round(times[len(times) // 2] * 1000., 1)}
+
+
+def bench_startup(args):
+    '''Compare eager and lazy collector imports.'''
+    rows = []
+    for device_type in args.device_types:
+        for mode in ('eager', 'lazy'):
+            rows.append(run_case(['startup', '--mode', mode,
+                                  '--device-type', device_type,
+                                  '--njobs', str(args.runs)]))
+    print_table(('mode', 'device_type', 'runs', 'median_ms'), rows)
+
+
+# Logging #########################################################
+
+def legacy_setup_logger(logger_name, log_file, level):
+    '''The FileHandler-per-host setup_logger() that somtsfilelog used to
+    provide, for comparison.'''
+    import logging
+    from somtsfilelog import FORMAT
+
+    logger = logging.getLogger(logger_name)
+    file_handler = logging.FileHandler(log_file, mode='a')
+    file_handler.setFormatter(logging.Formatter(FORMAT))
+    logger.setLevel(level)
+    logger.addHandler(file_handler)
+    return logger
+
+
+def logging_case(args):
+    '''Log like a run of collector jobs: one logger per host, a BEGIN,
+    some debug chatter and an END per job.'''
+    import logging
+    from multiprocessing.dummy import Pool
+    from tempfile import TemporaryDirectory
+    import somtsfilelog
+
+    if args.mode == 'legacy':
+        setup = legacy_setup_logger
+    else:
+        setup = somtsfilelog.setup_logger
+
+    def job(num):
+        host = 'host%i' % num
+        logger = setup('bench_%s' % host,
+                       path.join(log_dir, 'bench.%s.log' % host),
+                       level=logging.DEBUG)
+        logger.info('BEGIN %s', host)
+        for line in range(args.lines):
+            logger.debug('Line %i from %s', line, host)
+        logger.info('END %s', host)
+        return len(listdir('/proc/self/fd'))
+
+    with TemporaryDirectory() as log_dir:
+        start = time.time()
+        pool = Pool(processes=args.threads)
+        fds = pool.map(job, range(args.njobs))
+        pool.close()
+        pool.join()
+        if args.mode != 'legacy':
+            somtsfilelog.stop()  # include draining the queue
+        wall = time.time() - start
+    return {'mode': args.mode,
+            'jobs': args.njobs,
+            'us_per_job': round(wall / args.njobs * 1e6, 1),
+            'max_fds': max(fds)}
+
+
+def bench_logging(args):
+    '''Compare per-host FileHandlers with the queue pipeline.'''
+    rows = []
+    for njobs in args.jobs:
+        for mode in ('legacy', 'queue'):
+            rows.append(run_case(['logging', '--mode', mode,
+                                  '--njobs', str(njobs),
+                                  '--threads', str(args.threads),
+                                  '--lines', str(args.lines)]))
+    print_table(('mode', 'jobs', 'us_per_job', 'max_fds'), rows)
+
+
+# Stand-in farm ###################################################
+
+# device_type -> extra getconfs.json settings, using standins.py ports
+FARM_DEVICES = {
+    'cisco_ios': {'port': 2222},
+    'cisco_iossshcmd': {'port': 2222,
+                        'commands': ['show version', 'show ip route']},
+    'qflex': {'port': 2223, 'global_delay_factor': 1},
+    'advantech': {'port': 8080},
+    'pepperlfuchs': {'port': 8080},
+    'pfsense': {'port': 8443, 'username': 'admin', 'password': 'pw'},
+    'peplink': {'port': 8443, 'delay_days': 0,
+                'username': 'admin', 'password': 'pw'},
+    'mediacento': {'port': 2424},
+}
+
+
+def farm_config(workdir, njobs, device_types):
+    '''Write a getconfs.json for njobs stand-in devices, cycling through
+    device_types, each on its own loopback address. Return its path.'''
+    from os import makedirs
+
+    repo = path.join(workdir, 'repo')
+    config = {'DEFAULT': {'repo_dir': repo,
+                          'log_dir': path.join(workdir, 'logs')}}
+    makedirs(path.join(workdir, 'logs'), exist_ok=True)
+    makedirs(path.join(repo, '.git'), exist_ok=True)
+
+    for num in range(njobs):
+        device_type = device_types[num % len(device_types)]
+        section = 'dev%05i' % num
+        dest = path.join(repo, section)
+        makedirs(path.join(dest, 'txt'), exist_ok=True)
+        config[section] = dict(FARM_DEVICES[device_type],
+                               host='127.10.%i.%i' % (num // 250,
+                                                      num % 250 + 2),
+                               device_type=device_type,
+                               destination_dir=dest)
+
+    fname = path.join(workdir, 'getconfs.json')
+    with open(fname, 'w') as filep:
+        json.dump(config, filep, indent=1)
+    return fname
+
+
+def percentile(values, pct):
+    '''Nearest-rank percentile of a list of numbers.'''
+    if not values:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100. *
+                                                 (len(values) - 1))))]
+
+
+def getconfs_case(args):
+    '''Run getconfs.main() on a farm config and summarize its report.'''
+    import getconfs
+
+    report = path.join(path.dirname(args.json), 'report.%i.jsonl' %
+                       args.threads)
+    argv = ['getconfs', '--json', args.json, '--threads', str(args.threads),
+            '--logdir', path.join(path.dirname(args.json), 'logs'),
+            '--report', report]
+    sys.argv = argv
+    start = time.time()
+    getconfs.main()
+    wall = time.time() - start
+
+    durations = []
+    failed = 0
+    with open(report) as filep:
+        for line in filep:
+            rec = json.loads(line)
+            if rec.get('type') == 'summary':
+                continue
+            durations.append(rec['duration'])
+            failed += rec['outcome'] != 'ok'
+    return {'threads': args.threads,
+            'jobs': len(durations),
+            'failed': failed,
+            'jobs_per_s': round(len(durations) / wall, 1),
+            'p50_s': round(percentile(durations, 50), 3),
+            'p99_s': round(percentile(durations, 99), 3),
+            'rss_mib': round(peak_rss_kib() / 1024., 1)}
+
+
+def bench_farm(args):
+    '''Run getconfs against standins.py at several --threads values.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve',
+         '--latency', str(args.latency),
+         '--payload-size', str(args.payload_size)],
+        stdout=subprocess.PIPE)
+    workdir = mkdtemp(prefix='getconfs-farm.')
+    # The stand-ins use self-signed certificates; keep a CA bundle in
+    # the environment from overriding the collectors' verify=False.
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        config = farm_config(workdir, args.jobs, args.device_types)
+        rows = [run_case(['getconfs', '--json', config,
+                          '--threads', str(threads)])
+                for threads in args.threads]
+    finally:
+        standins.terminate()
+        standins.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print('Farm output kept in %s' % workdir)
+    print_table(('threads', 'jobs', 'failed', 'jobs_per_s',
+                 'p50_s', 'p99_s', 'rss_mib'), rows)
+
+
+# Sort ##############################################################
+
+def legacy_sort(fname):
+    '''The in-memory sort collectscp used to do, for comparison.'''
+    with open(fname, 'r+') as filep:
+        sortf = sorted(filep)
+        filep.seek(0)
+        filep.writelines(sortf)
+        filep.truncate()
+
+
+def write_esx_conf(fname, size):
+    '''Write about size bytes of esx.conf-like lines in random order.'''
+    import random
+
+    rand = random.Random(size)
+    written = 0
+    with open(fname, 'w') as filep:
+        while written < size:
+            line = '/adv/%s/%08x/value = "%x"\n' % (
+                rand.choice(('Net', 'Disk', 'Mem', 'UserVars', 'Misc')),
+                rand.getrandbits(32), rand.getrandbits(48))
+            filep.write(line)
+            written += len(line)
+
+
+def sort_case(args):
+    '''Sort one file in place with the legacy or external sort.'''
+    import extsort
+
+    start = time.time()
+    if args.mode == 'legacy':
+        legacy_sort(args.file)
+        runs = '-'
+    else:
+        runs = extsort.sort_file(args.file,
+                                 args.buffer_mib * 1024 * 1024)
+    return {'mode': args.mode,
+            'size_mib': round(path.getsize(args.file) / 1048576.),
+            'runs': runs,
+            'wall_s': round(time.time() - start, 2),
+            'rss_mib': round(peak_rss_kib() / 1024., 1)}
+
+
+def bench_sort(args):
+    '''Compare peak memory of the in-memory and external sorts.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    workdir = mkdtemp(prefix='getconfs-sort.', dir=args.dir)
+    rows = []
+    try:
+        for size in args.sizes:
+            source = path.join(workdir, 'source.%i' % size)
+            target = path.join(workdir, 'esx.conf')
+            write_esx_conf(source, size * 1024 * 1024)
+            for mode in args.modes:
+                shutil.copyfile(source, target)
+                rows.append(run_case(['sort', '--mode', mode,
+                                      '--file', target,
+                                      '--buffer-mib',
+                                      str(args.buffer_mib)]))
+            os.unlink(source)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print_table(('mode', 'size_mib', 'runs', 'wall_s', 'rss_mib'), rows)
+
+
+# HTTP bodies #######################################################
+
+# device_type -> (cfgworker kwargs, stand-in URL, body is text)
+HTTP_DEVICES = {
+    'advantech': ({'port': 8080},
+                  'http://127.0.0.1:8080/cgi-bin/result.cgi?types=export',
+                  True),
+    'pepperlfuchs': ({'port': 8080},
+                     'http://127.0.0.1:8080/goforms/ConfigGet', True),
+    'urlget': ({'port': 8080, 'urlpath': '/goforms/ConfigGet'},
+               'http://127.0.0.1:8080/goforms/ConfigGet', False),
+    'peplink': ({'port': 8443, 'delay_days': 0},
+                'https://127.0.0.1:8443/cgi-bin/MANGA/', False),
+}
+
+
+def legacy_http_fetch(url, text, fname):
+    '''Fetch a whole body and write it, as the HTTP collectors used
+    to, for comparison.'''
+    import requests
+    from confoutput import write_output
+
+    if url.endswith('/MANGA/'):
+        with requests.Session() as session:
+            session.post(url + 'api.cgi', data={'func': 'login'},
+                         verify=False)
+            data = session.get(url + 'download_config.cgi',
+                               verify=False).content
+    else:
+        response = requests.get(url, timeout=(18.5, 90.5))
+        data = response.text.encode('utf-8') if text else response.content
+    write_output(fname, data)
+
+
+def http_case(args):
+    '''Fetch one large body with a legacy or streaming collector.'''
+    import logging
+    from importlib import import_module
+
+    kwargs, url, text = HTTP_DEVICES[args.device_type]
+    start = time.time()
+    if args.mode == 'legacy':
+        legacy_http_fetch(url, text, path.join(args.file, 'legacy.out'))
+    else:
+        import freshness
+
+        # As getconfs does: freshness settings become the job's policy
+        kwargs = dict(kwargs)
+        collector = import_module('collect' + args.device_type)
+        with freshness.job_policy(freshness.pop_policy(kwargs)):
+            collector.cfgworker('127.0.0.1', logging.INFO,
+                                destination_dir=args.file,
+                                log_dir=args.file, **kwargs)
+    written = sum(path.getsize(path.join(args.file, name))
+                  for name in listdir(args.file)
+                  if not name.endswith('.log'))
+    return {'device_type': args.device_type,
+            'mode': args.mode,
+            'body_mib': round(written / 1048576., 1),
+            'wall_s': round(time.time() - start, 2),
+            'rss_mib': round(peak_rss_kib() / 1024., 1)}
+
+
+def bench_http(args):
+    '''Compare peak memory of whole-body and streamed HTTP fetches.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve',
+         '--latency', '0', '--payload-size', str(args.size * 1024 * 1024)],
+        stdout=subprocess.PIPE)
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    rows = []
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        for device_type in args.device_types:
+            for mode in ('legacy', 'stream'):
+                workdir = mkdtemp(prefix='getconfs-http.')
+                try:
+                    rows.append(run_case(['http', '--mode', mode,
+                                          '--device-type', device_type,
+                                          '--file', workdir]))
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        standins.terminate()
+        standins.wait()
+    print_table(('device_type', 'mode', 'body_mib', 'wall_s', 'rss_mib'),
+                rows)
+
+
+# SSH command output ################################################
+
+def sshcmd_case(args):
+    '''Collect --commands commands' output from the SSH stand-in,
+    buffered by send_command(), streamed or batched.'''
+    import hashlib
+    import logging
+    import collectsshcmd
+    import sessionpool
+
+    start = time.time()
+    collectsshcmd.cfgworker('127.0.0.1', logging.INFO,
+                            device_type='cisco_ios', port=2222,
+                            destination_dir=args.file, log_dir=args.file,
+                            commands=['show command %i' % num
+                                      for num in range(args.commands)],
+                            stream_output=args.mode == 'stream',
+                            batch=args.mode == 'batch')
+    sessionpool.POOL.close_all()
+    fname = path.join(args.file, '127.txt')
+    digest = hashlib.sha256()
+    if not path.exists(fname):  # the collector logged why
+        return {'mode': args.mode, 'output_mib': 0, 'sha256': 'failed',
+                'wall_s': round(time.time() - start, 2),
+                'rss_mib': round(peak_rss_kib() / 1024., 1)}
+    with open(fname, 'rb') as filep:
+        for block in iter(lambda: filep.read(1048576), b''):
+            digest.update(block)
+    return {'mode': args.mode,
+            'output_mib': round(path.getsize(fname) / 1048576., 1),
+            'sha256': digest.hexdigest()[:12],
+            'wall_s': round(time.time() - start, 2),
+            'rss_mib': round(peak_rss_kib() / 1024., 1)}
+
+
+def bench_sshcmd(args):
+    '''Compare peak memory of buffered and streamed collectsshcmd
+    output as the output grows; both must write the same file.'''
+    import shutil
+    from tempfile import mkdtemp
+
+    rows = []
+    for size in args.sizes:
+        standins = subprocess.Popen(
+            [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                       'standins.py'), 'serve',
+             '--latency', '0', '--payload-size', str(size * 1024 * 1024)],
+            stdout=subprocess.PIPE)
+        try:
+            if standins.stdout.readline().strip() != b'READY':
+                sys.exit('stand-ins failed to start')
+            for mode in ('legacy', 'stream'):
+                workdir = mkdtemp(prefix='getconfs-sshcmd.')
+                try:
+                    rows.append(dict(run_case(['sshcmd', '--mode', mode,
+                                               '--file', workdir]),
+                                     command_mib=size))
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+        finally:
+            standins.terminate()
+            standins.wait()
+    print_table(('command_mib', 'mode', 'output_mib', 'sha256', 'wall_s',
+                 'rss_mib'), rows)
+
+
+def bench_batch(args):
+    '''Time a job of --commands commands, sent one at a time with
+    send_command(), streamed, and batched into one write, against the
+    SSH stand-in at each --rtts round-trip time.'''
+    import shutil
+    from tempfile import mkdtemp
+
+    rows = []
+    for rtt in args.rtts:
+        standins = subprocess.Popen(
+            [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                       'standins.py'), 'serve',
+             '--latency', str(rtt), '--payload-size', str(args.payload_size)],
+            stdout=subprocess.PIPE)
+        try:
+            if standins.stdout.readline().strip() != b'READY':
+                sys.exit('stand-ins failed to start')
+            # Logging in and session setup, without commands
+            workdir = mkdtemp(prefix='getconfs-batch.')
+            try:
+                login = run_case(['sshcmd', '--mode', 'legacy', '--file',
+                                  workdir, '--commands', '0'])['wall_s']
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+            for mode in ('legacy', 'stream', 'batch'):
+                workdir = mkdtemp(prefix='getconfs-batch.')
+                try:
+                    row = run_case(['sshcmd', '--mode', mode, '--file',
+                                    workdir, '--commands', str(args.commands)])
+                finally:
+                    shutil.rmtree(workdir, ignore_errors=True)
+                rows.append(dict(row, rtt_ms=int(rtt * 1000), login_s=login,
+                                 commands_s=round(row['wall_s'] - login, 2)))
+        finally:
+            standins.terminate()
+            standins.wait()
+    print_table(('rtt_ms', 'mode', 'sha256', 'login_s', 'commands_s',
+                 'wall_s'), rows)
+
+
+# Resource groups ###################################################
+
+def blocking_groups():
+    '''Make getconfs enforce resource group caps the naive way, with a
+    semaphore per group taken inside the worker thread, for
+    comparison.'''
+    import threading
+    import getconfs
+
+    semaphores = {}
+    worker = getconfs.worker_wrapper
+    run_jobs = getconfs.run_jobs
+
+    def blocking_worker(job):
+        held = []
+        try:
+            for group in job[2]['groups']:
+                held.append(semaphores.setdefault(
+                    group.name, threading.Semaphore(group.max_jobs or 1 << 30)))
+                held[-1].acquire()
+            return worker(job)
+        finally:
+            for semaphore in held:
+                semaphore.release()
+
+    getconfs.worker_wrapper = blocking_worker
+    getconfs.run_jobs = lambda *args, **kwargs: run_jobs(
+        *args, **dict(kwargs, scheduler=None))
+
+
+def group_stats(report, groups):
+    '''Per-group cap, peak overlap, throughput and finish time from a
+    run report, checked against the limits in groups.'''
+    jobs = []
+    with open(report) as filep:
+        for line in filep:
+            rec = json.loads(line)
+            if rec.get('type') != 'summary':
+                jobs.append(rec)
+    run_start = min(rec['started'] for rec in jobs)
+
+    rows = []
+    names = sorted(groups) + [None]
+    for name in names:
+        recs = [rec for rec in jobs if (name in rec['resource_groups']
+                                        if name else
+                                        not rec['resource_groups'])]
+        if not recs:
+            continue
+        events = sorted([(rec['started'], 1) for rec in recs] +
+                        [(rec['started'] + rec['duration'], -1)
+                         for rec in recs], key=lambda ev: (ev[0], ev[1]))
+        running = peak = 0
+        for _, step in events:
+            running += step
+            peak = max(peak, running)
+        first = min(rec['started'] for rec in recs)
+        last = max(rec['started'] + rec['duration'] for rec in recs)
+        limits = groups.get(name, {})
+        rate = sum(rec['bytes'] for rec in recs) / max(last - first, 1e-6)
+        rate_ok = '-'
+        if limits.get('bytes_per_sec'):
+            # The bucket starts full, so allow one burst above the rate
+            allowed = limits['bytes_per_sec'] * (1 + 1. / (last - first))
+            rate_ok = 'yes' if rate <= allowed * 1.05 else 'NO'
+        rows.append({'group': name or '(none)',
+                     'jobs': len(recs),
+                     'failed': sum(rec['outcome'] != 'ok' for rec in recs),
+                     'max_jobs': limits.get('max_jobs', '-'),
+                     'peak': peak,
+                     'cap_ok': ('yes' if peak <= limits.get('max_jobs', peak)
+                                else 'NO'),
+                     'kib_per_s': round(rate / 1024., 1),
+                     'limit_kib_s': (round(limits['bytes_per_sec'] / 1024., 1)
+                                     if limits.get('bytes_per_sec') else '-'),
+                     'rate_ok': rate_ok,
+                     'done_s': round(last - run_start, 2)})
+    return rows
+
+
+def groups_case(args):
+    '''Run getconfs.main() on a farm config with resource groups.'''
+    import getconfs
+
+    if args.mode == 'blocking':
+        blocking_groups()
+    with open(args.json) as filep:
+        groups = json.load(filep)['RESOURCE_GROUPS']
+    report = path.join(path.dirname(args.json), 'report.%s.jsonl' %
+                       args.mode)
+    sys.argv = ['getconfs', '--json', args.json,
+                '--threads', str(args.threads), '--order', 'config',
+                '--logdir', path.join(path.dirname(args.json), 'logs'),
+                '--history', path.join(path.dirname(args.json),
+                                       'history.%s.json' % args.mode),
+                '--report', report]
+    start = time.time()
+    getconfs.main()
+    return {'wall_s': round(time.time() - start, 2),
+            'rows': group_stats(report, groups)}
+
+
+def bench_groups(args):
+    '''Run a farm where some devices sit behind a capped, slow link
+    and others behind a capped auth server, listed first so a naive
+    scheduler fills every thread with them. Check the caps and rate
+    held, and compare how soon the ungrouped devices finish with the
+    scheduler and with per-group semaphores.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve',
+         '--latency', str(args.latency),
+         '--payload-size', str(args.payload_size)],
+        stdout=subprocess.PIPE)
+    workdir = mkdtemp(prefix='getconfs-groups.')
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        # satlink: HTTP devices; tacacs: SSH/SCP devices; then ungrouped
+        device_types = (['advantech'] * args.link_jobs +
+                        ['cisco_ios'] * args.auth_jobs +
+                        ['pepperlfuchs'] * args.free_jobs)
+        config = farm_config(workdir, len(device_types), device_types)
+        with open(config) as filep:
+            settings = json.load(filep)
+        settings['RESOURCE_GROUPS'] = {
+            'satlink': {'max_jobs': args.link_max_jobs,
+                        'bytes_per_sec': args.link_rate},
+            'tacacs': {'max_jobs': args.auth_max_jobs}}
+        settings['DEFAULT']['freshness'] = 'always'  # both modes fetch
+        for section, job in settings.items():
+            group = {'advantech': 'satlink',
+                     'cisco_ios': 'tacacs'}.get(job.get('device_type'))
+            if group:
+                job['resource_groups'] = [group]
+        with open(config, 'w') as filep:
+            json.dump(settings, filep, indent=1)
+
+        rows = []
+        for mode in ('scheduler', 'blocking'):
+            result = run_case(['groups', '--mode', mode, '--json', config,
+                               '--threads', str(args.threads)])
+            for row in result['rows']:
+                rows.append(dict(row, mode=mode, wall_s=result['wall_s']))
+    finally:
+        standins.terminate()
+        standins.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print('Farm output kept in %s' % workdir)
+    print_table(('mode', 'group', 'jobs', 'failed', 'max_jobs', 'peak',
+                 'cap_ok', 'kib_per_s', 'limit_kib_s', 'rate_ok', 'done_s',
+                 'wall_s'), rows)
+    if any('NO' in (row['cap_ok'], row['rate_ok']) for row in rows):
+        sys.exit('A resource group limit was exceeded.')
+
+
+# DNS ###############################################################
+
+def slow_resolver(hosts_file, latency):
+    '''A getaddrinfo() that answers the names in hosts_file after
+    latency seconds, like a slow shipboard resolver.'''
+    import socket
+
+    with open(hosts_file) as filep:
+        hosts = json.load(filep)
+    real = socket.getaddrinfo
+
+    def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+        if host in hosts or str(host).endswith('.invalid'):
+            time.sleep(latency)
+            if host not in hosts:
+                raise socket.gaierror(socket.EAI_NONAME,
+                                      'Name or service not known')
+            return real(hosts[host], port, family, type, proto,
+                        flags | socket.AI_NUMERICHOST)
+        return real(host, port, family, type, proto, flags)
+    return getaddrinfo
+
+
+def dns_case(args):
+    '''Run getconfs.main() on a farm of named devices behind a slow
+    resolver, resolving once up front (cached) or in every job and
+    library call (legacy).'''
+    import socket
+    import getconfs
+    import resolver
+
+    slow = slow_resolver(args.file, args.latency)
+    resolver._GETADDRINFO = slow
+    if args.mode == 'legacy':
+        socket.getaddrinfo = slow
+
+    report = path.join(path.dirname(args.json), 'report.%s.jsonl' %
+                       args.mode)
+    sys.argv = ['getconfs', '--json', args.json,
+                '--threads', str(args.threads), '--order', 'config',
+                '--logdir', path.join(path.dirname(args.json), 'logs'),
+                '--history', path.join(path.dirname(args.json),
+                                       'history.%s.json' % args.mode),
+                '--report', report]
+    if args.mode != 'legacy':
+        sys.argv.append('--pin-dns')
+    start = time.time()
+    getconfs.main()
+    wall = time.time() - start
+
+    dns = []
+    with open(report) as filep:
+        for line in filep:
+            rec = json.loads(line)
+            if rec.get('type') == 'summary':
+                summary = rec
+            else:
+                dns.append(rec['phases'].get('dns', 0.))
+    return {'mode': args.mode,
+            'jobs': summary['jobs'],
+            'failed': summary['failed'],
+            'unresolved': len(summary['unresolved']),
+            'dns_s_sum': round(sum(dns), 2),
+            'wall_s': round(wall, 2)}
+
+
+def bench_dns(args):
+    '''Compare per-job lookups with up-front resolution when every
+    lookup costs --resolver-latency.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve',
+         '--latency', str(args.latency)],
+        stdout=subprocess.PIPE)
+    workdir = mkdtemp(prefix='getconfs-dns.')
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        config = farm_config(workdir, args.jobs, args.device_types)
+        with open(config) as filep:
+            settings = json.load(filep)
+        hosts = {}
+        for section, job in list(settings.items()):
+            if 'host' in job:
+                name = '%s.farm.test' % section
+                hosts[name] = job['host']
+                job['host'] = name
+                job['freshness'] = 'always'
+        for num in range(args.bad_names):
+            settings['gone%i' % num] = dict(settings['dev00000'],
+                                            host='gone%i.invalid' % num)
+        with open(config, 'w') as filep:
+            json.dump(settings, filep, indent=1)
+        hosts_file = path.join(workdir, 'hosts.json')
+        with open(hosts_file, 'w') as filep:
+            json.dump(hosts, filep)
+
+        rows = [run_case(['dns', '--mode', mode, '--json', config,
+                          '--file', hosts_file,
+                          '--latency', str(args.resolver_latency),
+                          '--threads', str(args.threads)])
+                for mode in ('legacy', 'cached')]
+    finally:
+        standins.terminate()
+        standins.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print('Farm output kept in %s' % workdir)
+    print_table(('mode', 'jobs', 'failed', 'unresolved', 'dns_s_sum',
+                 'wall_s'), rows)
+
+
+# Post-processing offload ###########################################
+
+def offload_case(args):
+    '''Run getconfs.main() on a farm config with --cpu-workers set to
+    --concurrency, and summarize the run's stages.'''
+    import getconfs
+
+    report = path.join(path.dirname(args.json), 'report.%i.jsonl' %
+                       args.concurrency)
+    sys.argv = ['getconfs', '--json', args.json,
+                '--threads', str(args.threads), '--order', 'config',
+                '--preflight-timeout', '0',
+                '--cpu-workers', str(args.concurrency),
+                '--logdir', path.join(path.dirname(args.json), 'logs'),
+                '--history', path.join(path.dirname(args.json),
+                                       'history.%i.json' % args.concurrency),
+                '--report', report]
+    start = time.time()
+    getconfs.main()
+    wall = time.time() - start
+
+    http = []
+    with open(report) as filep:
+        for line in filep:
+            rec = json.loads(line)
+            if rec.get('type') == 'summary':
+                summary = rec
+            elif rec['device_type'] != 'cisco_ios':
+                http.append(rec['duration'])
+    row = {'cpu_workers': args.concurrency,
+           'failed': summary['failed'],
+           'http_p50_s': round(percentile(http, 50), 3),
+           'http_p99_s': round(percentile(http, 99), 3),
+           'wall_s': round(wall, 2)}
+    for stage, values in summary['stages'].items():
+        row['%s_mib_s' % stage] = values['mib_per_s']
+    return row
+
+
+def bench_offload(args):
+    '''Fetch over HTTP while SCP jobs sort large files, sorting in the
+    job threads or in the post-processing pool.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve',
+         '--latency', str(args.latency),
+         '--payload-size', str(args.payload_size)],
+        stdout=subprocess.PIPE)
+    workdir = mkdtemp(prefix='getconfs-offload.')
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        device_types = (['cisco_ios'] * args.sort_jobs +
+                        ['advantech', 'pepperlfuchs'] * (args.http_jobs // 2))
+        config = farm_config(workdir, len(device_types), device_types)
+        with open(config) as filep:
+            settings = json.load(filep)
+        settings['DEFAULT']['freshness'] = 'always'
+        for job in settings.values():
+            if job.get('device_type') == 'cisco_ios':
+                job['sort'] = True
+        with open(config, 'w') as filep:
+            json.dump(settings, filep, indent=1)
+
+        rows = [run_case(['offload', '--json', config,
+                          '--threads', str(args.threads),
+                          '--concurrency', str(workers)])
+                for workers in args.cpu_workers]
+    finally:
+        standins.terminate()
+        standins.wait()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+        else:
+            print('Farm output kept in %s' % workdir)
+    print_table(list(rows[0]), rows)
+
+
+# Normalization #####################################################
+
+# Filters for the lines standins.py --volatile varies
+CHURN_RULES = {
+    'cisco_ios': [{'drop': '^! Last configuration change at '},
+                  {'drop': '^ntp clock-period '}],
+    '*sshcmd': [{'drop': '^Uptime is '},
+                {'replace': '[0-9]+ packets input, [0-9]+ bytes',
+                 'with': 'N packets input, N bytes'}],
+    'pfsense': ['xml', {'drop': '^\t*<time>[0-9]+</time>$'}],
+}
+
+def churn_case(args):
+    '''Run getconfs.main() once on a farm config.'''
+    import getconfs
+
+    logs = path.join(path.dirname(args.json), 'logs')
+    report = path.join(logs, 'report.jsonl')
+    sys.argv = ['getconfs', '--json', args.json,
+                '--threads', str(args.threads), '--preflight-timeout', '0',
+                '--logdir', logs, '--report', report]
+    getconfs.main()
+    with open(report) as filep:
+        summary = json.loads(filep.readlines()[-1])
+    return {'failed': summary['failed'], 'changed': summary['changed']}
+
+
+def git(repo, *argv):
+    '''Run git in repo and return its output.'''
+    return subprocess.check_output(
+        ['git', '-C', repo, '-c', 'user.name=bench',
+         '-c', 'user.email=bench@localhost'] + list(argv)).decode()
+
+
+def bench_churn(args):
+    '''Collect from stand-ins whose configs change on every request,
+    --rounds times, committing to git after each round, without and
+    with normalization filters.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve', '--volatile',
+         '--latency', str(args.latency),
+         '--payload-size', str(args.payload_size)],
+        stdout=subprocess.PIPE)
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    rows = []
+    workdirs = []
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        for mode in ('raw', 'normalized'):
+            workdir = mkdtemp(prefix='getconfs-churn.')
+            workdirs.append(workdir)
+            config = farm_config(workdir, args.jobs, args.device_types)
+            repo = path.join(workdir, 'repo')
+            git(repo, 'init', '-q')
+            with open(config) as filep:
+                settings = json.load(filep)
+            settings['DEFAULT']['freshness'] = 'always'
+            if mode == 'normalized':
+                settings['NORMALIZE'] = CHURN_RULES
+                settings['DEFAULT']['raw_dir'] = path.join(workdir, 'raw')
+            with open(config, 'w') as filep:
+                json.dump(settings, filep, indent=1)
+
+            commits = changed = failed = 0
+            for _ in range(args.rounds):
+                result = run_case(['churn', '--json', config,
+                                   '--threads', str(args.threads)])
+                changed += result['changed']
+                failed += result['failed']
+                git(repo, 'add', '-A')
+                if git(repo, 'status', '--porcelain').strip():
+                    git(repo, 'commit', '-q', '-m', 'round')
+                    commits += 1
+            objects = dict(line.split(': ') for line in
+                           git(repo, 'count-objects', '-v').splitlines())
+            rows.append({'mode': mode, 'jobs': args.jobs,
+                         'rounds': args.rounds, 'failed': failed,
+                         'files_changed': changed, 'commits': commits,
+                         'objects': int(objects['count']),
+                         'objects_kib': int(objects['size'])})
+    finally:
+        standins.terminate()
+        standins.wait()
+        for workdir in workdirs:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                print('Farm output kept in %s' % workdir)
+    print_table(('mode', 'jobs', 'rounds', 'failed', 'files_changed',
+                 'commits', 'objects', 'objects_kib'), rows)
+
+
+# Artifact store ####################################################
+
+def dir_mib(top):
+    '''Disk space used under top, in MiB.'''
+    import os
+
+    return round(sum(path.getsize(path.join(root, name))
+                     for root, _, names in os.walk(top)
+                     for name in names) / 1048576., 2)
+
+
+def bench_artifacts(args):
+    '''Collect large configs that change on every request --rounds
+    times, committing and pushing to a bare origin after each round,
+    with the files in git and in the artifact store. Time pushes and
+    fresh clones as history grows, then gc and restore the store.'''
+    import os
+    import shutil
+    from tempfile import mkdtemp
+
+    standins = subprocess.Popen(
+        [sys.executable, path.join(path.dirname(path.abspath(__file__)),
+                                   'standins.py'), 'serve', '--volatile',
+         '--latency', str(args.latency),
+         '--payload-size', str(args.payload_size)],
+        stdout=subprocess.PIPE)
+    for var in ('REQUESTS_CA_BUNDLE', 'CURL_CA_BUNDLE'):
+        os.environ.pop(var, None)
+    rows = []
+    workdirs = []
+    store_cmd = [sys.executable, path.join(path.dirname(
+        path.abspath(__file__)), 'artifactstore.py')]
+    try:
+        if standins.stdout.readline().strip() != b'READY':
+            sys.exit('stand-ins failed to start')
+        for mode in ('git', 'store'):
+            workdir = mkdtemp(prefix='getconfs-artifacts.')
+            workdirs.append(workdir)
+            config = farm_config(workdir, args.jobs, args.device_types)
+            repo, origin = path.join(workdir, 'repo'), \
+                path.join(workdir, 'origin.git')
+            store = path.join(workdir, 'store')
+            subprocess.check_call(['git', 'init', '-q', '--bare', origin])
+            git(repo, 'init', '-q')
+            git(repo, 'remote', 'add', 'origin', origin)
+            with open(config) as filep:
+                settings = json.load(filep)
+            settings['DEFAULT']['freshness'] = 'always'
+            if mode == 'store':
+                settings['DEFAULT']['artifact_store'] = store
+            with open(config, 'w') as filep:
+                json.dump(settings, filep, indent=1)
+
+            for num in range(1, args.rounds + 1):
+                result = run_case(['churn', '--json', config,
+                                   '--threads', str(args.threads)])
+                git(repo, 'add', '-A')
+                git(repo, 'commit', '-q', '-m', 'round %i' % num)
+                start = time.time()
+                git(repo, 'push', '-q', 'origin', 'HEAD:refs/heads/main')
+                push = time.time() - start
+                if num % args.every and num != args.rounds:
+                    continue
+                clone = path.join(workdir, 'clone')
+                start = time.time()
+                subprocess.check_call(['git', 'clone', '-q', '--no-local',
+                                       origin, clone])
+                rows.append({'mode': mode, 'round': num,
+                             'failed': result['failed'],
+                             'push_s': round(push, 2),
+                             'clone_s': round(time.time() - start, 2),
+                             'origin_mib': dir_mib(origin),
+                             'store_mib': dir_mib(store)
+                             if path.isdir(store) else 0})
+                shutil.rmtree(clone)
+
+        # Nothing is unreferenced yet; then restore every pointer
+        print(subprocess.check_output(
+            store_cmd + ['gc', '--store', store, '--min-age', '0', repo])
+              .decode().strip())
+        restored = path.join(workdirs[-1], 'restored')
+        subprocess.check_output(store_cmd + ['restore', '--store', store,
+                                             '-o', restored, repo])
+        print('Restored %.1f MiB from the store.' % dir_mib(restored))
+    finally:
+        standins.terminate()
+        standins.wait()
+        for workdir in workdirs:
+            if not args.keep:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                print('Farm output kept in %s' % workdir)
+    print_table(('mode', 'round', 'failed', 'push_s', 'clone_s',
+                 'origin_mib', 'store_mib'), rows)
+
+
+# Push contention ##################################################
+
+def legacy_commit_pull_push(git_dir):
+    '''gitcheck before push retries: one pull and one push, no lock.'''
+    from git import Repo
+
+    with Repo(git_dir) as repo:
+        git_cmd = repo.git
+        if git_cmd.status('--porcelain'):
+            git_cmd.add('-A')
+            git_cmd.commit('-a', '-m', 'bench')
+            git_cmd.pull('--rebase')
+            git_cmd.push()
+
+
+def push_case(args):
+    '''Write args.file into the clone args.json, wait until args.start,
+    then commit and push it.'''
+    import logging
+    import gitcheck
+
+    with open(path.join(args.json, args.file), 'w') as filep:
+        filep.write(args.file + '\n')
+    time.sleep(max(0., args.start - time.time()))
+    stats = gitcheck.push_stats()
+    try:
+        if args.mode == 'legacy':
+            stats['attempts'] = 1
+            legacy_commit_pull_push(args.json)
+            stats['pushed'] = True
+        else:
+            gitcheck.git_check_add_commit_pull_push(
+                args.json, logging.getLogger('bench'), stats,
+                base=args.backoff)
+    except Exception as err:
+        stats['error'] = str(err).strip().splitlines()[-1]
+    return stats
+
+
+def bench_push(args):
+    '''Start --runs overlapping getconfs git steps on each of --nodes
+    clones of one bare origin at once, each adding its own file, with
+    the single pull/push and with retries and the repo lock. Count the
+    files that reach origin.'''
+    import shutil
+    from tempfile import mkdtemp
+
+    rows = []
+    for mode in args.modes:
+        workdir = mkdtemp(prefix='getconfs-push.')
+        origin = path.join(workdir, 'origin.git')
+        subprocess.check_call(['git', 'init', '-q', '--bare', origin])
+        seed = path.join(workdir, 'seed')
+        subprocess.check_call(['git', 'clone', '-q', origin, seed],
+                              stderr=subprocess.DEVNULL)
+        with open(path.join(seed, 'README'), 'w') as filep:
+            filep.write('configs\n')
+        git(seed, 'add', 'README')
+        git(seed, 'commit', '-q', '-m', 'seed')
+        git(seed, 'push', '-q', 'origin', 'HEAD:refs/heads/main')
+        subprocess.check_call(['git', '-C', origin, 'symbolic-ref', 'HEAD',
+                               'refs/heads/main'])
+        clones = []
+        for node in range(1, args.nodes + 1):
+            clone = path.join(workdir, 'node%i' % node)
+            subprocess.check_call(['git', 'clone', '-q', origin, clone])
+            git(clone, 'config', 'user.name', 'node%i' % node)
+            git(clone, 'config', 'user.email', 'node%i@localhost' % node)
+            clones.append(clone)
+
+        start = time.time() + args.startup
+        procs = [subprocess.Popen(
+            [sys.executable, path.abspath(__file__), 'case', 'push',
+             '--mode', mode, '--json', clone,
+             '--file', 'node%i-run%i.cfg' % (node, run),
+             '--start', str(start), '--backoff', str(args.backoff)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                 for node, clone in enumerate(clones, 1)
+                 for run in range(1, args.runs + 1)]
+        results = [json.loads(proc.communicate()[0].decode()
+                              .splitlines()[-1]) for proc in procs]
+        wall = time.time() - start
+
+        landed = [name for name in
+                  git(origin, 'ls-tree', '--name-only', 'main').split()
+                  if name.endswith('.cfg')]
+        rows.append({'mode': mode, 'nodes': args.nodes, 'runs': args.runs,
+                     'landed': len(landed),
+                     'expected': args.nodes * args.runs,
+                     'failed_runs': sum(1 for res in results
+                                        if 'error' in res),
+                     'attempts': sum(res['attempts'] for res in results),
+                     'rejected': sum(res['rejected'] for res in results),
+                     'backoff_s': round(sum(res['backoff']
+                                            for res in results), 1),
+                     'lock_wait_s': round(sum(res['lock_wait']
+                                              for res in results), 1),
+                     'wall_s': round(wall, 1)})
+        for res in results:
+            if 'error' in res and args.verbose:
+                print('%s: %s' % (mode, res['error']))
+        if args.keep:
+            print('Repos kept in %s' % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    print_table(('mode', 'nodes', 'runs', 'landed', 'expected',
+                 'failed_runs', 'attempts', 'rejected', 'backoff_s',
+                 'lock_wait_s', 'wall_s'), rows)
+
+
+# Q-flex uudecode ###################################################
+
+def legacy_uu_to_modemconfig(uustr):
+    '''The uu_to_modemconfig() collectqflex used to have, for
+    comparison.'''
+    import binascii
+    import tarfile
+    from tempfile import NamedTemporaryFile
+
+    blines = b''
+    for line in uustr.splitlines()[1:-1]:
+        blines += binascii.a2b_uu(line)
+    with NamedTemporaryFile(suffix='.tgz', mode='wb') as tgz:
+        tgz.write(blines)
+        tgz.seek(0)
+        with tarfile.open(name=tgz.name, mode='r') as tar:
+            with tar.extractfile('default.conf') as filep:
+                modemconfig = filep.read().decode()
+    return modemconfig
+
+
+def uudecode_case(args):
+    '''Decode generated getcurrentconfig output of about --lines bytes
+    of default.conf, --njobs times.'''
+    from collectqflex import uu_to_modemconfig
+    from standins import payload, uuencode_tgz
+
+    uustr = uuencode_tgz('default.conf',
+                         payload('qflex', args.lines).encode('utf-8'))
+    func = (legacy_uu_to_modemconfig if args.mode == 'legacy'
+            else uu_to_modemconfig)
+    start = time.time()
+    for _ in range(args.njobs):
+        func(uustr)
+    return {'mode': args.mode,
+            'conf_kib': args.lines // 1024,
+            'uu_kib': len(uustr) // 1024,
+            'ms_per_call': round((time.time() - start) / args.njobs * 1e3,
+                                 2)}
+
+
+def bench_uudecode(args):
+    '''Compare the legacy and in-memory Q-flex decoders.'''
+    rows = []
+    for size in args.sizes:
+        runs = max(1, args.runs * 20000 // max(size, 20000))
+        for mode in ('legacy', 'memory'):
+            rows.append(run_case(['uudecode', '--mode', mode,
+                                  '--lines', str(size),
+                                  '--njobs', str(runs)]))
+    print_table(('mode', 'conf_kib', 'uu_kib', 'ms_per_call'), rows)
+
+
+# Main ##############################################################
+
+CASES = {
+    'churn': churn_case,
+    'dns': dns_case,
+    'getconfs': getconfs_case,
+    'groups': groups_case,
+    'http': http_case,
+    'logging': logging_case,
+    'offload': offload_case,
+    'push': push_case,
+    'sort': sort_case,
+    'sshcmd': sshcmd_case,
+    'startup': startup_case,
+    'uudecode': uudecode_case,
+}
+
+
+def get_arguments():
+    '''Get/set command-line options'''
+    parser = ArgumentParser()
+    sub = parser.add_subparsers(dest='command')
+
+    startup = sub.add_parser('startup', help='eager vs lazy imports')
+    startup.add_argument('--device-types', nargs='+',
+                         default=['advantech', 'cisco_ios'])
+    startup.add_argument('--runs', type=int, default=10)
+    startup.set_defaults(func=bench_startup)
+
+    logs = sub.add_parser('logging', help='per-host vs queue logging')
+    logs.add_argument('--jobs', type=int, nargs='+', default=[100, 1000])
+    logs.add_argument('--lines', type=int, default=20,
+                      help='Debug lines logged per job.')
+    logs.add_argument('--threads', type=int, default=32)
+    logs.set_defaults(func=bench_logging)
+
+    farm = sub.add_parser('farm', help='getconfs against standins.py')
+    farm.add_argument('--jobs', type=int, default=1000)
+    farm.add_argument('--threads', type=int, nargs='+',
+                      default=[8, 32, 128])
+    farm.add_argument('--latency', type=float, default=0.05,
+                      help='Stand-in round-trip latency, seconds.')
+    farm.add_argument('--payload-size', type=int, default=20000)
+    farm.add_argument('--device-types', nargs='+',
+                      default=sorted(FARM_DEVICES),
+                      choices=sorted(FARM_DEVICES))
+    farm.add_argument('--keep', action='store_true',
+                      help='Keep the generated config, repo and logs.')
+    farm.set_defaults(func=bench_farm)
+
+    grp = sub.add_parser('groups', help='resource group caps and fairness')
+    grp.add_argument('--link-jobs', type=int, default=12,
+                     help='HTTP devices behind the rate-limited link.')
+    grp.add_argument('--link-max-jobs', type=int, default=3)
+    grp.add_argument('--link-rate', type=int, default=100000,
+                     help='Link bytes/sec.')
+    grp.add_argument('--auth-jobs', type=int, default=12,
+                     help='SSH devices behind the capped auth server.')
+    grp.add_argument('--auth-max-jobs', type=int, default=2)
+    grp.add_argument('--free-jobs', type=int, default=24,
+                     help='Devices in no group.')
+    grp.add_argument('--threads', type=int, default=8)
+    grp.add_argument('--latency', type=float, default=0.05,
+                     help='Stand-in round-trip latency, seconds.')
+    grp.add_argument('--payload-size', type=int, default=50000)
+    grp.add_argument('--keep', action='store_true',
+                     help='Keep the generated config, repo and logs.')
+    grp.set_defaults(func=bench_groups)
+
+    dns = sub.add_parser('dns', help='per-job vs up-front DNS')
+    dns.add_argument('--jobs', type=int, default=40)
+    dns.add_argument('--bad-names', type=int, default=2,
+                     help='Extra sections whose host does not resolve.')
+    dns.add_argument('--threads', type=int, default=8)
+    dns.add_argument('--resolver-latency', type=float, default=0.5,
+                     help='Seconds per lookup.')
+    dns.add_argument('--latency', type=float, default=0.05,
+                     help='Stand-in round-trip latency, seconds.')
+    dns.add_argument('--device-types', nargs='+',
+                     default=['advantech', 'cisco_ios', 'cisco_iossshcmd',
+                              'pepperlfuchs', 'pfsense'],
+                     choices=sorted(FARM_DEVICES))
+    dns.add_argument('--keep', action='store_true',
+                     help='Keep the generated config, repo and logs.')
+    dns.set_defaults(func=bench_dns)
+
+    offload = sub.add_parser('offload',
+                             help='post-processing in threads vs processes')
+    offload.add_argument('--sort-jobs', type=int, default=8,
+                         help='SCP devices whose config gets sorted.')
+    offload.add_argument('--http-jobs', type=int, default=32)
+    offload.add_argument('--threads', type=int, default=16)
+    offload.add_argument('--cpu-workers', type=int, nargs='+',
+                         default=[0, 2])
+    offload.add_argument('--latency', type=float, default=0.05,
+                         help='Stand-in round-trip latency, seconds.')
+    offload.add_argument('--payload-size', type=int, default=4000000)
+    offload.add_argument('--keep', action='store_true',
+                         help='Keep the generated config, repo and logs.')
+    offload.set_defaults(func=bench_offload)
+
+    churn = sub.add_parser('churn',
+                           help='git churn without and with normalization')
+    churn.add_argument('--jobs', type=int, default=12)
+    churn.add_argument('--rounds', type=int, default=5)
+    churn.add_argument('--threads', type=int, default=8)
+    churn.add_argument('--latency', type=float, default=0.05,
+                       help='Stand-in round-trip latency, seconds.')
+    churn.add_argument('--payload-size', type=int, default=20000)
+    churn.add_argument('--device-types', nargs='+',
+                       default=['cisco_ios', 'cisco_iossshcmd', 'pfsense'],
+                       choices=sorted(FARM_DEVICES))
+    churn.add_argument('--keep', action='store_true',
+                       help='Keep the generated configs, repos and logs.')
+    churn.set_defaults(func=bench_churn)
+
+    arts = sub.add_parser('artifacts',
+                          help='large configs in git vs the artifact store')
+    arts.add_argument('--jobs', type=int, default=4)
+    arts.add_argument('--rounds', type=int, default=20)
+    arts.add_argument('--every', type=int, default=5,
+                      help='Time a fresh clone every this many rounds.')
+    arts.add_argument('--threads', type=int, default=4)
+    arts.add_argument('--latency', type=float, default=0.05,
+                      help='Stand-in round-trip latency, seconds.')
+    arts.add_argument('--payload-size', type=int, default=4000000)
+    arts.add_argument('--device-types', nargs='+',
+                      default=['peplink', 'pfsense'],
+                      choices=sorted(FARM_DEVICES))
+    arts.add_argument('--keep', action='store_true',
+                      help='Keep the generated configs, repos and logs.')
+    arts.set_defaults(func=bench_artifacts)
+
+    push = sub.add_parser('push',
+                          help='concurrent pushes from several nodes')
+    push.add_argument('--nodes', type=int, default=6)
+    push.add_argument('--runs', type=int, default=2,
+                      help='Overlapping runs per node.')
+    push.add_argument('--backoff', type=float, default=0.5,
+                      help='Seconds before the first push retry.')
+    push.add_argument('--startup', type=float, default=3.,
+                      help='Seconds to let every run start before they '
+                      'all commit at once.')
+    push.add_argument('--modes', nargs='+', default=['legacy', 'retry'],
+                      choices=['legacy', 'retry'])
+    push.add_argument('--verbose', action='store_true',
+                      help='Print why runs failed.')
+    push.add_argument('--keep', action='store_true',
+                      help='Keep the generated repos.')
+    push.set_defaults(func=bench_push)
+
+    sort = sub.add_parser('sort', help='in-memory vs external sort')
+    sort.add_argument('--sizes', type=int, nargs='+',
+                      default=[50, 200, 500], help='File sizes, MiB.')
+    sort.add_argument('--modes', nargs='+', default=['legacy', 'external'],
+                      choices=['legacy', 'external'])
+    sort.add_argument('--buffer-mib', type=int, default=32,
+                      help='External sort run size, MiB.')
+    sort.add_argument('--dir', default=None,
+                      help='Where to put the test files (not a tmpfs).')
+    sort.set_defaults(func=bench_sort)
+
+    http = sub.add_parser('http', help='whole-body vs streamed HTTP')
+    http.add_argument('--size', type=int, default=100,
+                      help='Response body size, MiB.')
+    http.add_argument('--device-types', nargs='+',
+                      default=sorted(HTTP_DEVICES),
+                      choices=sorted(HTTP_DEVICES))
+    http.set_defaults(func=bench_http)
+
+    sshcmd = sub.add_parser('sshcmd',
+                            help='buffered vs streamed SSH command output')
+    sshcmd.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 50],
+                        help='Output size per command, MiB.')
+    sshcmd.set_defaults(func=bench_sshcmd)
+
+    batch = sub.add_parser('batch',
+                           help='one command at a time vs batched, by RTT')
+    batch.add_argument('--commands', type=int, default=15)
+    batch.add_argument('--rtts', type=float, nargs='+',
+                       default=[0.05, 0.3, 0.6],
+                       help='Stand-in round-trip times, seconds.')
+    batch.add_argument('--payload-size', type=int, default=2000)
+    batch.set_defaults(func=bench_batch)
+
+    uudec = sub.add_parser('uudecode', help='Q-flex getcurrentconfig decode')
+    uudec.add_argument('--sizes', type=int, nargs='+',
+                       default=[20000, 1000000, 20000000],
+                       help='default.conf sizes, bytes.')
+    uudec.add_argument('--runs', type=int, default=200,
+                       help='Calls for the smallest size (fewer for '
+                       'larger ones).')
+    uudec.set_defaults(func=bench_uudecode)
+
+    case = sub.add_parser('case', help='(internal) run a single case')
+    case.add_argument('case', choices=sorted(CASES))
+    case.add_argument('--mode', default='lazy')
+    case.add_argument('--device-type', default='cisco_ios')
+    case.add_argument('--njobs', type=int, default=100)
+    case.add_argument('--latency', type=float, default=0.5)
+    case.add_argument('--lines', type=int, default=20)
+    case.add_argument('--json')
+    case.add_argument('--file')
+    case.add_argument('--threads', type=int, default=32)
+    case.add_argument('--concurrency', type=int, default=None)
+    case.add_argument('--buffer-mib', type=int, default=32)
+    case.add_argument('--commands', type=int, default=2)
+    case.add_argument('--start', type=float, default=0.)
+    case.add_argument('--backoff', type=float, default=0.5)
+    case.set_defaults(func=lambda args: print(json.dumps(
+        CASES[args.case](args))))
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a benchmark name is required')
+    return args
+
+
+if __name__ == '__main__':
+    ARGS = get_arguments()
+    ARGS.func(ARGS)
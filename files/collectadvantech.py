@@ -7,6 +7,9 @@
 from os import path
 import requests
 
+import freshness
+from httpoutput import save_response
+from runreport import fail, phase
 from somtsfilelog import setup_logger
 
 
@@ -24,7 +27,7 @@ def cfgworker(host, loglevel,
     url2 = "http://%s:%i/cgi-bin/index.cgi?func=doexport" % (host, port)
 
     url = url1
-    response = None
+    fname = path.join(destination_dir, host + '.conf')
 
     logger = setup_logger('collectadvantech_%s' % host,
                           path.join(log_dir, 'collectadvantech.%s.log' % host),
@@ -32,20 +35,45 @@ def cfgworker(host, loglevel,
     logger.info('BEGIN %s', host)
     logger.debug('Attempting to talk to %s ...', url1)
 
+    if not freshness.should_fetch(fname, logger):
+        logger.info('END %s', host)
+        return
+
     if username is None and password is None:
         # Out of the box, there seems to be no password Advantechs
         try:
-            response = requests.get(url1, timeout=(18.5, 90.5))
+            with phase('transfer'):
+                response = requests.get(url1, timeout=(18.5, 90.5),
+                                        headers=freshness.http_headers(fname),
+                                        stream=True)
 
             if response.status_code == 404:
+                response.close()
                 logger.debug('Done talking to %s.', url)
                 logger.debug('Attempting to talk to %s ...', url2)
-                response = requests.get(url2, timeout=(18.5, 90.5))
+                with phase('transfer'):
+                    response = requests.get(
+                        url2, timeout=(18.5, 90.5),
+                        headers=freshness.http_headers(fname), stream=True)
                 url = url2
 
+            with response:
+                # Stream data to disk
+                logger.debug('Opening %s for writing conf data...', fname)
+
+                # We must write as UTF-8 to avoid errors like:
+                # UnicodeEncodeError: 'ascii' codec can't encode
+                # character u'\x84' in position 2594: ordinal not in
+                # range(128)
+                # ...from the Healy CLAB1/CLAB2 devices.  Not sure why.
+                if save_response(response, fname, logger=logger):
+                    logger.debug('conf data saved to %s.', fname)
+
         except (requests.exceptions.ConnectTimeout,
-                requests.exceptions.ConnectionError) as err:
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError) as err:
             logger.info('Error with %s: "%s".', host, err)
+            fail(err)
         except Exception as err:
             logger.error('Unexpected error with %s: %s', host, err)
     else:
@@ -53,18 +81,4 @@ def cfgworker(host, loglevel,
 
     logger.debug('Done talking to %s.', url)
 
-    if response is not None:
-        # Write data to disk
-        fname = path.join(destination_dir, host + '.conf')
-        logger.debug('Opening %s for writing conf data...', fname)
-
-        # We must write as UTF-8 to avoid errors like:
-        # UnicodeEncodeError: 'ascii' codec can't encode character u'\x84'
-        # in position 2594: ordinal not in range(128)
-        # ...from the Healy CLAB1/CLAB2 devices.  Not sure why.
-        with open(fname, 'wb') as myfile:
-            myfile.write(response.text.encode('utf-8'))
-
-        logger.debug('conf data saved to %s.', fname)
-
     logger.info('END %s', host)
@@ -8,6 +8,8 @@ import socket
 from os import path
 from telnetlib import Telnet
 
+from confoutput import write_output
+from runreport import phase
 from somtsfilelog import setup_logger
 
 
@@ -40,18 +42,21 @@ def cfgworker(host, loglevel,
                                    '%s.%s' % (host.split('.')[0],
                                               filename_extension))
     try:
-        tel = Telnet(host, port)
+        with phase('connect'):
+            tel = Telnet(host, port)
 
-        tel.read_until('login: '.encode('utf-8'), timeout)
-        cmd = "%s\n" % username
-        tel.write(cmd.encode('utf-8'))
+        with phase('auth'):
+            tel.read_until('login: '.encode('utf-8'), timeout)
+            cmd = "%s\n" % username
+            tel.write(cmd.encode('utf-8'))
 
-        tel.read_until('#'.encode('utf-8'), timeout)
+            tel.read_until('#'.encode('utf-8'), timeout)
 
         # Get the current config
-        cmd = "%s\n" % remote_cmd
-        tel.write(cmd.encode('utf-8'))
-        astparams = tel.read_until('#'.encode('utf-8'), timeout).decode()
+        with phase('transfer'):
+            cmd = "%s\n" % remote_cmd
+            tel.write(cmd.encode('utf-8'))
+            astparams = tel.read_until('#'.encode('utf-8'), timeout).decode()
         logger.info('hi')
 
         # Close telnet session.
@@ -60,8 +65,9 @@ def cfgworker(host, loglevel,
         # Write data, eliminating:
         # 1) The 0th line -- this is the command we issued
         # 2) The last line -- this is the command prompt we waited for
-        with open(local_filename, 'w') as filepointer:
-            filepointer.write("\n".join(astparams.splitlines()[1:-1]))
+        write_output(local_filename,
+                     "\n".join(astparams.splitlines()[1:-1]),
+                     logger=logger)
 
         logger.info('%s saved to disk', local_filename)
 
@@ -3,14 +3,18 @@
 
     Config grabber via requests. Used to keep Peplink config file(s)
     up-to-date from various locations. Peplink conf files change with
-    each download, so we add an intentional delay interval to mitigate'''
-import time
+    each download, so by default we only fetch them every 90 days (see
+    freshness.py; "delay_days" in getconfs.json still sets this)'''
 import os
-import stat
 import requests
 
+import freshness
+from httpoutput import save_response
+from runreport import phase
 from somtsfilelog import setup_logger
 
+FRESHNESS = ('interval', 90 * 86400.)
+
 
 def cfgworker(host, loglevel,
               port=443,
@@ -20,7 +24,6 @@ def cfgworker(host, loglevel,
               log_dir='/tmp',
               filename_extension='conf',
               timeout=60,
-              delay_days=90,
               local_filename=None
               ):
     '''Speak to a Peplink WUI using requests on TCP/443'''
@@ -40,31 +43,29 @@ def cfgworker(host, loglevel,
 
     logger.info('BEGIN %s', host)
 
-    # assess file modification time, if any
-    if os.path.isfile(local_filename):
-        mdays = (time.time() - os.stat(local_filename)[stat.ST_MTIME])/86400.
-    else:
-        mdays = delay_days + 1
-
     # Do nothing if our config has been collected "recently enough"
-    if delay_days > mdays:
-        logger.info('%s was modified ' % local_filename +
-                    '%i days ago, which is more recently than ' % mdays +
-                    'delay_days value of %i. Doing nothing' % delay_days)
+    if freshness.should_fetch(local_filename, logger):
 
-    # Collect config and save to our repo
-    else:
+        # Collect config and save to our repo
         try:
             with requests.Session() as session:
-                session.timeout = timeout
-                session.verify = False  # complain about,but ignore cert errors
-                login = session.post(baseurl + 'api.cgi', data=postdata)
+                # complain about, but ignore cert errors. verify (and
+                # timeout) go with each request: a Session attribute
+                # would lose to REQUESTS_CA_BUNDLE in the environment.
+                with phase('auth'):
+                    login = session.post(baseurl + 'api.cgi', data=postdata,
+                                         timeout=timeout, verify=False)
                 if login.status_code == 200:
-                    config = session.get(baseurl + 'download_config.cgi')
+                    with phase('transfer'):
+                        config = session.get(
+                            baseurl + 'download_config.cgi',
+                            timeout=timeout, verify=False, stream=True)
 
                     # Response is a binary blob. Write binary .conf file
-                    with open(local_filename, 'wb') as filepointer:
-                        filepointer.write(config.content)
+                    with config:
+                        config.raise_for_status()
+                        save_response(config, local_filename, text=False,
+                                      logger=logger)
 
             logger.info('%s saved to disk', local_filename)
 
@@ -8,6 +8,9 @@ from os import path
 from pathlib import Path
 import requests
 
+import freshness
+from httpoutput import save_response
+from runreport import fail, phase
 from somtsfilelog import setup_logger
 
 
@@ -46,20 +49,48 @@ def cfgworker(host, loglevel,
         if not Path(local_filename).is_absolute():
             local_filename = destp.joinpath(local_filename)
 
-        destp = Path(local_filename).parent()
-
-    response = None
+        destp = Path(local_filename).parent
 
     logger.debug('Attempting to talk to %s ...', url)
 
+    if not freshness.should_fetch(local_filename, logger):
+        logger.info('END %s', host)
+        return
+
     if username is None and password is None:
         # Out of the box, there seems to be no password Pepper L Fuchs
         try:
-            response = requests.get(url, timeout=(18.5, 90.5))
+            with phase('transfer'):
+                response = requests.get(
+                    url, timeout=(18.5, 90.5),
+                    headers=freshness.http_headers(local_filename),
+                    stream=True)
+
+            with response:
+                try:  # Attempt to ensure dir exists
+                    destp.mkdir(parents=True, exist_ok=True)
+                except (FileNotFoundError, PermissionError) as err:
+                    logger.error('Error with target dir %s: %s', destp, err)
+                except Exception as err:
+                    logger.error('Unexpected error with target dir %s: %s',
+                                 destp, err)
+
+                logger.debug('Opening %s for writing conf data...',
+                             local_filename)
+
+                # We must write as UTF-8 to avoid errors like:
+                # UnicodeEncodeError: 'ascii' codec can't encode
+                # character u'\x84' in position 2594: ordinal not in
+                # range(128)
+                # ...from the Healy CLAB1/CLAB2 devices.  Not sure why.
+                if save_response(response, local_filename, logger=logger):
+                    logger.debug('ds data saved to %s.', local_filename)
 
         except (requests.exceptions.ConnectTimeout,
-                requests.exceptions.ConnectionError) as err:
+                requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError) as err:
             logger.info('Error with %s: "%s".', host, err)
+            fail(err)
         except Exception as err:
             logger.error('Unexpected error with %s: %s', host, err)
     else:
@@ -67,23 +98,4 @@ def cfgworker(host, loglevel,
 
     logger.debug('Done talking to %s.', url)
 
-    if response is not None:
-        try:  # Attempt to ensure dir exists
-            destp.mkdir(parents=True, exist_ok=True)
-        except (FileNotFoundError, PermissionError) as err:
-            logger.error('Error with target dir %s: %s', destp, err)
-        except Exception as err:
-            logger.error('Unexpected error with target dir %s: %s', destp, err)
-
-        logger.debug('Opening %s for writing conf data...', local_filename)
-
-        # We must write as UTF-8 to avoid errors like:
-        # UnicodeEncodeError: 'ascii' codec can't encode character u'\x84'
-        # in position 2594: ordinal not in range(128)
-        # ...from the Healy CLAB1/CLAB2 devices.  Not sure why.
-        with open(local_filename, 'wb') as myfile:
-            myfile.write(response.text.encode('utf-8'))
-
-        logger.debug('ds data saved to %s.', local_filename)
-
     logger.info('END %s', host)
@@ -4,27 +4,100 @@
     pfSense config grabber. Used to keep pfSense XML config file(s)
     up-to-date from various locations. See
     https://doc.pfsense.org/index.php/Remote_Config_Backup#2.3.3_and_Later
-    for details. Note that we make subprocess calls to wget to minimize
-    translation from the pfSense docs.'''
+    for details. We follow the same three steps as the wget example
+    there (fetch the login form, log in, download config.xml), in one
+    requests session so cookies stay in memory and the TLS connection
+    is reused.'''
 
+from html.parser import HTMLParser
 from os import path
-from subprocess import check_output, CalledProcessError
-from tempfile import NamedTemporaryFile
-from urllib.parse import urlencode
+from time import sleep
 
+import requests
+
+import freshness
+from confoutput import CHUNK_SIZE, atomic_write
+from runreport import phase
 from somtsfilelog import setup_logger
 
+# Errors worth another try, as wget --tries would retry them
+RETRYABLE = (requests.exceptions.ConnectionError,
+             requests.exceptions.Timeout,
+             requests.exceptions.ChunkedEncodingError)
+WAITRETRY = 10  # wget's default --waitretry, in seconds
+
+
+class CSRFParser(HTMLParser):
+    '''Pick the value of the __csrf_magic hidden input out of a page.'''
+
+    def __init__(self):
+        super().__init__()
+        self.csrf = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'input' and attrs.get('name') == '__csrf_magic' and \
+                self.csrf is None:
+            self.csrf = attrs.get('value')
+
+    handle_startendtag = handle_starttag
+
 
-def get_csrf_magic(mystr):
-    '''Take a string of pfSense WUI data and extract the CSRF token'''
-    objects = mystr.split()
-    for index, obj in enumerate(objects):
-        if obj == "name='__csrf_magic'":
-            # get next var
-            csrf = objects[index + 1]
+def get_csrf_magic(page):
+    '''Take pfSense WUI data (str or bytes) and extract the CSRF token,
+    or return None if there is none.'''
+    if isinstance(page, bytes):
+        page = page.decode('utf-8', 'replace')
+    parser = CSRFParser()
+    parser.feed(page)
+    parser.close()
+    return parser.csrf
 
-            # return the string between quotes
-            return csrf[csrf.find('"')+1:-1]
+
+def with_tries(tries, logger, func, *args, **kwargs):
+    '''Call func, making up to tries attempts in all when it fails with
+    a connection error or timeout. Like wget, wait a second longer after
+    each failure, up to WAITRETRY.'''
+    for attempt in range(1, max(1, tries) + 1):
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE as err:
+            if attempt >= tries:
+                raise
+            logger.debug('Attempt %i of %i failed (%s); retrying...',
+                         attempt, tries, err)
+            sleep(min(attempt, WAITRETRY))
+
+
+def fetch_csrf(session, url, timeout, data=None):
+    '''GET url (or POST data to it) and return the page's CSRF token.'''
+    resp = session.request('GET' if data is None else 'POST', url,
+                           data=data, timeout=timeout, verify=False)
+    resp.raise_for_status()
+    csrf = get_csrf_magic(resp.content)
+    if csrf is None:
+        raise ValueError('no __csrf_magic in response')
+    return csrf
+
+
+def download(session, url, fname, timeout, data, logger):
+    '''POST data to url and stream the XML response into fname. Return
+    True when fname changed.'''
+    with atomic_write(fname, 'wb', logger=logger) as filep:
+        with phase('transfer'), \
+                session.post(url, data=data, timeout=timeout,
+                             verify=False, stream=True) as resp:
+            resp.raise_for_status()
+            first = True
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                # A failed login gets the login page back, not config.xml
+                if first and not chunk.lstrip().startswith(b'<?xml'):
+                    raise ValueError('response is not XML')
+                first = False
+                filep.write(chunk)
+            if first:
+                raise ValueError('empty response')
+    return filep.changed
 
 
 def cfgworker(host, loglevel,
@@ -36,85 +109,73 @@ def cfgworker(host, loglevel,
               tries=3,
               timeout=300
               ):
-    '''Login to pfSense with wget and return XML data'''
+    '''Login to pfSense over HTTPS and save its XML config'''
 
     # Set up variables
     url = "https://%s:%i/diag_backup.php" % (host, port)
-    base_wget = [
-        '/usr/bin/wget',
-        '--no-check-certificate',
-        '--keep-session-cookies',
-        '--tries', '%s' % tries,
-        '--timeout', '%s' % timeout,
-        '-qO-']
 
     logger = setup_logger('collectpfsense_%s' % host,
                           path.join(log_dir, 'collectpfsense.%s.log' % host),
                           level=loglevel)
     logger.info('BEGIN %s', host)
+
+    fname = path.join(destination_dir, host + '.xml')
+    if not freshness.should_fetch(fname, logger):
+        logger.info('END %s', host)
+        return
+
     logger.debug('Attempting to talk to %s ...', url)
 
-    # Open cookie file
-    with NamedTemporaryFile() as cookie:
+    with requests.Session() as session:
 
         # Step 1:
-        # Fetch the login form and save the cookies and CSRF token
+        # Fetch the login form and keep the cookies and CSRF token
         try:
-            csrf1 = get_csrf_magic(check_output(
-                base_wget + ['--save-cookies=%s' % cookie.name, url]))
+            with phase('connect'):
+                csrf1 = with_tries(tries, logger, fetch_csrf,
+                                   session, url, timeout)
             logger.debug('Collected csrf1, "%s" ...', csrf1)
-        except CalledProcessError:
-            logger.error('Could not collect CSRF magic #1 from %s', url)
+        except (requests.exceptions.RequestException, ValueError) as err:
+            logger.error('Could not collect CSRF magic #1 from %s: %s',
+                         url, err)
             return
 
         # Step 2:
         # Submit the login form along with the first CSRF token and
-        # save the second CSRF token -- now the script is logged in
+        # keep the second CSRF token -- now the script is logged in
         # and can take action.
         try:
-            csrf2 = get_csrf_magic(check_output(
-                base_wget + [
-                    '--load-cookies=%s' % cookie.name,
-                    '--save-cookies=%s' % cookie.name,
-                    '--post-data',
-                    urlencode({
-                        'login': 'Login',
-                        'usernamefld': username,
-                        'passwordfld': password,
-                        '__csrf_magic': csrf1,
-                        }),
-                    url]))
+            with phase('auth'):
+                csrf2 = with_tries(tries, logger, fetch_csrf,
+                                   session, url, timeout, {
+                                       'login': 'Login',
+                                       'usernamefld': username,
+                                       'passwordfld': password,
+                                       '__csrf_magic': csrf1,
+                                       })
             logger.debug('Collected csrf2, "%s" ...', csrf2)
-        except CalledProcessError:
-            logger.error('Could not collect CSRF magic #2 from %s', url)
+        except (requests.exceptions.RequestException, ValueError) as err:
+            logger.error('Could not collect CSRF magic #2 from %s: %s',
+                         url, err)
             return
 
         # Step 3:
         # Submit the download form along with the second CSRF token
-        # to save a copy of config.xml
+        # and stream config.xml to disk
+        logger.debug('Saving XML data to %s...', fname)
         try:
-            myxml = check_output(
-                base_wget + [
-                    '--load-cookies=%s' % cookie.name,
-                    '--post-data',
-                    urlencode({
-                        'download': 'download',
-                        'donotbackuprrd': 'yes',
-                        '__csrf_magic': csrf2,
-                        }),
-                    url])
-            logger.debug('Collected XML data.')
-        except CalledProcessError:
-            logger.error('Could not collect XML from %s', url)
+            with_tries(tries, logger, download,
+                       session, url, fname, timeout, {
+                           'download': 'download',
+                           'donotbackuprrd': 'yes',
+                           '__csrf_magic': csrf2,
+                           }, logger)
+        except (requests.exceptions.RequestException, ValueError,
+                OSError) as err:
+            logger.error('Could not collect XML from %s: %s', url, err)
             return
+        freshness.remember(fname)
     logger.debug('Done talking to %s.', url)
 
-    # Write XML to disk
-    fname = path.join(destination_dir, host + '.xml')
-    logger.debug('Opening %s for writing XML data...', fname)
-    myfile = open(fname, 'w')
-    myfile.write(myxml)
-    myfile.close()
-
     logger.debug('XML data saved to %s.', fname)
     logger.info('END %s', host)
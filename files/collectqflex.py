@@ -5,18 +5,23 @@ Talk to various devices, get their config and store.
 # Import python built-ins
 import binascii
 import csv
+import gzip
+import io
 import os
 import re
 import tarfile
+import zlib
 import socket
-from tempfile import NamedTemporaryFile
 
 # Import modules that tend to need a special install
-from netmiko import ConnectHandler
 from netmiko.ssh_exception import NetMikoTimeoutException
 from netmiko.ssh_exception import NetMikoAuthenticationException
 from paramiko.ssh_exception import SSHException
 
+from confoutput import write_output
+import postprocess
+from runreport import fail, phase
+import sessionpool
 from somtsfilelog import setup_logger
 
 
@@ -31,20 +36,25 @@ def get_qflex_data(filecmddict, nm_kwargs, logger, enable=False, ending=None):
     logger.info('Connect to %s', hostinfo)
 
     try:
-        with ConnectHandler(**nm_kwargs) as net_connect:
+        with sessionpool.session(**nm_kwargs) as net_connect:
             if enable:
                 logger.debug('Sending enable command to %s', hostinfo)
-                net_connect.enable()
+                with phase('auth'):
+                    net_connect.enable()
 
             for fname, cmd in filecmddict.items():
                 logger.debug('Sending command "%s" to %s', cmd, hostinfo)
-                output = net_connect.send_command(cmd)
+                with phase('transfer'):
+                    output = net_connect.send_command(cmd)
 
-                if cmd == 'getcurrentconfig':  # uu decode this text
-                    output = uu_to_modemconfig(output)
+                with phase('postprocess'):
+                    if cmd == 'getcurrentconfig':  # uu decode this text
+                        output = postprocess.run('uudecode',
+                                                 uu_to_modemconfig, output,
+                                                 size=len(output))
 
-                elif cmd == 'getcurrent':  # sanity-check this text
-                    output = check_getcurrent(output, logger)
+                    elif cmd == 'getcurrent':  # sanity-check this text
+                        output = check_getcurrent(output, logger)
 
                 logger.debug('Received output from command "%s" from %s',
                              cmd, hostinfo)
@@ -61,8 +71,7 @@ def get_qflex_data(filecmddict, nm_kwargs, logger, enable=False, ending=None):
                             'Unsaved output from %s to %s. Data is empty.',
                             hostinfo, fname)
                 else:
-                    with open(fname, 'w') as filep:
-                        filep.write(output)
+                    write_output(fname, output, logger=logger)
                     logger.info('Saved output from %s to %s.', hostinfo, fname)
 
         logger.info('Disconnect from %s', hostinfo)
@@ -70,19 +79,31 @@ def get_qflex_data(filecmddict, nm_kwargs, logger, enable=False, ending=None):
     except (IOError, TypeError, ValueError, socket.error, SSHException,
             NetMikoTimeoutException, NetMikoAuthenticationException) as err:
         logger.info('Error with %s: "%s".', hostinfo, err)
+        fail(err)
     except Exception as err:
         logger.error('Unexpected error with %s: %s', hostinfo, err)
 
 
-def check_getcurrent(text, logger):
-    ''' We expect a bunch of lines that are essentially key=value\n.
-        Parse for that and return None when we do not get it. '''
+def getcurrent_ok(text):
+    ''' True when text is a bunch of lines that are essentially
+        key=value\n. '''
 
     # CSV reader needs a list or file to read.
     data = csv.reader(text.splitlines(), delimiter='=')
     try:
         dict([(row[0], row[1]) for row in data])
     except IndexError:
+        return False
+    return True
+
+
+def check_getcurrent(text, logger):
+    ''' We expect a bunch of lines that are essentially key=value\n.
+        Parse for that (in the post-processing pool) and return None
+        when we do not get it. '''
+
+    if not postprocess.run('getcurrent', getcurrent_ok, text,
+                           size=len(text)):
         logger.error('Unable to parse output from `getcurrent`. ' +
                      'Set output to None.')
         return None
@@ -90,6 +111,57 @@ def check_getcurrent(text, logger):
     return text
 
 
+class _ViewReader(io.RawIOBase):
+    '''Read-only file object over a memoryview, so tarfile can read
+    decoded data without it being copied into a BytesIO.'''
+
+    def __init__(self, view):
+        super().__init__()
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        size = min(len(buf), len(self.view) - self.pos)
+        buf[:size] = self.view[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+
+def uu_lines(uustr):
+    '''Return the data lines between the begin and end lines of
+    UUEncoded text, checking each line's length character.'''
+    lines = uustr.splitlines()
+    try:
+        first = next(num for num, line in enumerate(lines)
+                     if line.startswith('begin '))
+        last = next(num for num in range(len(lines) - 1, first, -1)
+                    if lines[num].rstrip() == 'end')
+    except StopIteration:
+        raise ValueError('UU data has no begin/end lines')
+
+    lines = lines[first + 1:last]
+    short = False
+    for num, line in enumerate(lines, first + 2):
+        if not line:
+            raise ValueError('UU line %i is empty' % num)
+        size = (ord(line[0]) - 32) & 63
+        if not 32 <= ord(line[0]) <= 96 or size > 45:
+            raise ValueError('UU line %i has a bad length character' % num)
+        # Only the last data line(s) may be short; a short line in the
+        # middle means lines were lost or garbled over the air.
+        if short and size:
+            raise ValueError('UU line %i follows a short line' % num)
+        short = size < 45
+        # Lines may be short by trailing spaces (zeros) that got
+        # stripped, which a2b_uu pads back, but never long.
+        if len(line.rstrip()) > 1 + (size + 2) // 3 * 4:
+            raise ValueError('UU line %i is too long' % num)
+    return lines
+
+
 def uu_to_modemconfig(uustr):
     '''Take UUEncoded tar.gz data in the form of a string, return the
     ASCII contents of default.conf, which is really quasi-XML data'''
@@ -99,24 +171,37 @@ def uu_to_modemconfig(uustr):
     # UU data and converting to binary, things get trickier.  The
     # binascii module in Python is well suited to handle this.
 
-    # Take unicode string and convert each UU line to binary, stripping
-    # the first and last line in the process.  The 'begin' and 'end'
-    # characters on these lines are illegal chars in the binascii
-    # module (but not the uu module that we used to use).
-    blines = b''
-    for line in uustr.splitlines()[1:-1]:
-        blines += binascii.a2b_uu(line)
-
-    # Write down uu-decoded binary data, which is a .tgz file
-    with NamedTemporaryFile(suffix='.tgz', mode='wb') as tgz:
-        tgz.write(blines)
-        tgz.seek(0)
-
-        # Read .tgz file
-        with tarfile.open(name=tgz.name, mode='r') as tar:
-            # Unpack default.conf
-            with tar.extractfile('default.conf') as filep:
-                modemconfig = filep.read().decode()  # decode to ascii
+    # Convert each UU line to binary, straight into a buffer sized from
+    # the lines' length characters.  The 'begin' and 'end' lines are
+    # illegal in the binascii module (but not the uu module that we
+    # used to use), so uu_lines() leaves them out.
+    lines = uu_lines(uustr)
+    sizes = [(ord(line[0]) - 32) & 63 for line in lines]
+    view = memoryview(bytearray(sum(sizes)))
+    pos = 0
+    for line, size in zip(lines, sizes):
+        view[pos:pos + size] = binascii.a2b_uu(line)
+        pos += size
+
+    # Stream the .tgz through gzip and tar until default.conf turns
+    # up, without writing it down or unpacking other members. Then read
+    # to the end, so gzip checks its CRC over everything we decoded;
+    # that catches corruption uu_lines() cannot see.
+    modemconfig = None
+    try:
+        with gzip.GzipFile(fileobj=_ViewReader(view)) as gzfile, \
+                tarfile.open(fileobj=gzfile, mode='r|') as tar:
+            for member in tar:
+                if modemconfig is None and \
+                        member.name in ('default.conf', './default.conf'):
+                    with tar.extractfile(member) as filep:
+                        modemconfig = filep.read().decode()  # to ascii
+            while gzfile.read(io.DEFAULT_BUFFER_SIZE):
+                pass
+    except (EOFError, OSError, tarfile.TarError, zlib.error) as err:
+        raise ValueError('Bad tar.gz data: %s' % err)
+    if modemconfig is None:
+        raise ValueError('No default.conf in tar.gz data')
     return modemconfig
 
 
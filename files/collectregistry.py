@@ -0,0 +1,97 @@
+# THIS FILE MANANGED BY PUPPET.
+''' collectregistry.py
+
+    Map getconfs device_type values to collector modules. Collectors
+    are imported the first time a job needs them, so a run that only
+    touches HTTP devices never pays for netmiko/paramiko/scp imports.'''
+
+from fnmatch import fnmatchcase
+from importlib import import_module
+from inspect import signature
+from threading import Lock
+
+# device_type rewrite rules for a collector's cfgworker()
+DROP = 'drop'  # collector does not take a device_type kwarg
+KEEP = 'keep'  # pass device_type through untouched
+
+
+def strip_suffix(suffix):
+    '''Return a rewrite rule removing suffix from the device_type.'''
+    return lambda device_type: device_type[:-len(suffix)]
+
+
+# (device_type glob, collector module, device_type rewrite rule).
+# First match wins; order specific patterns before general ones.
+COLLECTORS = [
+    ('advantech', 'collectadvantech', DROP),
+    ('mediacento', 'collectmediacento', DROP),
+    ('peplink', 'collectpeplink', DROP),
+    ('pepperlfuchs', 'collectpepperlfuchs', DROP),
+    ('pfsense', 'collectpfsense', DROP),
+    ('qflex', 'collectqflex', DROP),
+    ('cisco_s300', 'collectssh', KEEP),  # No SCP on Cisco SG-300
+    ('sshcmd', 'collectsshcmd', DROP),
+    ('*sshcmd', 'collectsshcmd', strip_suffix('sshcmd')),
+]
+
+# many device_type options for Netmiko SCP, so it is the default
+DEFAULT_COLLECTOR = ('collectscp', KEEP)
+
+_LOADED = {}
+_LOCK = Lock()
+
+
+def register(pattern, module_name, rewrite=DROP, first=True):
+    '''Add a device_type glob for a collector module. New patterns are
+    tried before the built-in ones unless first is False.'''
+    if first:
+        COLLECTORS.insert(0, (pattern, module_name, rewrite))
+    else:
+        COLLECTORS.append((pattern, module_name, rewrite))
+
+
+def lookup(device_type):
+    '''Return (module name, rewrite rule) for a device_type.'''
+    for pattern, module_name, rewrite in COLLECTORS:
+        if fnmatchcase(device_type, pattern):
+            return module_name, rewrite
+    return DEFAULT_COLLECTOR
+
+
+def target_port(kwargs):
+    '''The TCP port a job's collector will connect to: the job's own
+    "port", else the default of its cfgworker(), which means importing
+    the collector. None when the collector takes no port.'''
+    if kwargs.get('port') is not None:
+        return int(kwargs['port'])
+    module_name, _ = lookup(kwargs.get('device_type', ''))
+    param = signature(load(module_name).cfgworker).parameters.get('port')
+    if param is None or param.default is param.empty:
+        return None
+    return int(param.default)
+
+
+def load(module_name):
+    '''Import a collector module once, on first use.'''
+    try:
+        return _LOADED[module_name]
+    except KeyError:
+        pass
+
+    with _LOCK:
+        if module_name not in _LOADED:
+            _LOADED[module_name] = import_module(module_name)
+    return _LOADED[module_name]
+
+
+def get_collector(kwargs):
+    '''Pick and import the collector module for a job, adjusting the
+    device_type in kwargs in place to suit its cfgworker().'''
+    module_name, rewrite = lookup(kwargs['device_type'])
+
+    if rewrite == DROP:
+        kwargs.pop('device_type', None)
+    elif rewrite != KEEP:
+        kwargs['device_type'] = rewrite(kwargs['device_type'])
+
+    return load(module_name)
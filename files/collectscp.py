@@ -4,18 +4,61 @@
     Config grabber via Netmiko/SCP. Used to keep various
     SSH/SCP-capable config file(s) up-to-date from various locations.'''
 
+import os
 from pathlib import Path
-from netmiko import ConnectHandler, SCPConn
+from shutil import rmtree
+from tempfile import mkdtemp, mkstemp
+from threading import Lock
+from time import time
 from netmiko.ssh_exception import NetMikoTimeoutException
 from netmiko.ssh_exception import NetMikoAuthenticationException
+from paramiko import SFTPClient
 from paramiko.ssh_exception import SSHException
-from scp import SCPException
-
+from scp import SCPClient, SCPException
+
+from confoutput import commit_file, commit_tree
+import extsort
+import freshness
+import postprocess
+import resourcegroups
+from runreport import phase
+import sessionpool
 from somtsfilelog import setup_logger
 
+# Hosts found not to offer SFTP this run, so we stop asking
+_NO_SFTP = set()
+_NO_SFTP_LOCK = Lock()
+
+
+def remote_stat(transport, host, remote_filename, logger):
+    '''Return (size, mtime) of remote_filename via SFTP on transport, or
+    None when the device cannot tell us (many network devices do not do
+    SFTP, or do not map their file systems into it).'''
+    with _NO_SFTP_LOCK:
+        if host in _NO_SFTP:
+            return None
+    try:
+        sftp = SFTPClient.from_transport(transport)
+    except (EOFError, SSHException) as err:
+        logger.debug('No SFTP on %s (%s); cannot stat %s.',
+                     host, err, remote_filename)
+        with _NO_SFTP_LOCK:
+            _NO_SFTP.add(host)
+        return None
+    try:
+        sftp.get_channel().settimeout(10.0)
+        attrs = sftp.stat(remote_filename)
+        return attrs.st_size, attrs.st_mtime
+    except (EOFError, IOError, SSHException) as err:
+        logger.debug('Cannot stat %s on %s: %s', remote_filename, host, err)
+        return None
+    finally:
+        sftp.close()
+
 
 def cfgworker(host, loglevel,
               device_type='cisco_ios',
+              port=22,
               username='admin',
               password='!!',
               destination_dir='/tmp',
@@ -26,7 +69,8 @@ def cfgworker(host, loglevel,
               hostname=None,
               preserve_times=False,
               recursive=False,
-              sort=False
+              sort=False,
+              sort_buffer_size=extsort.BUFFER_SIZE
               ):
     '''Multiprocessing worker for get_cfg()'''
 
@@ -58,7 +102,7 @@ def cfgworker(host, loglevel,
         if not Path(local_filename).is_absolute():
             local_filename = destp.joinpath(local_filename)
 
-        destp = local_filename.parent()
+        destp = local_filename.parent
 
     try:  # Attempt to ensure dir exists
         destp.mkdir(parents=True, exist_ok=True)
@@ -67,39 +111,108 @@ def cfgworker(host, loglevel,
     except Exception as err:
         logger.error('Unexpected error with target dir %s: %s', destp, err)
 
+    # Directories cannot be checked with a stat, so only single files
+    # follow the freshness policy.
+    if not recursive and not freshness.should_fetch(local_filename, logger):
+        logger.info('END %s', host)
+        return
+
     try:
         logger.debug('Attempt to SSH to host %s, device type %s',
                      host, device_type)
-        with ConnectHandler(host=host,
-                            device_type=device_type,
-                            username=username,
-                            password=password) as net_connect:
-            net_connect.enable()
+        with sessionpool.session(host=host,
+                                 port=port,
+                                 device_type=device_type,
+                                 username=username,
+                                 password=password) as net_connect:
+            with phase('auth'):
+                net_connect.enable()
+
+            # Skip the transfer if the remote file looks unchanged, on
+            # device_types known to answer an SFTP stat
+            remote = None
+            pol = freshness.policy()
+            if not recursive and pol.stat and pol.mode != 'always':
+                stat_time = time()
+                with phase('stat'):
+                    remote = remote_stat(
+                        net_connect.remote_conn.get_transport(), host,
+                        remote_filename, logger)
+                if remote is not None and freshness.remote_unchanged(
+                        local_filename, remote[0], remote[1], logger):
+                    logger.info('END %s', host)
+                    return
+
             logger.debug('Attempt to connect via SCP...')
+
+            # Transfer into a temp file/dir beside the destination, so
+            # the output stage can leave unchanged files untouched.
+            if recursive:
+                tmp_dir = mkdtemp(dir=destp,
+                                  prefix='.%s.' % local_filename.name)
+                tmp_filename = Path(tmp_dir).joinpath(local_filename.name)
+            else:
+                fdesc, tmp_filename = mkstemp(
+                    dir=destp, prefix='.%s.' % local_filename.name,
+                    suffix='.tmp')
+                os.close(fdesc)
             try:
-                scp_conn = SCPConn(net_connect)
-                scp_conn.scp_client.get(remote_filename, local_filename,
-                                        recursive=recursive,
-                                        preserve_times=preserve_times)
-                logger.info('Config for %s:%s transferred successfully to %s.',
-                            host, remote_filename, local_filename)
-                scp_conn.close()
+                # SCP runs on a new channel of the (possibly shared)
+                # session's transport, rather than a second login.
+                with phase('transfer'), SCPClient(
+                        net_connect.remote_conn.get_transport(),
+                        socket_timeout=10.0,
+                        progress=resourcegroups.scp_progress()) as scp_client:
+                    scp_client.get(remote_filename, str(tmp_filename),
+                                   recursive=recursive,
+                                   preserve_times=preserve_times)
+                logger.info('Config for %s:%s transferred successfully.',
+                            host, remote_filename)
 
                 # files like esx.conf come to us in varying order,
                 # which makes some of the changes we track not very
                 # helpful. So, we offer a way to sort the file lines
-                # to work around issues like that.
-                if sort and not recursive:
-                    logger.info('Sorting contents of %s', local_filename)
-                    with open(local_filename, 'r+') as filep:
-                        sortf = sorted(filep)    # sort file
-                        filep.seek(0)            # goto start of file
-                        filep.writelines(sortf)  # overwrite
-                        filep.truncate()         # cut off any remainder
+                # to work around issues like that. Large files are
+                # sorted on disk rather than in memory, in the
+                # post-processing pool.
+                if sort:
+                    logger.info('Sorting contents of %s', tmp_filename)
+                    with phase('postprocess'):
+                        if os.path.isdir(tmp_filename):
+                            size = sum(
+                                os.path.getsize(os.path.join(root, name))
+                                for root, _, names in os.walk(tmp_filename)
+                                for name in names)
+                            postprocess.run('sort', extsort.sort_tree,
+                                            str(tmp_filename),
+                                            sort_buffer_size, size=size)
+                        else:
+                            postprocess.run(
+                                'sort', extsort.sort_file, str(tmp_filename),
+                                sort_buffer_size,
+                                size=os.path.getsize(tmp_filename))
+
+                if recursive:
+                    changed = commit_tree(tmp_filename, local_filename,
+                                          logger=logger)
+                else:
+                    changed = commit_file(tmp_filename, local_filename,
+                                          logger=logger)
+                    if remote is not None:
+                        freshness.remember_remote(local_filename,
+                                                  remote[0], remote[1],
+                                                  stat_time)
+                logger.info('%s %s.', local_filename,
+                            'updated' if changed else 'unchanged')
             except (EOFError, SCPException, SSHException) as err:
                 logger.error('Error with %s: %s', host, err)
             except Exception as err:
                 logger.error('Unexpected error with %s: %s', host, err)
+            finally:
+                if recursive:
+                    rmtree(tmp_dir, ignore_errors=True)
+                elif os.path.exists(tmp_filename):
+                    os.unlink(tmp_filename)
 
     except (EOFError,
             SSHException,
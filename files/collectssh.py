@@ -4,17 +4,20 @@
     Config grabber via Netmiko/SSH typically to a Cisco SG-300. Used to
     keep SG-300 switches and the like up-to-date from various locations
     by making the device send its config to our collector.'''
-from os import path, rename
-from socket import gethostbyname, gethostname
+from os import path
 from getpass import getuser
-from netmiko import ConnectHandler
 from netmiko.ssh_exception import NetMikoTimeoutException
 
+from confoutput import commit_file
+import resolver
+from runreport import phase
+import sessionpool
 from somtsfilelog import setup_logger
 
 
 def cfgworker(host, loglevel,
               device_type='cisco_s300',
+              port=22,
               username='admin',
               password='!!',
               destination_dir='staging',
@@ -37,7 +40,7 @@ def cfgworker(host, loglevel,
         dest_username = getuser()
 
     if dest_host is None:
-        dest_host = gethostbyname(gethostname())
+        dest_host = resolver.local_address()
 
     if dest_filename is None:
         dest_filename = path.join(path.realpath(destination_dir),
@@ -56,19 +59,22 @@ def cfgworker(host, loglevel,
     try:
         logger.debug('Attempt to connect to host %s, device type %s',
                      host, device_type)
-        with ConnectHandler(host=host,
-                            device_type=device_type,
-                            username=username,
-                            password=password) as net_connect:
-            net_connect.enable()
+        with sessionpool.session(host=host,
+                                 port=port,
+                                 device_type=device_type,
+                                 username=username,
+                                 password=password) as net_connect:
+            with phase('auth'):
+                net_connect.enable()
             logger.debug('Sending command, "%s"...', command)
-            output = net_connect.send_command(command)
+            with phase('transfer'):
+                output = net_connect.send_command(command)
             logger.info(output)
 
         # Once copied, move file into place
         tempfile = path.join(path.expanduser('~'), dest_basename)
         logger.info('Moving %s to %s.', tempfile, dest_filename)
-        rename(tempfile, dest_filename)
+        commit_file(tempfile, dest_filename, logger=logger)
 
     except NetMikoTimeoutException as err:
         logger.error('Error with %s: %s', host, err)
@@ -6,6 +6,9 @@
 # pylint: disable=too-many-arguments
 from os import path
 import requests
+import freshness
+from httpoutput import save_response
+from runreport import fail, phase
 from somtsfilelog import setup_logger
 
 
@@ -22,42 +25,48 @@ def cfgworker(host, loglevel,
     '''Query a URL and return conf data'''
 
     if username is None:
-        url = f"{proto}://{host}:{port}{path}"
+        url = f"{proto}://{host}:{port}{urlpath}"
     elif password is None:
-        url = f"{proto}://{username}@{host}:{port}{path}"
+        url = f"{proto}://{username}@{host}:{port}{urlpath}"
     else:
-        url = f"{proto}://{username}:{password}@{host}:{port}{path}"
+        url = f"{proto}://{username}:{password}@{host}:{port}{urlpath}"
     fname = path.join(destination_dir, host + '.' + extension)
 
     logger = setup_logger('collecturl_%s' % host,
                           path.join(log_dir, 'collecturl.%s.log' % host),
                           level=loglevel)
     logger.info('BEGIN %s', host)
+    if not freshness.should_fetch(fname, logger):
+        logger.info('END %s', host)
+        return
+
     logger.debug('Attempting to talk to %s ...', url)
 
     # pylint: disable-msg=broad-except
     try:
-        with requests.get(url, timeout=(18.5, 90.5)) as response:
+        with phase('transfer'):
+            response = requests.get(url, timeout=(18.5, 90.5),
+                                    headers=freshness.http_headers(fname),
+                                    stream=True)
+        with response:
             logger.debug('Done talking to %s.', url)
 
             if response.ok is True:
                 logger.debug('Opening %s for writing URL response data...',
                              fname)
 
-                if response.apparent_encoding == 'ascii':
-                    with open(fname, 'wb') as myfile:
-                        myfile.write(response.text.encode('utf-8'))
-                else:
-                    with open(fname, 'wb') as myfile:
-                        myfile.write(response.content)
+                # Bodies used to be re-encoded only when they were
+                # ASCII, which UTF-8 leaves as is, so write them as is.
+                save_response(response, fname, text=False, logger=logger)
 
-                logger.debug('URL reponse data from &s saved to %s.',
+                logger.debug('URL reponse data from %s saved to %s.',
                              url, fname)
             else:
                 logger.debug('Response not OK')
 
     except requests.exceptions.RequestException as err:
         logger.info('Error with %s: "%s".', host, err)
+        fail(err)
 
     except Exception as err:
         logger.error('Unexpected error with %s: %s', host, err)
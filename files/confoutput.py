@@ -0,0 +1,510 @@
+# THIS FILE MANANGED BY PUPPET.
+''' confoutput.py
+
+    Shared output stage for collectors. Fetched content is hashed and
+    compared with a per-repo manifest of what is already on disk; the
+    destination file is only replaced (atomically) when its content
+    changed. Unchanged files keep their mtime, so neither the
+    collectors nor `git status` in gitcheck have to touch them.
+
+    A job's normalization filters (see normalize.py) are applied on the
+    way in, so the hash, and the file, are of the normalized content.
+    Large or binary files of jobs with an artifact store go to the store
+    (see artifactstore.py), and the file written is a pointer to them.'''
+
+import errno
+import hashlib
+import json
+import os
+import shutil
+from contextlib import ExitStack, contextmanager
+from tempfile import mkstemp
+from threading import Lock
+
+import artifactstore
+import normalize
+from resourcegroups import throttle
+from runreport import add_bytes, phase
+
+MANIFEST_NAME = 'confcollect-manifest.json'
+PENDING_NAME = 'confcollect-pending.json'
+CHUNK_SIZE = 1024 * 1024
+
+# os.umask() can only be read by setting it, so do that once at import.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+_STAGES = {}
+_STAGES_LOCK = Lock()
+
+
+def write_text(fname, text, mode=None):
+    '''Replace fname with text atomically, via a temp file beside it.
+    mode, if given, sets the new file's permissions.'''
+    fdesc, tmpname = _temp_beside(fname)
+    try:
+        with os.fdopen(fdesc, 'w') as filep:
+            filep.write(text)
+        if mode is not None:
+            os.chmod(tmpname, mode)
+        os.replace(tmpname, fname)
+    except BaseException:
+        if os.path.exists(tmpname):
+            os.unlink(tmpname)
+        raise
+
+
+def load_json(fname, key=None):
+    '''The JSON object in fname, or its member key; None if the file is
+    missing or unreadable.'''
+    try:
+        with open(fname, 'r') as filep:
+            data = json.load(filep)
+        return data if key is None else data.get(key)
+    except (IOError, ValueError, AttributeError):
+        return None
+
+
+def save_json(fname, data):
+    '''Write data to fname atomically as JSON.'''
+    write_text(fname, json.dumps(data, indent=0, sort_keys=True))
+
+
+def hash_file(fname):
+    '''Return the sha256 hex digest of a file, read in chunks.'''
+    digest = hashlib.sha256()
+    with open(fname, 'rb') as filep:
+        for chunk in iter(lambda: filep.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _state_file(repo_dir, name):
+    '''Where confcollect keeps file name for repo_dir: in .git, out of
+    the worktree, if there is one.'''
+    gitdir = os.path.join(repo_dir, '.git')
+    if os.path.isdir(gitdir):
+        return os.path.join(gitdir, name)
+    return os.path.join(repo_dir, '.' + name)
+
+
+def pending_paths(repo_dir):
+    '''Paths (relative to repo_dir) changed by this or earlier runs and
+    not committed yet.'''
+    fname = _state_file(os.path.realpath(repo_dir), PENDING_NAME)
+    return sorted(load_json(fname) or [])
+
+
+def clear_pending(repo_dir, paths):
+    '''Forget paths once they are committed.'''
+    fname = _state_file(os.path.realpath(repo_dir), PENDING_NAME)
+    pending = set(load_json(fname) or [])
+    if pending.intersection(paths):
+        save_json(fname, sorted(pending.difference(paths)))
+
+
+class OutputStage():
+    '''Content manifest and change list for one repo_dir.'''
+
+    def __init__(self, repo_dir):
+        self.repo_dir = os.path.realpath(repo_dir)
+        self.manifest_file = _state_file(self.repo_dir, MANIFEST_NAME)
+        self.pending_file = _state_file(self.repo_dir, PENDING_NAME)
+        self.lock = Lock()
+        self.changed = []
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        '''Read the manifest from disk, if there is one.'''
+        self.entries = load_json(self.manifest_file) or {}
+
+    def save(self):
+        '''Write the manifest back to disk atomically, and add the
+        changed paths to the ones still to commit (see pending_paths()).'''
+        with self.lock:
+            data = json.dumps(self.entries, indent=0, sort_keys=True)
+            changed = set(self.changed)
+        write_text(self.manifest_file, data)
+        if changed:
+            pending = changed.union(load_json(self.pending_file) or [])
+            save_json(self.pending_file, sorted(pending))
+
+    def relpath(self, fname):
+        '''Path of fname relative to repo_dir.'''
+        return os.path.relpath(os.path.realpath(fname), self.repo_dir)
+
+    def is_current(self, fname, digest, size):
+        '''Return True when fname already holds content with digest.'''
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            return False
+        if stat.st_size != size:
+            return False
+
+        rel = self.relpath(fname)
+        with self.lock:
+            entry = self.entries.get(rel)
+        if entry is not None and entry['size'] == stat.st_size and \
+                entry['mtime_ns'] == stat.st_mtime_ns:
+            return entry['sha256'] == digest
+
+        # Unknown or stale entry; hash what is on disk and remember it
+        current = hash_file(fname)
+        self.record(fname, current, stat)
+        return current == digest
+
+    def record(self, fname, digest, stat=None, changed=False):
+        '''Remember the digest and stat of fname. Freshness metadata
+        (see meta()) is kept only while the digest stays the same.'''
+        if stat is None:
+            stat = os.stat(fname)
+        rel = self.relpath(fname)
+        with self.lock:
+            old = self.entries.get(rel, {})
+            entry = {'sha256': digest,
+                     'size': stat.st_size,
+                     'mtime_ns': stat.st_mtime_ns}
+            if old.get('sha256') == digest and 'meta' in old:
+                entry['meta'] = old['meta']
+            self.entries[rel] = entry
+            if changed:
+                self.changed.append(rel)
+
+    def meta(self, fname):
+        '''Return the freshness metadata (validators, fetch time) stored
+        for fname, or None unless fname is exactly what was recorded.'''
+        try:
+            stat = os.stat(fname)
+        except OSError:
+            return None
+        with self.lock:
+            entry = self.entries.get(self.relpath(fname))
+            if entry is None or entry['size'] != stat.st_size or \
+                    entry['mtime_ns'] != stat.st_mtime_ns:
+                return None
+            return dict(entry.get('meta', {}))
+
+    def set_meta(self, fname, meta):
+        '''Store freshness metadata for fname, which must have been
+        recorded already.'''
+        with self.lock:
+            entry = self.entries.get(self.relpath(fname))
+            if entry is not None:
+                entry['meta'] = meta
+
+
+class _NoStage():
+    '''Stand-in for files outside any repo_dir: compare with the file on
+    disk, keep no manifest.'''
+
+    @staticmethod
+    def is_current(fname, digest, size):
+        '''Return True when fname already holds content with digest.'''
+        try:
+            if os.stat(fname).st_size != size:
+                return False
+            return hash_file(fname) == digest
+        except OSError:
+            return False
+
+    @staticmethod
+    def record(fname, digest, stat=None, changed=False):
+        '''Nothing to remember.'''
+
+    @staticmethod
+    def meta(fname):
+        '''No freshness metadata without a manifest.'''
+        return None
+
+    @staticmethod
+    def set_meta(fname, meta):
+        '''Nothing to remember.'''
+
+
+def open_stage(repo_dir):
+    '''Return the OutputStage for repo_dir, creating it if needed.'''
+    key = os.path.realpath(repo_dir)
+    with _STAGES_LOCK:
+        if key not in _STAGES:
+            _STAGES[key] = OutputStage(key)
+        return _STAGES[key]
+
+
+def stage_for(fname):
+    '''Return the stage whose repo_dir holds fname (deepest wins).'''
+    real = os.path.realpath(fname)
+    best = None
+    with _STAGES_LOCK:
+        for repo_dir, stage in _STAGES.items():
+            if real.startswith(repo_dir + os.sep) and \
+                    (best is None or len(repo_dir) > len(best.repo_dir)):
+                best = stage
+    return _NoStage if best is None else best
+
+
+def close_stages():
+    '''Save every manifest. Return {repo_dir: [changed relative paths]}
+    and forget the stages.'''
+    with _STAGES_LOCK:
+        stages = list(_STAGES.values())
+        _STAGES.clear()
+
+    changed = {}
+    for stage in stages:
+        stage.save()
+        changed[stage.repo_dir] = sorted(set(stage.changed))
+    return changed
+
+
+def _file_mode(fname):
+    '''Mode for a replacement of fname: keep the existing file's mode,
+    or use what open() would have created.'''
+    try:
+        return os.stat(fname).st_mode & 0o7777
+    except OSError:
+        return 0o666 & ~_UMASK
+
+
+def _replace(tmpname, fname):
+    '''os.replace(), falling back to a copy into fname's directory when
+    tmpname lives on another filesystem.'''
+    try:
+        os.replace(tmpname, fname)
+    except OSError as err:
+        if err.errno != errno.EXDEV:
+            raise
+        fdesc, local = mkstemp(dir=os.path.dirname(fname) or '.',
+                               prefix='.%s.' % os.path.basename(fname),
+                               suffix='.tmp')
+        os.close(fdesc)
+        try:
+            shutil.copyfile(tmpname, local)
+            os.replace(local, fname)
+        except BaseException:
+            os.unlink(local)
+            raise
+        os.unlink(tmpname)
+
+
+def _raw_name(fname):
+    '''Where the current job keeps the raw copy of fname, or None.'''
+    raw_dir = normalize.raw_dir()
+    if raw_dir is None:
+        return None
+    repo_dir = getattr(stage_for(fname), 'repo_dir', None)
+    if repo_dir is None:
+        return os.path.join(raw_dir, os.path.basename(fname))
+    return os.path.join(raw_dir,
+                        os.path.relpath(os.path.realpath(fname), repo_dir))
+
+
+def _temp_beside(fname):
+    '''Make a temp file beside fname; return (fd, name).'''
+    return mkstemp(dir=os.path.dirname(os.path.abspath(fname)),
+                   prefix='.%s.' % os.path.basename(fname), suffix='.tmp')
+
+
+def _normalize_file(tmpname, fname, normalizer):
+    '''Stream tmpname through normalizer into a new temp file beside it,
+    then keep tmpname as fname's raw copy, or delete it. Return (new
+    temp file, digest, size, raw size).'''
+    fdesc, normname = _temp_beside(tmpname)
+    raw_size = 0
+    try:
+        with open(tmpname, 'rb') as src, os.fdopen(fdesc, 'wb') as dst:
+            hfile = _HashingFile(dst)
+            for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                raw_size += len(chunk)
+                hfile.put(normalizer.feed(chunk))
+            hfile.put(normalizer.close())
+
+        raw_name = _raw_name(fname)
+        if raw_name is None:
+            os.unlink(tmpname)
+        else:
+            os.makedirs(os.path.dirname(raw_name), exist_ok=True)
+            _replace(tmpname, raw_name)
+    except BaseException:
+        os.unlink(normname)
+        raise
+    return normname, hfile.digest.hexdigest(), hfile.size, raw_size
+
+
+def _store_artifact(tmpname, store):
+    '''Put tmpname in store and replace it with a pointer file beside
+    it. Return (pointer temp file, digest, size).'''
+    data = artifactstore.pointer_bytes(store.put_file(tmpname))
+    fdesc, pointername = _temp_beside(tmpname)
+    try:
+        with os.fdopen(fdesc, 'wb') as filep:
+            filep.write(data)
+    except BaseException:
+        os.unlink(pointername)
+        raise
+    os.unlink(tmpname)
+    return pointername, hashlib.sha256(data).hexdigest(), len(data)
+
+
+def commit_file(tmpname, fname, digest=None, size=None, logger=None,
+                fetched=None):
+    '''Move a finished temp file into place as fname if its content
+    differs from what fname holds; otherwise discard it. Without a
+    digest, tmpname is taken as fetched and the current job's filters
+    are applied first. fetched is the byte count before filtering.
+    Content the current job's artifact store takes is replaced by a
+    pointer to it. Return True when fname changed.'''
+    ours = None  # a temp file made here, which the caller cannot remove
+    with phase('write'):
+        try:
+            if digest is None:
+                normalizer = normalize.normalizer()
+                if normalizer is not None:
+                    tmpname, digest, size, fetched = _normalize_file(
+                        tmpname, fname, normalizer)
+                    ours = tmpname
+            if digest is None:
+                digest = hash_file(tmpname)
+            if size is None:
+                size = os.stat(tmpname).st_size
+            if fetched is None:
+                fetched = size
+            store = artifactstore.store_for(tmpname, size)
+            if store is not None:
+                tmpname, digest, size = _store_artifact(tmpname, store)
+                ours = tmpname
+
+            stage = stage_for(fname)
+            if stage.is_current(fname, digest, size):
+                os.unlink(tmpname)
+                add_bytes(fetched)
+                if logger is not None:
+                    logger.debug('%s unchanged; not rewritten.', fname)
+                return False
+
+            os.chmod(tmpname, _file_mode(fname))
+            _replace(tmpname, fname)
+            stage.record(fname, digest, changed=True)
+            add_bytes(fetched, changed=True)
+            if logger is not None:
+                logger.debug('%s changed; replaced.', fname)
+            return True
+        finally:
+            if ours is not None and os.path.exists(ours):
+                os.unlink(ours)
+
+
+def commit_tree(srcdir, destdir, logger=None):
+    '''commit_file() every file under srcdir to the same relative path
+    under destdir. Return the list of destination files that changed.'''
+    changed = []
+    for root, _, files in os.walk(srcdir):
+        target = os.path.join(destdir, os.path.relpath(root, srcdir))
+        os.makedirs(target, exist_ok=True)
+        for name in files:
+            dest = os.path.join(target, name)
+            if commit_file(os.path.join(root, name), dest, logger=logger):
+                changed.append(dest)
+    return changed
+
+
+class _HashingFile():
+    '''Write-only file wrapper that hashes and counts what it writes,
+    after passing it through normalizer (if any). The raw data also
+    goes to rawp, if given.'''
+
+    def __init__(self, filep, encoding=None, normalizer=None, rawp=None):
+        self.filep = filep
+        self.encoding = encoding
+        self.normalizer = normalizer
+        self.rawp = rawp
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.fetched = 0
+        self.changed = None
+
+    def put(self, data):
+        '''Hash, count and write bytes as they are.'''
+        self.digest.update(data)
+        self.size += len(data)
+        self.filep.write(data)
+
+    def write(self, data):
+        '''Write str (text mode) or bytes.'''
+        if self.encoding is not None:
+            data = data.encode(self.encoding)
+        throttle(len(data))
+        self.fetched += len(data)
+        if self.rawp is not None:
+            self.rawp.write(data)
+        if self.normalizer is not None:
+            self.put(self.normalizer.feed(data))
+        else:
+            self.put(data)
+        return len(data)
+
+    def writelines(self, lines):
+        '''Write an iterable of str or bytes.'''
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        '''Flush the underlying file.'''
+        self.filep.flush()
+
+    def finish(self):
+        '''Write what the normalizer held back to the end.'''
+        if self.normalizer is not None:
+            self.put(self.normalizer.close())
+
+    @property
+    def name(self):
+        '''Name of the temp file being written.'''
+        return self.filep.name
+
+
+@contextmanager
+def atomic_write(fname, mode='wb', encoding='utf-8', logger=None):
+    '''Context manager yielding a file-like object for the new content of
+    fname. The content goes to a temp file beside fname, which replaces
+    fname on success only if the content changed; on error, fname is
+    left alone. The current job's filters are applied as data is
+    written, and its raw copy, if it keeps one, replaced. After the
+    block, the object's .changed says whether fname was replaced.'''
+    fdesc, tmpname = _temp_beside(fname)
+    normalizer = normalize.normalizer()
+    raw_name = None if normalizer is None else _raw_name(fname)
+    rawtmp = None
+    try:
+        with ExitStack() as stack:
+            filep = stack.enter_context(os.fdopen(fdesc, 'wb'))
+            rawp = None
+            if raw_name is not None:
+                os.makedirs(os.path.dirname(raw_name), exist_ok=True)
+                rawfd, rawtmp = _temp_beside(raw_name)
+                rawp = stack.enter_context(os.fdopen(rawfd, 'wb'))
+            hfile = _HashingFile(filep, None if 'b' in mode else encoding,
+                                 normalizer, rawp)
+            yield hfile
+            hfile.finish()
+        if rawtmp is not None:
+            os.replace(rawtmp, raw_name)
+        hfile.changed = commit_file(tmpname, fname,
+                                    hfile.digest.hexdigest(), hfile.size,
+                                    logger=logger, fetched=hfile.fetched)
+    except BaseException:
+        for name in (tmpname, rawtmp):
+            if name is not None and os.path.exists(name):
+                os.unlink(name)
+        raise
+
+
+def write_output(fname, data, encoding='utf-8', logger=None):
+    '''Write str or bytes to fname via atomic_write(). Return True when
+    fname changed.'''
+    mode = 'w' if isinstance(data, str) else 'wb'
+    with atomic_write(fname, mode, encoding=encoding,
+                      logger=logger) as filep:
+        filep.write(data)
+    return filep.changed
@@ -0,0 +1,122 @@
+# THIS FILE MANANGED BY PUPPET.
+''' extsort.py
+
+    Bounded-memory line sort for collected files. Lines are read in
+    runs of at most buffer_size bytes; each run is sorted in memory and,
+    if the file does not fit in one run, spilled to a temp file. The
+    runs are then merged into a temp file that atomically replaces the
+    original.
+
+    Lines are sorted as bytes. For UTF-8 that is the same order as
+    sorting the decoded text, and files that are not valid UTF-8 sort
+    too. CRLF line endings become LF, as they did when files were
+    sorted in text mode, and a missing final newline is added so the
+    last line cannot run into whichever line follows it.'''
+
+import heapq
+import os
+from contextlib import ExitStack
+from tempfile import mkstemp
+
+BUFFER_SIZE = 32 * 1024 * 1024  # bytes of lines held in memory per run
+LINE_OVERHEAD = 64              # rough per-line cost of a bytes object
+MAX_FANIN = 64                  # runs merged at once
+IO_BUFFER = 256 * 1024
+
+
+def _line(line):
+    '''Normalize the line ending of one line.'''
+    if line.endswith(b'\r\n'):
+        return line[:-2] + b'\n'
+    if not line.endswith(b'\n'):
+        return line + b'\n'
+    return line
+
+
+def _tempfile(dirname, fname, suffix):
+    '''Make a temp file beside fname and return its name.'''
+    fdesc, tmpname = mkstemp(dir=dirname,
+                             prefix='.%s.' % os.path.basename(fname),
+                             suffix=suffix)
+    os.close(fdesc)
+    return tmpname
+
+
+def _write_run(lines, dirname, fname):
+    '''Spill a sorted run to a temp file and return its name.'''
+    tmpname = _tempfile(dirname, fname, '.run')
+    with open(tmpname, 'wb', buffering=IO_BUFFER) as filep:
+        filep.writelines(lines)
+    return tmpname
+
+
+def _merge(runs, dest):
+    '''Merge sorted run files into dest.'''
+    with ExitStack() as stack:
+        inputs = [stack.enter_context(open(run, 'rb', buffering=IO_BUFFER))
+                  for run in runs]
+        with open(dest, 'wb', buffering=IO_BUFFER) as filep:
+            filep.writelines(heapq.merge(*inputs))
+
+
+def sort_file(fname, buffer_size=BUFFER_SIZE):
+    '''Sort the lines of fname in place, holding at most about
+    buffer_size bytes of lines in memory. Return the number of runs
+    spilled to disk (0 when the file was sorted in memory).'''
+    dirname = os.path.dirname(os.path.abspath(fname))
+    runs = []
+    spilled = 0
+    tmpname = None
+    try:
+        lines = []
+        held = 0
+        with open(fname, 'rb', buffering=IO_BUFFER) as filep:
+            for line in filep:
+                line = _line(line)
+                lines.append(line)
+                held += len(line) + LINE_OVERHEAD
+                if held >= buffer_size:
+                    lines.sort()
+                    runs.append(_write_run(lines, dirname, fname))
+                    lines = []
+                    held = 0
+        lines.sort()
+
+        if not runs:  # it all fit in memory
+            tmpname = _write_run(lines, dirname, fname)
+        else:
+            if lines:
+                runs.append(_write_run(lines, dirname, fname))
+            spilled = len(runs)
+            lines = None
+            # Merge in passes of MAX_FANIN runs to bound open files
+            while len(runs) > MAX_FANIN:
+                merged = _tempfile(dirname, fname, '.run')
+                _merge(runs[:MAX_FANIN], merged)
+                for run in runs[:MAX_FANIN]:
+                    os.unlink(run)
+                runs = runs[MAX_FANIN:] + [merged]
+            tmpname = _tempfile(dirname, fname, '.tmp')
+            _merge(runs, tmpname)
+
+        os.chmod(tmpname, os.stat(fname).st_mode & 0o7777)
+        os.replace(tmpname, fname)
+        tmpname = None
+        return spilled
+    finally:
+        for run in runs + [tmpname]:
+            if run is not None and os.path.exists(run):
+                os.unlink(run)
+
+
+def sort_tree(dirname, buffer_size=BUFFER_SIZE):
+    '''sort_file() every regular file under dirname. Return the number
+    of files sorted.'''
+    count = 0
+    for root, _, files in os.walk(dirname):
+        for name in files:
+            fname = os.path.join(root, name)
+            if os.path.isfile(fname) and not os.path.islink(fname):
+                sort_file(fname, buffer_size)
+                count += 1
+    return count
@@ -0,0 +1,214 @@
+# THIS FILE MANANGED BY PUPPET.
+''' freshness.py
+
+    Skip transfers of configs that have not changed since the last run.
+    Each job has a policy, set in its getconfs.json section:
+
+      "freshness": "conditional"  (the default) Ask the device whether
+          the config changed. HTTP collectors send If-None-Match and
+          If-Modified-Since when the device gave us an ETag or
+          Last-Modified before. SCP only asks for device_types listed
+          in SFTP_STAT (or sections with "sftp_stat": true), since the
+          SFTP stat is an extra round trip that SCP-only devices fail:
+          it compares the remote file's size and mtime with those seen
+          at the last transfer.
+      "freshness": "interval", "max_age": <seconds>  Leave the device
+          alone until max_age has passed since the last fetch, then
+          fetch conditionally.
+      "freshness": "always"  Always fetch everything.
+
+    "delay_days", the old Peplink-only setting, still works and means
+    "interval" with a max_age of that many days. Collectors may set a
+    FRESHNESS = (policy, max_age) default of their own.
+
+    Validators and fetch times live in the output stage's manifest
+    beside the content hashes, and only count while the file on disk is
+    the one they were stored with.'''
+
+import os
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from threading import local
+from time import time
+
+from confoutput import stage_for
+from runreport import add_skipped
+
+POLICIES = ('always', 'conditional', 'interval')
+DEFAULT = ('conditional', None)
+
+_CURRENT = local()
+
+
+class Policy():
+    '''How eagerly one job fetches.'''
+
+    def __init__(self, mode=DEFAULT[0], max_age=DEFAULT[1], stat=False):
+        if mode not in POLICIES:
+            raise ValueError('freshness must be one of %s, not %r' %
+                             (', '.join(POLICIES), mode))
+        if mode == 'interval' and max_age is None:
+            raise ValueError('freshness "interval" needs a max_age')
+        self.mode = mode
+        self.max_age = None if max_age is None else float(max_age)
+        self.stat = stat  # SCP may stat the remote file over SFTP
+
+    def __repr__(self):
+        return 'Policy(%r, %r, stat=%r)' % (self.mode, self.max_age,
+                                            self.stat)
+
+
+def parse_stat_types(setting):
+    '''Check the SFTP_STAT section of getconfs.json: a list of
+    device_type globs whose SCP jobs stat the remote file.'''
+    if setting is None:
+        return ()
+    if not isinstance(setting, list) or \
+            not all(isinstance(glob, str) for glob in setting):
+        raise ValueError('SFTP_STAT must be a list of device_type globs')
+    return tuple(setting)
+
+
+def pop_stat(kwargs, stat_types):
+    '''Remove "sftp_stat" from a job's kwargs and return whether its
+    SCP transfer may be skipped after an SFTP stat: the section's own
+    setting, else whether its device_type matches one of stat_types.'''
+    stat = kwargs.pop('sftp_stat', None)
+    if stat is None:
+        return any(fnmatchcase(kwargs.get('device_type', ''), glob)
+                   for glob in stat_types)
+    if not isinstance(stat, bool):
+        raise ValueError('sftp_stat must be true or false, not %r' % stat)
+    return stat
+
+
+def pop_policy(kwargs, default=None, stat=False):
+    '''Remove freshness settings from a job's kwargs and return its
+    Policy. default is the collector's (policy, max_age), if any; stat
+    is what pop_stat() said.'''
+    mode = kwargs.pop('freshness', None)
+    max_age = kwargs.pop('max_age', None)
+    delay_days = kwargs.pop('delay_days', None)
+
+    if mode is None and max_age is None and delay_days is not None:
+        mode, max_age = 'interval', delay_days * 86400.
+    if mode is None and max_age is not None:
+        mode = 'interval'
+    if mode is None:
+        mode, max_age = default or DEFAULT
+    return Policy(mode, max_age, stat)
+
+
+@contextmanager
+def job_policy(policy):
+    '''Make policy the current job's policy in this thread.'''
+    previous = getattr(_CURRENT, 'policy', None)
+    _CURRENT.policy = policy
+    try:
+        yield policy
+    finally:
+        _CURRENT.policy = previous
+
+
+def policy():
+    '''The current job's Policy (the default outside a job).'''
+    return getattr(_CURRENT, 'policy', None) or Policy()
+
+
+def _skip(fname, logger, why):
+    '''Count and log a skipped transfer.'''
+    add_skipped()
+    if logger is not None:
+        logger.info('%s is fresh (%s); not fetched.', fname, why)
+
+
+def _meta(fname):
+    '''Stored metadata for fname, unless the policy ignores it.'''
+    if policy().mode == 'always':
+        return {}
+    return stage_for(fname).meta(fname) or {}
+
+
+def remember(fname, **validators):
+    '''Store validators (those not None) and the fetch time for fname,
+    which has just been written or confirmed current.'''
+    meta = dict((key, value) for key, value in validators.items()
+                if value is not None)
+    meta['fetched'] = time()
+    stage_for(fname).set_meta(fname, meta)
+
+
+def should_fetch(fname, logger=None):
+    '''Return False, after logging why, when an "interval" policy says
+    fname was fetched recently enough to leave the device alone.'''
+    pol = policy()
+    if pol.mode != 'interval':
+        return True
+
+    fetched = _meta(fname).get('fetched')
+    if fetched is None:  # e.g. a first run; go by mtime as delay_days did
+        try:
+            fetched = os.stat(fname).st_mtime
+        except OSError:
+            return True
+
+    age = time() - fetched
+    if age < pol.max_age:
+        _skip(fname, logger, 'fetched %.1f days ago' % (age / 86400.))
+        return False
+    return True
+
+
+def http_headers(fname):
+    '''Conditional request headers for refetching fname.'''
+    meta = _meta(fname)
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('last_modified'):
+        headers['If-Modified-Since'] = meta['last_modified']
+    return headers
+
+
+def not_modified(response, fname, logger=None):
+    '''Return True, after counting the skip, when response is a 304 Not
+    Modified for fname.'''
+    if response.status_code != 304:
+        return False
+    meta = _meta(fname)
+    remember(fname,
+             etag=response.headers.get('ETag', meta.get('etag')),
+             last_modified=response.headers.get('Last-Modified',
+                                                meta.get('last_modified')))
+    _skip(fname, logger, 'HTTP 304')
+    return True
+
+
+def remember_http(fname, response):
+    '''Store the validators of a 2xx response just saved to fname.'''
+    if response.ok:
+        remember(fname, etag=response.headers.get('ETag'),
+                 last_modified=response.headers.get('Last-Modified'))
+
+
+def remember_remote(fname, size, mtime, stat_time):
+    '''Store the remote size and mtime of fname, just transferred after
+    a stat at stat_time. An mtime in the second of the stat (or later)
+    is not stored: the file could still change within that second
+    without its size or mtime changing, and the next run would skip
+    it.'''
+    if int(mtime) >= int(stat_time):
+        remember(fname)
+    else:
+        remember(fname, remote_size=size, remote_mtime=mtime)
+
+
+def remote_unchanged(fname, size, mtime, logger=None):
+    '''Return True, after counting the skip, when the remote file's size
+    and mtime match those stored with fname.'''
+    meta = _meta(fname)
+    if meta.get('remote_size') != size or meta.get('remote_mtime') != mtime:
+        return False
+    remember(fname, remote_size=size, remote_mtime=mtime)
+    _skip(fname, logger, 'remote size and mtime unchanged')
+    return True
@@ -9,30 +9,39 @@
 import sys
 
 from argparse import ArgumentParser
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from getpass import getuser
 from os import path
 from logging import DEBUG
 from logging import ERROR
 from logging import INFO
-from multiprocessing.dummy import Pool
 from multiprocessing import cpu_count
 from pprint import pformat
+from socket import getfqdn
+from time import ctime, time
 import json
 
 # Import custom libs from ../lib/python, relative to this file...
 sys.path.append(path.join(path.dirname(path.dirname(path.abspath(__file__))),
                           'lib',
                           'python'))
-import collectadvantech
-import collectmediacento
-import collectpeplink
-import collectpepperlfuchs
-import collectpfsense
-import collectqflex
-import collectscp
-import collectssh
-import collectsshcmd
-from gitcheck import git_check_add_commit_pull_push
+import artifactstore
+import collectregistry
+import freshness
+import jobhistory
+import normalize
+import postprocess
+import reachability
+import resolver
+import resourcegroups
+import runreport
+import runstate
+import sessionpool
+import sharding
+import somtsfilelog
+from confoutput import clear_pending, close_stages, open_stage, pending_paths
+from runengine import run_jobs
 from somtsfilelog import setup_logger
 
 
@@ -56,66 +65,523 @@ def get_arguments():
                         help="No console output (for running from cron)")
     parser.add_argument('-g', '--git', action='store_true',
                         dest='git', help='Turn on git check and commit.')
+    parser.add_argument('--git-mode', action='store',
+                        choices=('worktree', 'changed'), default='worktree',
+                        dest='git_mode',
+                        help='"worktree" runs git status/add -A over the ' +
+                        'whole repo; "changed" stages and commits only ' +
+                        'the paths this run changed. Default: worktree.')
+    parser.add_argument('--push-tries', action='store', type=int,
+                        default=5, dest='push_tries',
+                        help='Pull/push attempts per repo when other ' +
+                        'nodes push first. Default: 5.')
+    parser.add_argument('--push-backoff', action='store', type=float,
+                        default=2., dest='push_backoff',
+                        help='Seconds of backoff before the first push ' +
+                        'retry, doubling (with jitter) each time. ' +
+                        'Default: 2.')
     parser.add_argument('-t', '--threads', action='store', type=int,
                         default=pool_size, dest='pool_size',
                         help='Number of threads. Default: %i.' % pool_size)
+    parser.add_argument('--cpu-workers', action='store', type=int,
+                        default=postprocess.PROCESSES, dest='cpu_workers',
+                        help='Processes for CPU-bound post-processing ' +
+                        '(sorting, decoding); 0 runs it in the job\'s ' +
+                        'thread. Default: %i.' % postprocess.PROCESSES)
+    parser.add_argument('--ssh-per-host', action='store', type=int,
+                        default=sessionpool.PER_HOST, dest='ssh_per_host',
+                        help='Max shared SSH sessions open per host. ' +
+                        'Default: %i.' % sessionpool.PER_HOST)
+    parser.add_argument('--ssh-idle-timeout', action='store', type=float,
+                        default=sessionpool.IDLE_TIMEOUT,
+                        dest='ssh_idle_timeout',
+                        help='Seconds an unused shared SSH session stays ' +
+                        'open. Default: %i.' % sessionpool.IDLE_TIMEOUT)
     parser.add_argument('-l', '--logdir', action='store',
                         default=log_dir, dest='log_dir',
                         help='Log dir to store logs in. Default: %s.' % log_dir
                         )
+    parser.add_argument('--log-max-bytes', action='store', type=int,
+                        default=0, dest='log_max_bytes',
+                        help='Rotate a log file once it reaches this size. ' +
+                        'Default: 0 (leave rotation to logrotate).')
+    parser.add_argument('--log-rotate-when', action='store', default=None,
+                        dest='log_rotate_when', metavar='WHEN',
+                        help='Rotate log files on a schedule, e.g. ' +
+                        '"midnight" (as for TimedRotatingFileHandler). ' +
+                        'Overrides --log-max-bytes.')
+    parser.add_argument('--log-backups', action='store', type=int,
+                        default=7, dest='log_backups',
+                        help='Rotated log files to keep. Default: 7.')
+    parser.add_argument('--log-max-open', action='store', type=int,
+                        default=somtsfilelog.MAX_OPEN_FILES,
+                        dest='log_max_open',
+                        help='Max log files held open at once. ' +
+                        'Default: %i.' % somtsfilelog.MAX_OPEN_FILES)
+    parser.add_argument('-r', '--report', action='store',
+                        default=None, dest='report',
+                        help='JSON-lines run report to write. ' +
+                        'Default: getconfs.report.jsonl in --logdir.')
+    parser.add_argument('-p', '--prom-file', action='store',
+                        default=None, dest='prom_file',
+                        help='Prometheus textfile-collector file to ' +
+                        'write. Default: getconfs.prom in --logdir.')
+    parser.add_argument('-o', '--order', action='store',
+                        choices=('history', 'config'), default='history',
+                        dest='order',
+                        help='"history" starts the jobs expected to take ' +
+                        'longest first; "config" keeps getconfs.json ' +
+                        'order. Default: history.')
+    parser.add_argument('--history', action='store', default=None,
+                        dest='history',
+                        help='Job duration history file. ' +
+                        'Default: getconfs.history.json in --logdir.')
+    parser.add_argument('--retry-failed', action='store_true',
+                        default=False, dest='retry_failed',
+                        help='Only run the jobs that did not succeed ' +
+                        'last time they ran.')
+    parser.add_argument('--only', action='append', default=[],
+                        dest='only', metavar='GLOB',
+                        help='Only run jobs whose section, host or ' +
+                        'device_type matches GLOB. May be repeated.')
+    parser.add_argument('--state', action='store', default=None,
+                        dest='state',
+                        help='Last outcome per job, for --retry-failed. ' +
+                        'Default: getconfs.state.json in --logdir.')
+    parser.add_argument('--shard', action='store', default=None,
+                        dest='shard', metavar='K/N',
+                        help='Only run this node\'s share of the jobs, ' +
+                        'as node K of N.')
+    parser.add_argument('--shard-nodes', action='store', default=None,
+                        dest='shard_nodes', metavar='NODE,...',
+                        help='Only run this node\'s share of the jobs, ' +
+                        'split across these named nodes.')
+    parser.add_argument('--shard-node', action='store', default=None,
+                        dest='shard_node',
+                        help='This node\'s name in --shard-nodes. ' +
+                        'Default: this host\'s FQDN.')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        default=False, dest='dry_run',
+                        help='List the sections this run would collect, ' +
+                        'and which shard each belongs to, then exit.')
+    parser.add_argument('--pin-dns', action='store_true', default=False,
+                        dest='pin_dns',
+                        help='Resolve every host at the start of the run ' +
+                        'and have every DNS lookup in this process ' +
+                        'answered from those results; hosts that do not ' +
+                        'resolve are skipped.')
+    parser.add_argument('--dns-ttl', action='store', type=float,
+                        default=resolver.TTL, dest='dns_ttl',
+                        help='Seconds a host resolved with --pin-dns ' +
+                        'stays pinned. Default: %g.' % resolver.TTL)
+    parser.add_argument('--preflight-timeout', action='store', type=float,
+                        default=0, dest='preflight_timeout',
+                        help='Seconds to wait for each host to accept a ' +
+                        'TCP connection before jobs start; hosts that do ' +
+                        'not are skipped until their backoff runs out. ' +
+                        'Default: 0 (no check); try %g.' %
+                        reachability.TIMEOUT)
+    parser.add_argument('--dead-hosts', action='store', default=None,
+                        dest='dead_hosts',
+                        help='Cache of unreachable hosts. ' +
+                        'Default: getconfs.deadhosts.json in --logdir.')
     parser.add_argument('-j', '--json', action='store',
                         dest='json', default=myjson,
                         help='.json file to use for config. Default: %s' % json
                         )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    try:
+        get_shard(args)
+    except ValueError as err:
+        parser.error(str(err))
+    return args
 
 
-def worker_wrapper(arg):
-    '''Take structured data and turn it into args and/or kwargs for a
-    cfgworker().  By default, we assume this is an SCP daemon via
-    Netmiko, but we also catch specialized cases too.'''
-    args, kwargs = arg
+def get_collector(kwargs):
+    '''Pick the collector module for a job, adjusting kwargs in place to
+    suit its cfgworker().  By default, we assume this is an SCP daemon
+    via Netmiko, but collectregistry catches specialized cases too.'''
 
     kwargs.pop('repo_dir', None)  # remove repo_dir from kwargs
 
-    if kwargs['device_type'] == 'advantech':
-        kwargs.pop('device_type', None)  # remove device_type from kwargs
-        return collectadvantech.cfgworker(*args, **kwargs)
-
-    elif kwargs['device_type'] == 'mediacento':
-        kwargs.pop('device_type', None)  # remove device_type from kwargs
-        return collectmediacento.cfgworker(*args, **kwargs)
+    return collectregistry.get_collector(kwargs)
 
-    elif kwargs['device_type'] == 'peplink':
-        kwargs.pop('device_type', None)  # remove device_type from kwargs
-        return collectpeplink.cfgworker(*args, **kwargs)
 
-    if kwargs['device_type'] == 'pepperlfuchs':
-        kwargs.pop('device_type', None)  # remove device_type from kwargs
-        return collectpepperlfuchs.cfgworker(*args, **kwargs)
+def job_record(args, kwargs, meta):
+    '''Start a runreport.JobRecord for a job.'''
+    return runreport.JobRecord(meta['section'], args[0],
+                               device_type=kwargs.get('device_type'),
+                               repo_dir=meta.get('repo_dir'),
+                               predicted=meta.get('predicted'),
+                               estimate=meta.get('estimate'),
+                               resource_groups=[
+                                   group.name
+                                   for group in meta.get('groups', ())])
 
-    elif kwargs['device_type'] == 'pfsense':
-        kwargs.pop('device_type', None)  # remove device_type from kwargs
-        return collectpfsense.cfgworker(*args, **kwargs)
 
-    elif kwargs['device_type'] == 'qflex':
-        kwargs.pop('device_type', None)  # remove device_type from kwargs
-        return collectqflex.cfgworker(*args, **kwargs)
-
-    elif kwargs['device_type'] == 'cisco_s300':  # No SCP on Cisco SG-300
-        return collectssh.cfgworker(*args, **kwargs)
+def worker_wrapper(arg):
+    '''Take structured data and turn it into args and/or kwargs for a
+    cfgworker(), timing the job for the run report.'''
+    args, kwargs, meta = arg
+    kwargs = kwargs.copy()  # options are popped below; keep the job's own
+
+    with runreport.job(job_record(args, kwargs, meta)) as record:
+        collector = get_collector(kwargs)
+        record.collector = collector.__name__
+        policy = freshness.pop_policy(kwargs,
+                                      getattr(collector, 'FRESHNESS', None),
+                                      meta.get('sftp_stat', False))
+
+        if resolver.installed():
+            with runreport.phase('dns'):
+                try:
+                    record.extra['address'] = resolver.CACHE.address(
+                        args[0])
+                except (OSError, UnicodeError) as err:
+                    # The collector will fail (and say so) if this matters
+                    record.extra['dns_error'] = str(err)
 
-    elif kwargs['device_type'].endswith('sshcmd'):  # Use collectsshcmd
-        if kwargs['device_type'] == 'sshcmd':
-            kwargs.pop('device_type', None)  # remove device_type from kwargs
+        try:
+            with freshness.job_policy(policy), \
+                    resourcegroups.job_groups(meta.get('groups', ())), \
+                    normalize.job_filters(meta.get('normalize'),
+                                          meta.get('raw_dir')), \
+                    artifactstore.job_store(meta.get('artifacts')):
+                return collector.cfgworker(*args, **kwargs)
+        finally:
+            sessionpool.POOL.job_done(args[0])
+
+
+def git_worker(arg):
+    '''Commit/push one repo_dir and log how long that took. Return
+    (repo_dir, push stats).'''
+    repo_dir, git_mode, changed_paths, tries, base, logger = arg
+
+    # GitPython is only needed for git checks
+    from gitcheck import git_check_add_commit_pull_push
+    from gitcheck import git_commit_paths_pull_push
+    from gitcheck import push_stats
+
+    logger.info('Git checking enabled. Checking %s.', repo_dir)
+    start = time()
+    stats = push_stats()
+    try:
+        if git_mode == 'changed':
+            git_commit_paths_pull_push(repo_dir, changed_paths, logger,
+                                       stats, tries, base)
         else:
-            # remove sshcmd from the end of the string
-            kwargs['device_type'] = kwargs['device_type'][:-6]
-        return collectsshcmd.cfgworker(*args, **kwargs)
-
-    # many device_type options for Netmiko SCP, so it is the default
-    return collectscp.cfgworker(*args, **kwargs)
+            git_check_add_commit_pull_push(repo_dir, logger, stats, tries,
+                                           base)
+    except Exception as err:
+        logger.error('Git error with %s: %s', repo_dir, err)
+        stats['error'] = str(err)
+    stats['seconds'] = time() - start
+    logger.info('Git processing of %s took %.2fs.', repo_dir,
+                stats['seconds'])
+    return repo_dir, stats
+
+
+def skip_job(job, outcome, error, **extra):
+    '''Record a job as not run, with outcome and error.'''
+    record = job_record(job[0], job[1], job[2])
+    record.extra.update(extra)
+    record.start()
+    record.fail(error, outcome=outcome)
+    record.finish()
+
+
+def pre_resolve(jobs, logger):
+    '''Resolve every job's host, and this host's own name, at once
+    into resolver.CACHE. Return the jobs whose host resolved; record
+    the rest as unresolved without running them.'''
+    start = time()
+    errors = resolver.CACHE.resolve_all(job[0][0] for job in jobs)
+    try:
+        resolver.local_address()
+    except (OSError, UnicodeError) as err:
+        logger.warning('Could not resolve this host\'s own name: %s', err)
+    logger.info('Resolved %i hosts in %.2fs; %i failed.',
+                len(set(job[0][0] for job in jobs)), time() - start,
+                len(errors))
+
+    live = []
+    for job in jobs:
+        if job[0][0] not in errors:
+            live.append(job)
+            continue
+        logger.warning('Skipping section %s: cannot resolve %s (%s).',
+                       job[2]['section'], job[0][0], errors[job[0][0]])
+        skip_job(job, 'unresolved', errors[job[0][0]])
+    return live
+
+
+def section_host(section, section_dict, defaults):
+    '''The host a section collects from.'''
+    return section_dict.get('host', defaults.get('host', section))
+
+
+def get_shard(args):
+    '''Return (this node, all nodes) from --shard or --shard-nodes, or
+    None without sharding. Raise ValueError on bad settings.'''
+    if args.shard and args.shard_nodes:
+        raise ValueError('--shard and --shard-nodes are exclusive')
+    if args.shard:
+        return sharding.parse_shard(args.shard)
+    if args.shard_nodes:
+        return sharding.parse_nodes(args.shard_nodes,
+                                    args.shard_node or getfqdn())
+    return None
+
+
+def shard_sections(config, defaults, shard, logger):
+    '''Return the sections of config that belong to this node, and
+    {section: node} for all of them.'''
+    node, nodes = shard
+    owners = OrderedDict(
+        (section, sharding.owner(section_host(section, section_dict,
+                                              defaults), nodes))
+        for section, section_dict in config.items())
+    mine = OrderedDict((section, section_dict)
+                       for section, section_dict in config.items()
+                       if owners[section] == node)
+    logger.info('Shard %s of %s: %i of %i sections.', node,
+                ','.join(nodes), len(mine), len(config))
+    return mine, owners
+
+
+def list_sections(config, defaults, owners, node):
+    '''Print the sections a run would collect (for --dry-run).'''
+    width = max([len(section) for section in config] + [7])
+    for section, section_dict in config.items():
+        print('%s %-*s %s%s' % (
+            '*' if owners is None or owners[section] == node else ' ',
+            width, section, section_host(section, section_dict, defaults),
+            '' if owners is None else '  [%s]' % owners[section]))
+    if owners is not None:
+        for name in sorted(set(owners.values())):
+            print('# %s: %i sections%s' % (
+                name, sum(1 for owner in owners.values() if owner == name),
+                ' (this node)' if name == node else ''))
+
+
+def select_sections(args, config, defaults, state, logger):
+    '''Return the sections of config to run: all of them, or those
+    picked by --retry-failed and/or --only (both must match when both
+    are given).'''
+    if not args.retry_failed and not args.only:
+        return config
+
+    failed = state.failed() if args.retry_failed else None
+    selected = OrderedDict()
+    for section, section_dict in config.items():
+        if failed is not None and section not in failed:
+            continue
+        if args.only and not runstate.matches(
+                args.only, section,
+                section_host(section, section_dict, defaults),
+                section_dict.get('device_type',
+                                 defaults.get('device_type'))):
+            continue
+        selected[section] = section_dict
+    logger.info('Selected %i of %i sections (%s).', len(selected),
+                len(config), ', '.join(
+                    (['failed last run'] if args.retry_failed else []) +
+                    ['matching %s' % pattern for pattern in args.only]))
+    return selected
+
+
+def preflight(args, jobs, logger):
+    '''Probe every job's host and port at once. Return the jobs whose
+    target answered; record the rest as unreachable without running
+    them. Targets in the dead-host cache are not probed until their
+    backoff runs out, unless jobs were picked by hand.'''
+    dead_hosts = reachability.DeadHosts(
+        args.dead_hosts or path.join(args.log_dir, 'getconfs.deadhosts.json'))
+    targets = {id(job): (job[0][0], collectregistry.target_port(job[1]))
+               for job in jobs}
+    targets = {key: target for key, target in targets.items()
+               if target[1] is not None}  # nothing to probe
+
+    forced = bool(args.retry_failed or args.only)
+    due = [target for target in set(targets.values())
+           if forced or dead_hosts.due(target)]
+    start = time()
+    errors = reachability.sweep(due, args.preflight_timeout)
+    for target, error in errors.items():
+        if error is None:
+            dead_hosts.alive(target)
+        else:
+            dead_hosts.failed(target, error)
+    logger.info('Probed %i of %i targets in %.1fs; %i unreachable.',
+                len(due), len(set(targets.values())), time() - start,
+                sum(1 for error in errors.values() if error is not None))
+
+    live = []
+    for job in jobs:
+        target = targets.get(id(job))
+        entry = None if target is None else dead_hosts.entry(target)
+        if entry is None:
+            live.append(job)
+            continue
+        cached = target not in errors
+        logger.warning('Skipping section %s: %s:%s unreachable (%s%s); '
+                       'next try after %s.', job[2]['section'], target[0],
+                       target[1], entry['error'],
+                       ', cached' if cached else '',
+                       ctime(entry['next_probe']))
+        skip_job(job, 'unreachable', entry['error'], port=target[1],
+                 failures=entry['failures'], next_probe=entry['next_probe'])
+
+    try:
+        dead_hosts.save()
+    except (IOError, OSError) as err:
+        logger.error('Could not save dead-host cache: %s', err)
+    return live
+
+
+def stage_stats(records, stages):
+    '''Throughput of the fetch stage (from the job records) and of the
+    post-processing stages (from postprocess.stats()).'''
+    fetch = {'items': len(records),
+             'bytes': sum(rec.bytes for rec in records),
+             'busy': sum(rec.phases.get('transfer', 0.) for rec in records)}
+    fetch['wall'] = fetch['busy']
+    result = OrderedDict([('fetch', fetch)])
+    result.update(stages or {})
+    for values in result.values():
+        values['mib_per_s'] = round(values['bytes'] / 1048576. /
+                                    values['busy'], 3) \
+            if values['busy'] else None
+        values['busy'] = round(values['busy'], 3)
+        values['wall'] = round(values['wall'], 3)
+    return result
+
+
+def push_repos(args, stages, changed, logger):
+    '''Commit/push every repo_dir, if --git; return push stats by
+    repo_dir.'''
+    if not args.git:
+        for repo_dir in stages:
+            logger.info('Git checks disabled. Will not process %s', repo_dir)
+        return {}
+
+    # Repos are independent, so commit/push them in parallel. Paths an
+    # earlier run changed but did not commit go along with this run's.
+    pending = {repo_dir: pending_paths(stage.repo_dir)
+               for repo_dir, stage in stages.items()}
+    git_jobs = [(repo_dir, args.git_mode,
+                 sorted(set(changed[stage.repo_dir]).union(
+                     pending[repo_dir])),
+                 args.push_tries, args.push_backoff, logger)
+                for repo_dir, stage in stages.items()]
+    with ThreadPoolExecutor(max_workers=max(1, len(git_jobs))) as executor:
+        pushes = dict(executor.map(git_worker, git_jobs))
+
+    for repo_dir, stats in pushes.items():
+        if stats['committed'] or 'error' not in stats:
+            clear_pending(stages[repo_dir].repo_dir, pending[repo_dir])
+    return pushes
+
+
+def write_reports(args, records, run_start, logger, schedule=None,
+                  groups=None, stages=None, artifacts=None, pushes=None):
+    '''Write the JSON-lines run report and Prometheus textfile.
+    schedule holds the predicted and actual makespan of the jobs;
+    groups the resource groups, by name; stages the post-processing
+    stage counters; artifacts the artifact store counters; pushes the
+    git push stats, by repo_dir.'''
+    run_end = time()
+    report = args.report or path.join(args.log_dir, 'getconfs.report.jsonl')
+    prom_file = args.prom_file or path.join(args.log_dir, 'getconfs.prom')
+    summary = {'run_start': run_start,
+               'run_end': run_end,
+               'jobs': len(records),
+               'failed': sum(1 for rec in records if rec.outcome != 'ok'),
+               'bytes': sum(rec.bytes for rec in records),
+               'changed': sum(rec.changed for rec in records),
+               'skipped': sum(rec.skipped for rec in records),
+               'unresolved': sorted(set(
+                   rec.host for rec in records
+                   if rec.outcome == 'unresolved')),
+               'unreachable': sorted(set(
+                   rec.host for rec in records
+                   if rec.outcome == 'unreachable')),
+               'retry_failed': args.retry_failed,
+               'only': args.only}
+    summary.update(schedule or {})
+    summary['stages'] = stage_stats(records, stages)
+    if artifacts is not None:
+        summary['artifacts'] = artifacts
+    extra = [('getconfs_makespan_%s_seconds' % kind,
+              '%s wall time of the jobs in the last run.' % kind.title(),
+              'gauge', [({}, summary[kind + '_makespan'])])
+             for kind in ('predicted', 'actual')
+             if kind + '_makespan' in summary]
+    extra += [
+        ('getconfs_stage_%s' % name, helptext, 'gauge',
+         [({'stage': stage}, values[key])
+          for stage, values in summary['stages'].items()])
+        for name, key, helptext in (
+            ('items', 'items', 'Items through a pipeline stage in the last '
+             'run.'),
+            ('bytes', 'bytes', 'Input bytes through a pipeline stage in the '
+             'last run.'),
+            ('busy_seconds', 'busy', 'Seconds a pipeline stage spent '
+             'working in the last run.'),
+            ('wall_seconds', 'wall', 'Seconds jobs waited on a pipeline '
+             'stage in the last run.'))]
+    if groups:
+        summary['resource_groups'] = {
+            name: {'max_jobs': group.max_jobs, 'peak_jobs': group.peak,
+                   'throttled_seconds': round(group.throttled, 3)}
+            for name, group in groups.items()}
+        extra += [
+            ('getconfs_resource_group_peak_jobs',
+             'Most jobs of a resource group running at once in the last run.',
+             'gauge',
+             [({'group': name}, group.peak)
+              for name, group in groups.items()]),
+            ('getconfs_resource_group_throttled_seconds',
+             'Seconds jobs of a resource group waited for bandwidth in the '
+             'last run.', 'gauge',
+             [({'group': name}, group.throttled)
+              for name, group in groups.items()])]
+    if pushes:
+        summary['git'] = {
+            repo_dir: dict(values, backoff=round(values['backoff'], 3),
+                           lock_wait=round(values['lock_wait'], 3),
+                           seconds=round(values['seconds'], 3))
+            for repo_dir, values in pushes.items()}
+        extra += [
+            ('getconfs_git_%s' % name, helptext, 'gauge',
+             [({'repo': repo_dir}, float(values[key]))
+              for repo_dir, values in pushes.items()])
+            for name, key, helptext in (
+                ('pushed', 'pushed', 'Whether the last run pushed its '
+                 'commit to origin.'),
+                ('push_attempts', 'attempts', 'Pull/push attempts in the '
+                 'last run.'),
+                ('push_rejected', 'rejected', 'Pushes rejected because '
+                 'another node pushed first in the last run.'),
+                ('push_errors', 'errors', 'Pulls or pushes that failed '
+                 'otherwise in the last run.'),
+                ('backoff_seconds', 'backoff', 'Seconds spent backing off '
+                 'between push attempts in the last run.'),
+                ('lock_wait_seconds', 'lock_wait', 'Seconds spent waiting '
+                 'for another run\'s lock on the repo in the last run.'),
+                ('seconds', 'seconds', 'Seconds spent committing and '
+                 'pushing in the last run.'))]
+
+    try:
+        runreport.write_jsonl(report, records, summary)
+        runreport.write_prometheus(prom_file, records, run_start, run_end,
+                                   extra)
+    except (IOError, OSError) as err:
+        logger.error('Could not write run report: %s', err)
+        return
+    logger.info('%i of %i jobs failed. Report written to %s and %s.',
+                summary['failed'], summary['jobs'], report, prom_file)
 
 
 def main():
@@ -137,9 +603,55 @@ def main():
     else:
         defaults = dict()
 
+    # Must come before any logger is set up
+    somtsfilelog.configure(max_open=args.log_max_open,
+                           max_bytes=args.log_max_bytes,
+                           backup_count=args.log_backups,
+                           when=args.log_rotate_when)
     logger = setup_logger('getconfs',
                           path.join(args.log_dir, 'getconfs.log'),
                           level=loglevel)
+
+    # Concurrency and bandwidth limits shared by groups of jobs
+    try:
+        groups = resourcegroups.parse_groups(config.pop('RESOURCE_GROUPS',
+                                                        None))
+    except (TypeError, ValueError) as err:
+        logger.error('Bad RESOURCE_GROUPS: %s', err)
+        sys.exit(1)
+
+    # Filters for lines that change on every download, per device_type
+    try:
+        rules = normalize.parse_rules(config.pop('NORMALIZE', None))
+    except ValueError as err:
+        logger.error('Bad NORMALIZE: %s', err)
+        sys.exit(1)
+
+    # device_types whose SCP jobs may stat the remote file first
+    try:
+        stat_types = freshness.parse_stat_types(config.pop('SFTP_STAT',
+                                                           None))
+    except ValueError as err:
+        logger.error('Bad SFTP_STAT: %s', err)
+        sys.exit(1)
+
+    # Re-run only some jobs, if asked
+    state = runstate.RunState(
+        args.state or path.join(args.log_dir, 'getconfs.state.json'))
+    config = select_sections(args, config, defaults, state, logger)
+
+    # Split the jobs across collector nodes, if asked
+    shard = get_shard(args)
+    owners = None
+    if shard is not None:
+        mine, owners = shard_sections(config, defaults, shard, logger)
+    if args.dry_run:
+        list_sections(config, defaults, owners,
+                      shard[0] if shard is not None else None)
+        return
+    if shard is not None:
+        config = mine
+
     # Build jobs
 
     repo_dirs = set()
@@ -155,33 +667,108 @@ def main():
         except KeyError:
             host = section
 
+        # Catch bad freshness settings here rather than in a worker
+        try:
+            sftp_stat = freshness.pop_stat(merged, stat_types)
+            freshness.pop_policy(merged.copy())
+            names = resourcegroups.pop_groups(merged, groups)
+            filters, raw_dir = normalize.pop_filters(merged, rules)
+            artifacts = artifactstore.pop_store(merged)
+        except ValueError as err:
+            logger.error('Skipping section %s: %s', section, err)
+            continue
+
         # Set up structured data for worker_wrapper()
-        jobs.append(((host, loglevel), merged))
+        jobs.append(((host, loglevel), merged,
+                     {'section': section, 'repo_dir': merged.get('repo_dir'),
+                      'groups': tuple(groups[name] for name in names),
+                      'normalize': filters, 'raw_dir': raw_dir,
+                      'artifacts': artifacts, 'sftp_stat': sftp_stat}))
 
         # Add any unique repo dirs to our set.
         if 'repo_dir' in merged:
             repo_dirs.add(merged['repo_dir'])
 
+    # Resolve every host once, concurrently, and have collectors connect
+    # to the pinned addresses instead of resolving again in workers
+    resolver.configure(ttl=args.dns_ttl)
+    if args.pin_dns:
+        jobs = pre_resolve(jobs, logger)
+        resolver.install()
+
+    # Leave dead hosts out rather than tie up a thread per connect timeout
+    if args.preflight_timeout > 0:
+        jobs = preflight(args, jobs, logger)
+
+    # Start the jobs expected to take longest first
+    history = jobhistory.JobHistory(
+        args.history or path.join(args.log_dir, 'getconfs.history.json'))
+    for job in jobs:
+        job[2]['predicted'], job[2]['estimate'] = history.estimate(
+            job[2]['section'], job[1].get('device_type'))
+    if args.order == 'history':
+        jobs.sort(key=lambda job: job[2]['predicted'], reverse=True)
+    predicted = jobhistory.makespan([job[2]['predicted'] for job in jobs],
+                                    args.pool_size)
+    logger.info('Predicted makespan of %i jobs on %i threads in %s '
+                'order: %.1fs.', len(jobs), args.pool_size, args.order,
+                predicted)
+
     logger.debug("Jobs built:\n%s", pformat(jobs))
 
-    # Set up pools
-    pool = Pool(processes=args.pool_size)
+    # Load each repo's content manifest so collectors skip rewriting
+    # files whose content did not change
+    stages = {repo_dir: open_stage(repo_dir) for repo_dir in repo_dirs}
+
+    # Jobs for the same device share SSH sessions; close each device's
+    # sessions once its last job is done.
+    postprocess.configure(args.cpu_workers)
+    sessionpool.configure(per_host=args.ssh_per_host,
+                          idle_timeout=args.ssh_idle_timeout)
+    sessionpool.POOL.expect_jobs(Counter(job[0][0] for job in jobs))
 
     # Start fetching all supported configs...
+    runreport.install_outcome_handler()
+    run_start = time()
     logger.info('Processing %i jobs...', jobs.__len__())
-    pool.map(worker_wrapper, jobs)
-    pool.close()  # no more tasks
-    pool.join()   # wrap up current tasks
-    logger.info('%i jobs processed.', jobs.__len__())
+    scheduler = None
+    if any(job[2]['groups'] for job in jobs):
+        scheduler = resourcegroups.Scheduler(
+            groups, [tuple(group.name for group in job[2]['groups'])
+                     for job in jobs])
+    run_jobs(worker_wrapper, jobs, args.pool_size, scheduler=scheduler)
+    actual = time() - run_start
+    logger.info('%i jobs processed in %.1fs (predicted %.1fs).',
+                jobs.__len__(), actual, predicted)
+    sessionpool.POOL.close_all()
+    resolver.uninstall()
+    postprocess.shutdown()
+
+    # Save manifests and report what actually changed
+    changed = close_stages()
+    for repo_dir, stage in stages.items():
+        logger.info('%i file(s) changed in %s.',
+                    len(changed[stage.repo_dir]), repo_dir)
+        for relpath in changed[stage.repo_dir]:
+            logger.info('Changed: %s', path.join(repo_dir, relpath))
 
     # Commit any changes after we've attempted to collect everything
-    for repo_dir in repo_dirs:
-        if args.git:
-            logger.info('Git checking enabled. Checking %s.', repo_dir)
-            git_check_add_commit_pull_push(repo_dir, logger)
-        else:
-            logger.info('Git checks disabled. Will not process %s', repo_dir)
-
+    pushes = push_repos(args, stages, changed, logger)
+
+    records = runreport.collect_records()
+    write_reports(args, records, run_start, logger,
+                  {'order': args.order,
+                   'predicted_makespan': round(predicted, 3),
+                   'actual_makespan': round(actual, 3)}, groups,
+                  postprocess.stats(), artifactstore.stats(), pushes)
+
+    history.update(records)
+    state.update(records)
+    for name, store in (('job history', history), ('run state', state)):
+        try:
+            store.save()
+        except (IOError, OSError) as err:
+            logger.error('Could not save %s: %s', name, err)
 
 if __name__ == '__main__':
     main()
@@ -5,18 +5,42 @@
     If the repository has any changes or new files, add/commit them,
     then pull from our origin (rebasing) and finally push changes to
     the origin.
+
+    git_commit_paths_pull_push() does the same for an explicit list of
+    changed paths, staging only those and building the commit with
+    plumbing so the worktree is never scanned.
+
+    Several collector nodes push to one branch, so a push can lose the
+    race to another node's, and a pull over a flaky link can fail. The
+    pull and push are then retried, up to `tries` times with jittered
+    exponential backoff, and a commit left unpushed by an earlier run
+    goes out with the next one. An flock on
+    a file in .git keeps overlapping runs on one host from committing
+    and rebasing the same repo at once.
 '''
+import fcntl
 from os import path
+from random import uniform
 from socket import gethostname
-from time import gmtime, strftime
+from tempfile import TemporaryFile
+from time import gmtime, monotonic, sleep, strftime
 from getpass import getuser
-from git import Repo
+from git import GitCommandError, Repo
 
-def git_check_add_commit_pull_push(git_dir, logger):
-    '''Check git repo for changes, and then blindly
-    commit/push if changes are found.'''
+PUSH_TRIES = 5
+BACKOFF_BASE = 2.  # seconds; the nth retry waits up to base * 2**(n-1)
+BACKOFF_MAX = 60.
+LOCK_NAME = 'confcollect-push.lock'
+LOCK_TIMEOUT = 600.
 
-    msg = '%s@%s:%s, %s update at %s' % (
+# git push errors that mean another node pushed first
+CONTENTION = ('[rejected]', 'fetch first', 'non-fast-forward',
+              'failed to update ref', 'cannot lock ref')
+
+
+def commit_message(git_dir):
+    '''Build our standard commit message'''
+    return '%s@%s:%s, %s update at %s' % (
         getuser(),
         gethostname(),
         git_dir,
@@ -24,17 +48,186 @@ def git_check_add_commit_pull_push(git_dir, logger):
         strftime("%Y-%m-%d %H:%M:%S %Z", gmtime())
         )
 
-    with Repo(git_dir) as repo:
+
+def push_stats():
+    '''Fresh counters for one repo's commit/push.'''
+    return {'committed': False, 'pushed': False, 'attempts': 0,
+            'rejected': 0, 'errors': 0, 'backoff': 0., 'lock_wait': 0.}
+
+
+def backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    '''Seconds to wait after failed attempt number attempt: "full
+    jitter", so nodes that collided spread out instead of colliding
+    again.'''
+    return uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class RepoLock():
+    '''Exclusive flock on LOCK_NAME in a repo's .git directory, waited
+    for up to timeout seconds. Adds the wait to stats['lock_wait'].'''
+
+    def __init__(self, git_dir, stats, timeout=LOCK_TIMEOUT):
+        self.fname = path.join(git_dir, LOCK_NAME)
+        self.stats = stats
+        self.timeout = timeout
+        self.filep = None
+
+    def __enter__(self):
+        start = monotonic()
+        self.filep = open(self.fname, 'a')
+        while True:
+            try:
+                fcntl.flock(self.filep, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if monotonic() - start > self.timeout:
+                    self.filep.close()
+                    raise TimeoutError('%s is held by another run' %
+                                       self.fname)
+                sleep(0.1)
+        self.stats['lock_wait'] += monotonic() - start
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.filep, fcntl.LOCK_UN)
+        self.filep.close()
+
+
+def unpushed(git):
+    '''Number of local commits the upstream branch does not have yet,
+    as of the last fetch.'''
+    try:
+        return int(git.rev_list('--count', '@{upstream}..HEAD'))
+    except (GitCommandError, ValueError):
+        return 0
+
+
+def rebasing(repo):
+    '''True when a rebase stopped partway, e.g. on a conflict.'''
+    return path.isdir(path.join(repo.git_dir, 'rebase-merge')) or \
+        path.isdir(path.join(repo.git_dir, 'rebase-apply'))
+
+
+def pull_push(repo, logger, stats, tries=PUSH_TRIES, base=BACKOFF_BASE):
+    '''Rebase onto origin and push, retrying with backoff after a pull
+    or push that failed, such as a push another node beat to the
+    branch. Raise GitCommandError once tries are used up, or on a
+    rebase conflict, which is aborted so the next run starts clean.'''
+    git = repo.git
+    for attempt in range(1, tries + 1):
+        stats['attempts'] = attempt
+        step = 'Pull'
+        try:
+            git.pull('--rebase')
+            step = 'Push'
+            git.push()
+        except GitCommandError as err:
+            if step == 'Pull' and rebasing(repo):
+                git.rebase('--abort')
+                raise  # a conflict would only recur
+            contended = step == 'Push' and \
+                any(text in str(err.stderr) for text in CONTENTION)
+            stats['rejected' if contended else 'errors'] += 1
+            if attempt == tries:
+                raise
+            wait = backoff(attempt, base)
+            stats['backoff'] += wait
+            logger.info('%s %i of %i from %s failed (%s); retrying in '
+                        '%.1fs.', step, attempt, tries,
+                        repo.working_tree_dir,
+                        'another node pushed first' if contended else
+                        str(err.stderr).strip(), wait)
+            sleep(wait)
+            continue
+        stats['pushed'] = True
+        if attempt > 1:
+            logger.info('Pushed after %i attempts.', attempt)
+        return
+
+
+def git_check_add_commit_pull_push(git_dir, logger, stats=None,
+                                   tries=PUSH_TRIES, base=BACKOFF_BASE):
+    '''Check git repo for changes, and then blindly
+    commit/push if changes are found. Fills in stats (see
+    push_stats()) and returns it.'''
+
+    stats = push_stats() if stats is None else stats
+    msg = commit_message(git_dir)
+
+    with Repo(git_dir) as repo, RepoLock(repo.git_dir, stats):
         git = repo.git
 
         if git.status('--porcelain').__len__() == 0:
-            logger.info('No repo changes. End.')
+            logger.info('No repo changes.')
         else:
             logger.info('Repo changed...')
             logger.info('Committing changes with message "%s"...', msg)
             git.add('-A')
             git.commit('-a', '-m', msg)
+            stats['committed'] = True
             logger.info('Changes committed...')
-            git.pull('--rebase')
-            git.push()
+
+        if stats['committed'] or unpushed(git):
+            pull_push(repo, logger, stats, tries, base)
             logger.info('Changes pushed to origin.')
+        else:
+            logger.info('Nothing to push. End.')
+    return stats
+
+
+def git_commit_paths_pull_push(git_dir, paths, logger, stats=None,
+                               tries=PUSH_TRIES, base=BACKOFF_BASE):
+    '''Stage only paths (relative to git_dir), and any left staged by
+    a run that died before committing, with one batched `git
+    update-index`, commit the resulting tree with commit-tree and
+    update-ref, then pull/push. Callers pass the paths changed by
+    earlier runs that were not committed too (see
+    confoutput.pending_paths()). Fills in stats (see push_stats()) and
+    returns it; stats['committed'] says whether a commit was made.'''
+
+    stats = push_stats() if stats is None else stats
+    msg = commit_message(git_dir)
+
+    with Repo(git_dir) as repo, RepoLock(repo.git_dir, stats):
+        git = repo.git
+
+        # Compares the index with HEAD only; the worktree is not read.
+        staged = set(name for name in git.diff_index(
+            '--cached', '--name-only', '-z', 'HEAD').split('\0') if name)
+        staged.difference_update(paths)
+        if staged:
+            logger.info('%i path(s) left staged in %s; adding them.',
+                        len(staged), git_dir)
+        paths = sorted(staged.union(paths))
+
+        if not paths:
+            logger.info('No changed paths for %s.', git_dir)
+        else:
+            # One update-index for every path; --remove drops index
+            # entries for paths that no longer exist in the worktree.
+            with TemporaryFile() as pathlist:
+                pathlist.write(b'\0'.join(p.encode('utf-8') for p in paths))
+                pathlist.seek(0)
+                git.update_index('--add', '--remove', '-z', '--stdin',
+                                 istream=pathlist)
+            logger.info('Staged %i changed path(s) in %s.', len(paths),
+                        git_dir)
+
+            parent = git.rev_parse('--verify', 'HEAD')
+            tree = git.write_tree()
+            if tree == git.rev_parse('HEAD^{tree}'):
+                logger.info('No repo changes.')
+            else:
+                logger.info('Committing changes with message "%s"...', msg)
+                commit = git.commit_tree(tree, '-p', parent, '-m', msg)
+                git.update_ref('-m', 'commit: ' + msg, 'HEAD', commit,
+                               parent)
+                stats['committed'] = True
+                logger.info('Changes committed...')
+
+        if stats['committed'] or unpushed(git):
+            pull_push(repo, logger, stats, tries, base)
+            logger.info('Changes pushed to origin.')
+        else:
+            logger.info('Nothing to push. End.')
+    return stats
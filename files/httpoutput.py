@@ -0,0 +1,69 @@
+# THIS FILE MANANGED BY PUPPET.
+''' httpoutput.py
+
+    Stream HTTP response bodies to disk for the requests-based
+    collectors. The body goes through confoutput.atomic_write() in
+    chunks, so memory per job is bounded by the chunk size and a
+    response cut short never replaces a good config.'''
+
+import codecs
+
+from requests.compat import chardet
+
+import freshness
+import postprocess
+from confoutput import CHUNK_SIZE, atomic_write
+from runreport import phase
+
+# Bodies in these encodings are written as they come
+PASSTHROUGH = ('utf-8', 'ascii')
+
+
+def detect_encoding(data):
+    '''Guess the encoding of bytes, or None.'''
+    return chardet.detect(data)['encoding']
+
+
+def body_encoding(response, first_chunk):
+    '''The encoding requests would decode response.text with. When the
+    headers do not say, guess from the first chunk rather than the
+    whole body, in the post-processing pool.'''
+    if response.encoding is not None:
+        return response.encoding
+    if not first_chunk:
+        return 'utf-8'
+    return postprocess.run('charset', detect_encoding, first_chunk,
+                           size=len(first_chunk)) or 'utf-8'
+
+
+def save_response(response, fname, text=True, logger=None):
+    '''Write the body of response (made with stream=True) to fname.
+    With text, save the body as UTF-8, decoding it as response.text
+    would; bodies that are already UTF-8 (or ASCII) are written
+    unchanged. A 304 Not Modified (see freshness.http_headers()) leaves
+    fname as it is. Return True when fname changed.'''
+    if freshness.not_modified(response, fname, logger):
+        return False
+
+    chunks = response.iter_content(CHUNK_SIZE)
+    with atomic_write(fname, 'wb', logger=logger) as filep:
+        with phase('transfer'):
+            first = next(chunks, b'')
+            decoder = None
+            if text:
+                encoding = codecs.lookup(body_encoding(response, first)).name
+                if encoding not in PASSTHROUGH:
+                    decoder = codecs.getincrementaldecoder(encoding)(
+                        'replace')
+
+            if decoder is None:
+                filep.write(first)
+                for chunk in chunks:
+                    filep.write(chunk)
+            else:
+                filep.write(decoder.decode(first).encode('utf-8'))
+                for chunk in chunks:
+                    filep.write(decoder.decode(chunk).encode('utf-8'))
+                filep.write(decoder.decode(b'', True).encode('utf-8'))
+    freshness.remember_http(fname, response)
+    return filep.changed
@@ -0,0 +1,108 @@
+# THIS FILE MANANGED BY PUPPET.
+''' jobhistory.py
+
+    Per-job duration history, for scheduling. After each run, getconfs
+    folds every job's duration into an exponentially weighted average
+    kept in a JSON file. Before the next run, it starts the jobs
+    expected to take longest first, so a slow Q-flex or a big recursive
+    SCP does not start last and stretch the run while other threads sit
+    idle. Jobs without history are estimated from the other jobs of
+    their device_type, or failing that from PRIORS.'''
+
+import heapq
+from fnmatch import fnmatchcase
+
+from confoutput import load_json, save_json
+
+ALPHA = 0.3  # weight of the newest duration in the average
+
+# (device_type glob, seconds) for device types without history; first
+# match wins
+PRIORS = [
+    ('qflex', 120.),  # global_delay_factor=10 makes Netmiko slow
+    ('mediacento', 20.),
+    ('*sshcmd', 30.),
+    ('pfsense', 10.),
+    ('peplink', 5.),
+    ('advantech', 3.),
+    ('pepperlfuchs', 3.),
+]
+DEFAULT_PRIOR = 15.  # SCP via Netmiko
+
+
+def prior(device_type):
+    '''Built-in duration guess for a device_type.'''
+    for pattern, seconds in PRIORS:
+        if fnmatchcase(str(device_type), pattern):
+            return seconds
+    return DEFAULT_PRIOR
+
+
+def makespan(estimates, workers):
+    '''Wall time of running jobs of the given durations, in order, on
+    workers threads that each take the next job as soon as they are
+    free.'''
+    finish = [0.] * max(1, min(workers, len(estimates)))
+    for seconds in estimates:
+        heapq.heappush(finish, heapq.heappop(finish) + seconds)
+    return max(finish) if estimates else 0.
+
+
+class JobHistory():
+    '''Average duration per job (section), persisted as JSON.'''
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.jobs = {}
+        self.averages = None  # per device_type, until jobs change
+        self.load()
+
+    def load(self):
+        '''Read the history file, if there is one.'''
+        self.jobs = load_json(self.fname, 'jobs') or {}
+        self.averages = None
+
+    def save(self):
+        '''Write the history file atomically.'''
+        save_json(self.fname, {'jobs': self.jobs})
+
+    def device_type_average(self, device_type):
+        '''Mean average duration of known jobs of device_type, or None.
+        The means of all device_types come from one pass over the
+        history, not one per job estimated.'''
+        if self.averages is None:
+            totals = {}
+            for entry in self.jobs.values():
+                total = totals.setdefault(entry.get('device_type'), [0., 0])
+                total[0] += entry['seconds']
+                total[1] += 1
+            self.averages = dict((dtype, seconds / count) for dtype,
+                                 (seconds, count) in totals.items())
+        return self.averages.get(device_type)
+
+    def estimate(self, section, device_type=None):
+        '''Return (expected seconds, source) for a job, where source is
+        "history", "device_type" or "prior".'''
+        entry = self.jobs.get(section)
+        if entry is not None:
+            return entry['seconds'], 'history'
+        average = self.device_type_average(device_type)
+        if average is not None:
+            return average, 'device_type'
+        return prior(device_type), 'prior'
+
+    def update(self, records):
+        '''Fold the durations of finished runreport.JobRecords in.'''
+        self.averages = None
+        for rec in records:
+            if rec.duration is None or \
+                    rec.outcome in ('unresolved', 'unreachable'):
+                continue  # not run, so its duration says nothing
+            entry = self.jobs.get(rec.section)
+            if entry is None:
+                seconds = rec.duration
+            else:
+                seconds = ALPHA * rec.duration + (1 - ALPHA) * entry['seconds']
+            self.jobs[rec.section] = {'seconds': round(seconds, 3),
+                                      'device_type': rec.device_type,
+                                      'runs': (entry or {}).get('runs', 0) + 1}
@@ -0,0 +1,294 @@
+# THIS FILE MANANGED BY PUPPET.
+''' normalize.py
+
+    Normalization filters, applied to collected configs as they are
+    written, so lines that change on every download (timestamps,
+    counters) do not become a git commit each run. getconfs.json
+    declares filters per device_type glob in a top-level NORMALIZE
+    section; the first glob matching a job's device_type wins:
+
+      "NORMALIZE": {
+        "cisco_ios*": [
+          {"drop": "^! (Last configuration change|NVRAM config last)"},
+          {"drop": "^ntp clock-period "}
+        ],
+        "*sshcmd": [
+          {"replace": "[0-9]+ packets", "with": "N packets"}
+        ],
+        "pfsense": ["xml", {"drop": "^\\t*<time>[0-9]+</time>$"}],
+        "vmware_esxi": ["sort"]
+      }
+
+    A section may set "normalize" to its own list (or [] for none), and
+    "raw_dir" to keep each file it filters as fetched, under that
+    directory (outside the git repo) at the same path relative to
+    repo_dir.
+
+    Filters run in order on lines, as bytes; regexes are matched
+    against each line without its line ending. "drop" and "replace"
+    stream; "sort" and "xml" hold the whole file until it ends.'''
+
+import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from fnmatch import fnmatchcase
+from threading import local
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+
+_CURRENT = local()
+
+
+def _split(line):
+    '''(line without its ending, ending).'''
+    if line.endswith(b'\r\n'):
+        return line[:-2], b'\r\n'
+    if line.endswith(b'\n'):
+        return line[:-1], b'\n'
+    return line, b''
+
+
+def _regex(spec, key):
+    '''Compile the regex in spec[key], for bytes.'''
+    if not isinstance(spec[key], str):
+        raise ValueError('%s filter needs a regex string' % key)
+    try:
+        return re.compile(spec[key].encode('utf-8'))
+    except re.error as err:
+        raise ValueError('%s filter %r: %s' % (key, spec[key], err))
+
+
+class Drop():
+    '''Leave out lines matching a regex.'''
+
+    options = ()
+
+    def __init__(self, spec):
+        self.regex = _regex(spec, 'drop')
+
+    def feed(self, lines):
+        '''Filter some lines.'''
+        return [line for line in lines
+                if not self.regex.search(_split(line)[0])]
+
+    @staticmethod
+    def close():
+        '''Nothing held back.'''
+        return []
+
+
+class Replace():
+    '''Substitute "with" (default: nothing) for matches of a regex in
+    each line; \\1 and \\g<name> refer to groups.'''
+
+    options = ('with',)
+
+    def __init__(self, spec):
+        self.regex = _regex(spec, 'replace')
+        self.repl = spec.get('with', '')
+        if not isinstance(self.repl, str):
+            raise ValueError('replace filter "with" must be a string')
+        self.repl = self.repl.encode('utf-8')
+        try:  # fail now on bad group references
+            self.regex.sub(self.repl, b'')
+        except re.error as err:
+            raise ValueError('replace filter "with" %r: %s' %
+                             (spec['with'], err))
+
+    def feed(self, lines):
+        '''Filter some lines.'''
+        result = []
+        for line in lines:
+            body, ending = _split(line)
+            result.append(self.regex.sub(self.repl, body) + ending)
+        return result
+
+    @staticmethod
+    def close():
+        '''Nothing held back.'''
+        return []
+
+
+class Sort():
+    '''Sort lines as bytes, for devices that list things in varying
+    order. A missing final newline is added, as extsort does.'''
+
+    options = ()
+
+    def __init__(self, spec):
+        self.lines = []
+
+    def feed(self, lines):
+        '''Hold lines until the end.'''
+        self.lines.extend(lines)
+        return []
+
+    def close(self):
+        '''All lines, sorted.'''
+        lines, self.lines = self.lines, []
+        if lines and not lines[-1].endswith(b'\n'):
+            lines[-1] += b'\n'
+        return sorted(lines)
+
+
+def _strip_blanks(node):
+    '''Remove whitespace-only text between elements, so indentation
+    comes from pretty-printing alone.'''
+    for child in list(node.childNodes):
+        if child.nodeType == child.TEXT_NODE and not child.data.strip():
+            node.removeChild(child)
+        else:
+            _strip_blanks(child)
+
+
+class PrettyXML():
+    '''Re-indent an XML document one element per line, so the device's
+    own whitespace does not matter. "indent" defaults to a tab.'''
+
+    options = ('indent',)
+
+    def __init__(self, spec):
+        self.indent = spec.get('indent', '\t')
+        if not isinstance(self.indent, str):
+            self.indent = '\t'  # "xml": true
+        self.lines = []
+
+    def feed(self, lines):
+        '''Hold lines until the end.'''
+        self.lines.extend(lines)
+        return []
+
+    def close(self):
+        '''The whole document, pretty-printed. Raise ValueError if it is
+        not XML.'''
+        data, self.lines = b''.join(self.lines), []
+        if not data.strip():
+            return []
+        try:
+            doc = minidom.parseString(data)
+        except ExpatError as err:
+            raise ValueError('xml filter: not XML (%s)' % err)
+        _strip_blanks(doc)
+        text = doc.toprettyxml(indent=self.indent,
+                               encoding=doc.encoding or 'utf-8')
+        doc.unlink()
+        return text.splitlines(True)
+
+
+FILTERS = OrderedDict([
+    ('drop', Drop),
+    ('replace', Replace),
+    ('sort', Sort),
+    ('xml', PrettyXML),
+])
+
+
+def make_filter(spec):
+    '''Build a filter from its getconfs.json form: "sort" or "xml", or
+    an object with exactly one filter name as a key. Raise ValueError
+    on bad settings.'''
+    if isinstance(spec, str):
+        spec = {spec: True}
+    if not isinstance(spec, dict):
+        raise ValueError('filter %r must be a name or an object' % (spec,))
+    kinds = [kind for kind in FILTERS if kind in spec]
+    if len(kinds) != 1:
+        raise ValueError('filter %r must name exactly one of %s' %
+                         (spec, ', '.join(FILTERS)))
+    cls = FILTERS[kinds[0]]
+    unknown = set(spec) - {kinds[0]} - set(cls.options)
+    if unknown:
+        raise ValueError('%s filter: unknown setting(s) %s' %
+                         (kinds[0], ', '.join(sorted(unknown))))
+    return cls(spec)
+
+
+def check_filters(specs):
+    '''Return specs, a list of filters, after checking that each one
+    builds. Raise ValueError otherwise.'''
+    if not isinstance(specs, list):
+        raise ValueError('normalization filters must be a list')
+    for spec in specs:
+        make_filter(spec)
+    return specs
+
+
+def parse_rules(settings):
+    '''Build {device_type glob: [filter]} from a NORMALIZE section.
+    Raise ValueError on bad settings.'''
+    if settings is not None and not isinstance(settings, dict):
+        raise ValueError('NORMALIZE must be an object')
+    rules = OrderedDict()
+    for pattern, specs in (settings or {}).items():
+        try:
+            rules[pattern] = check_filters(specs)
+        except ValueError as err:
+            raise ValueError('%s: %s' % (pattern, err))
+    return rules
+
+
+def pop_filters(kwargs, rules):
+    '''Remove "normalize" and "raw_dir" from a job's kwargs and return
+    (filters, raw_dir). A section's own "normalize" wins over the rules
+    for its device_type. Raise ValueError on bad settings.'''
+    specs = kwargs.pop('normalize', None)
+    raw_dir = kwargs.pop('raw_dir', None)
+    if specs is not None:
+        return check_filters(specs), raw_dir
+    device_type = kwargs.get('device_type') or ''
+    for pattern, specs in rules.items():
+        if fnmatchcase(device_type, pattern):
+            return specs, raw_dir
+    return [], raw_dir
+
+
+class Normalizer():
+    '''A chain of filters over one file's bytes, fed in chunks of any
+    size.'''
+
+    def __init__(self, specs):
+        self.filters = [make_filter(spec) for spec in specs]
+        self.partial = b''
+
+    def _run(self, lines):
+        '''Pass whole lines through every filter.'''
+        for filt in self.filters:
+            lines = filt.feed(lines)
+        return b''.join(lines)
+
+    def feed(self, data):
+        '''Normalize a chunk; return what can be written so far.'''
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        return self._run([line + b'\n' for line in lines])
+
+    def close(self):
+        '''Return the rest, once the input has ended.'''
+        lines = [self.partial] if self.partial else []
+        self.partial = b''
+        for filt in self.filters:
+            lines = filt.feed(lines) + filt.close()
+        return b''.join(lines)
+
+
+@contextmanager
+def job_filters(specs, raw_dir=None):
+    '''Make specs and raw_dir the current job's in this thread.'''
+    previous = getattr(_CURRENT, 'settings', None)
+    _CURRENT.settings = (specs, raw_dir)
+    try:
+        yield
+    finally:
+        _CURRENT.settings = previous
+
+
+def normalizer():
+    '''A new Normalizer for a file of the current job, or None when the
+    job has no filters.'''
+    specs, _ = getattr(_CURRENT, 'settings', None) or ((), None)
+    return Normalizer(specs) if specs else None
+
+
+def raw_dir():
+    '''Where the current job keeps raw copies, or None.'''
+    return (getattr(_CURRENT, 'settings', None) or ((), None))[1]
@@ -0,0 +1,96 @@
+# THIS FILE MANANGED BY PUPPET.
+''' postprocess.py
+
+    CPU-bound post-processing (sorting, uudecoding, parsing, charset
+    detection) in a small process pool, so it does not hold the GIL
+    that getconfs' I/O threads share. Only paths and bytes/str buffers
+    cross to the pool; a job's thread waits for the result without the
+    GIL, so the other threads keep fetching meanwhile.
+
+    Each named stage counts its items, input bytes and the time spent
+    on them in the pool (busy) and all told, including the queue and
+    transfer to and from the pool (wall), for the run report.'''
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import cpu_count, get_context
+from threading import Lock
+from time import time
+
+PROCESSES = min(4, cpu_count())
+INLINE_BELOW = 64 * 1024  # input bytes not worth a trip to the pool
+
+_POOL = None
+_PROCESSES = PROCESSES
+_LOCK = Lock()
+STATS = OrderedDict()  # stage -> {'items', 'bytes', 'busy', 'wall'}
+
+
+def configure(processes=PROCESSES):
+    '''Use up to processes worker processes; 0 runs stages in the
+    calling thread instead.'''
+    global _PROCESSES
+    shutdown()
+    with _LOCK:
+        _PROCESSES = max(0, processes)
+        STATS.clear()
+
+
+def _pool():
+    '''The process pool, started on first use.'''
+    global _POOL
+    with _LOCK:
+        if _POOL is None and _PROCESSES:
+            # Forking a process full of threads can copy locks held by
+            # other threads; start workers from a clean server instead.
+            try:
+                _POOL = ProcessPoolExecutor(
+                    _PROCESSES, mp_context=get_context('forkserver'))
+            except TypeError:  # Python 3.6 has no mp_context
+                _POOL = ProcessPoolExecutor(_PROCESSES)
+        return _POOL
+
+
+def _timed(func, args):
+    '''Run func(*args) in a worker and say how long it took.'''
+    start = time()
+    result = func(*args)
+    return result, time() - start
+
+
+def run(stage, func, *args, size=0):
+    '''Return func(*args), run in the pool and counted under stage.
+    func must be a module-level function; size is the input bytes, for
+    throughput. Inputs smaller than INLINE_BELOW run in this thread.'''
+    start = time()
+    pool = _pool() if size >= INLINE_BELOW else None
+    if pool is None:
+        result, busy = _timed(func, args)
+    else:
+        result, busy = pool.submit(_timed, func, args).result()
+    wall = time() - start
+
+    with _LOCK:
+        stats = STATS.setdefault(stage, {'items': 0, 'bytes': 0,
+                                         'busy': 0., 'wall': 0.})
+        stats['items'] += 1
+        stats['bytes'] += size
+        stats['busy'] += busy
+        stats['wall'] += wall
+    return result
+
+
+def stats():
+    '''A copy of the per-stage counters.'''
+    with _LOCK:
+        return OrderedDict((stage, dict(values))
+                           for stage, values in STATS.items())
+
+
+def shutdown():
+    '''Stop the worker processes.'''
+    global _POOL
+    with _LOCK:
+        pool, _POOL = _POOL, None
+    if pool is not None:
+        pool.shutdown(wait=True)
@@ -0,0 +1,111 @@
+# THIS FILE MANANGED BY PUPPET.
+''' reachability.py
+
+    Pre-flight reachability sweep. With --preflight-timeout, getconfs
+    opens (and at once closes) a TCP connection to every job's target
+    port before jobs are dispatched, all concurrently, so a powered-off
+    or decommissioned device costs a few seconds of one sweep rather
+    than a pool thread stuck in a collector's connect timeout.
+
+    Targets that fail go into a negative cache kept as JSON. A cached
+    target is neither probed nor collected until its backoff runs out;
+    each consecutive failure doubles the backoff, up to BACKOFF_MAX. A
+    target that answers again leaves the cache.'''
+
+import asyncio
+from time import time
+
+from confoutput import load_json, save_json
+
+TIMEOUT = 3.       # seconds per connection attempt
+CONCURRENCY = 256  # probes in flight at once
+BACKOFF_BASE = 3600.
+BACKOFF_MAX = 7 * 86400.
+
+
+async def _probe(semaphore, host, port, timeout):
+    '''Return None if host:port accepts a TCP connection, else why not.'''
+    async with semaphore:
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port), timeout)
+        except asyncio.TimeoutError:
+            return 'no answer within %gs' % timeout
+        except (OSError, UnicodeError) as err:
+            return str(err) or err.__class__.__name__
+        writer.close()
+        return None
+
+
+async def _sweep(targets, timeout, concurrency):
+    '''Probe every (host, port) in targets concurrently.'''
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = await asyncio.gather(*[
+        _probe(semaphore, host, port, timeout) for host, port in targets])
+    return dict(zip(targets, errors))
+
+
+def sweep(targets, timeout=TIMEOUT, concurrency=CONCURRENCY):
+    '''Probe (host, port) targets. Return {target: None or error}.'''
+    targets = sorted(set(targets))
+    if not targets:
+        return {}
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_sweep(targets, timeout,
+                                              max(1, concurrency)))
+    finally:
+        loop.close()
+
+
+def backoff(failures, base=BACKOFF_BASE):
+    '''Seconds to leave a target alone after consecutive failures.'''
+    return min(BACKOFF_MAX, base * 2 ** max(0, failures - 1))
+
+
+class DeadHosts():
+    '''Negative cache of unreachable (host, port) targets, persisted as
+    JSON.'''
+
+    def __init__(self, fname, base=BACKOFF_BASE):
+        self.fname = fname
+        self.base = base
+        self.targets = {}
+        self.load()
+
+    @staticmethod
+    def key(target):
+        '''JSON key for a (host, port) target.'''
+        return '%s:%s' % target
+
+    def load(self):
+        '''Read the cache file, if there is one.'''
+        self.targets = load_json(self.fname, 'targets') or {}
+
+    def save(self):
+        '''Write the cache file atomically.'''
+        save_json(self.fname, {'targets': self.targets})
+
+    def entry(self, target):
+        '''The cache entry for target, or None.'''
+        return self.targets.get(self.key(target))
+
+    def due(self, target, now=None):
+        '''True unless target is cached and still backing off.'''
+        entry = self.entry(target)
+        return entry is None or entry['next_probe'] <= (now or time())
+
+    def failed(self, target, error, now=None):
+        '''Record a failed probe of target and return its entry.'''
+        now = now or time()
+        entry = self.entry(target) or {'failures': 0, 'first_failure': now}
+        entry['failures'] += 1
+        entry['error'] = error
+        entry['last_probe'] = now
+        entry['next_probe'] = now + backoff(entry['failures'], self.base)
+        self.targets[self.key(target)] = entry
+        return entry
+
+    def alive(self, target):
+        '''Forget target after it answered.'''
+        self.targets.pop(self.key(target), None)
@@ -0,0 +1,137 @@
+# THIS FILE MANANGED BY PUPPET.
+''' resolver.py
+
+    Per-run DNS cache. With --pin-dns, getconfs resolves every job's
+    host (and this collector's own name) up front, concurrently, then
+    install()s a socket.getaddrinfo() wrapper that answers from the
+    cache for the whole process until the jobs are done. Netmiko,
+    paramiko, requests and telnetlib then connect to the pinned
+    address without a lookup of their own, while collectors keep using
+    hostnames for URLs, filenames and logs (and TLS and Host headers
+    still see the name).
+
+    getaddrinfo() does not tell us record TTLs, so entries live for a
+    fixed ttl; failures are remembered for NEGATIVE_TTL. A host looked
+    up after its entry expired is resolved again, once, and cached.'''
+
+import ipaddress
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+
+TTL = 300.
+NEGATIVE_TTL = 30.
+CONCURRENCY = 64
+
+_GETADDRINFO = socket.getaddrinfo
+
+
+def is_address(host):
+    '''True when host is an IP address literal rather than a name.'''
+    try:
+        ipaddress.ip_address(host.split('%', 1)[0])
+    except ValueError:
+        return False
+    return True
+
+
+class ResolverCache():
+    '''Pinned address per (host, family), with expiry.'''
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.entries = {}  # (host, family) -> (address, error, expires)
+        self.lock = Lock()
+
+    def _lookup(self, host, family):
+        '''Resolve host with the real getaddrinfo(); return (address,
+        error) and cache the answer.'''
+        try:
+            infos = _GETADDRINFO(host, None, family, socket.SOCK_STREAM)
+            address, error, ttl = infos[0][4][0], None, self.ttl
+        except (OSError, UnicodeError) as err:
+            address, error, ttl = None, str(err), NEGATIVE_TTL
+        with self.lock:
+            self.entries[(host, family)] = (address, error,
+                                            monotonic() + ttl)
+        return address, error
+
+    def cached(self, host, family=0):
+        '''(address, error) for host if cached and not expired, or None.'''
+        with self.lock:
+            entry = self.entries.get((host, family))
+        if entry is None or entry[2] < monotonic():
+            return None
+        return entry[:2]
+
+    def resolve(self, host, family=0):
+        '''(address, error) for host, resolving it if need be. address
+        is None when resolution failed.'''
+        entry = self.cached(host, family)
+        if entry is None:
+            entry = self._lookup(host, family)
+        return entry
+
+    def address(self, host, family=0):
+        '''Pinned address for host; raise socket.gaierror if it does not
+        resolve.'''
+        address, error = self.resolve(host, family)
+        if address is None:
+            raise socket.gaierror(error)
+        return address
+
+    def resolve_all(self, hosts, family=0, concurrency=CONCURRENCY):
+        '''Resolve hosts concurrently. Return {host: error} for those
+        that failed.'''
+        hosts = sorted(set(host for host in hosts if not is_address(host)))
+        if not hosts:
+            return {}
+        with ThreadPoolExecutor(
+                max_workers=max(1, min(concurrency, len(hosts)))) as pool:
+            results = list(pool.map(lambda host: self._lookup(host, family),
+                                    hosts))
+        return dict((host, error) for host, (address, error)
+                    in zip(hosts, results) if address is None)
+
+
+CACHE = ResolverCache()
+
+
+def configure(ttl=TTL):
+    '''Start a fresh CACHE with the given ttl.'''
+    global CACHE
+    CACHE = ResolverCache(ttl)
+
+
+def getaddrinfo(host, port, family=0, type=0, proto=0, flags=0):
+    '''socket.getaddrinfo() answering names from CACHE.'''
+    if not isinstance(host, str) or not host or is_address(host) or \
+            flags & socket.AI_NUMERICHOST:
+        return _GETADDRINFO(host, port, family, type, proto, flags)
+    address, error = CACHE.resolve(host, family)
+    if address is None:
+        raise socket.gaierror(socket.EAI_NONAME, error)
+    return _GETADDRINFO(address, port, family, type, proto,
+                        flags | socket.AI_NUMERICHOST)
+
+
+def install():
+    '''Route socket.getaddrinfo() through CACHE.'''
+    socket.getaddrinfo = getaddrinfo
+
+
+def uninstall():
+    '''Restore the real socket.getaddrinfo().'''
+    socket.getaddrinfo = _GETADDRINFO
+
+
+def installed():
+    '''True while socket.getaddrinfo() answers from CACHE.'''
+    return socket.getaddrinfo is getaddrinfo
+
+
+def local_address():
+    '''This host's IPv4 address, as gethostbyname(gethostname()) would
+    give it, from CACHE.'''
+    return CACHE.address(socket.gethostname(), socket.AF_INET)
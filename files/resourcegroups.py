@@ -0,0 +1,205 @@
+# THIS FILE MANANGED BY PUPPET.
+''' resourcegroups.py
+
+    Limits shared by groups of jobs, such as the devices behind one
+    satellite link or one TACACS server. getconfs.json declares groups
+    in a top-level RESOURCE_GROUPS section:
+
+      "RESOURCE_GROUPS": {
+        "site-a-link": {"max_jobs": 4, "bytes_per_sec": 250000},
+        "tacacs1": {"max_jobs": 20}
+      }
+
+    and jobs join them with "resource_groups": ["site-a-link",
+    "tacacs1"] (in their own section or in DEFAULT). A job starts only
+    once every group it is in has a free slot; until then, threads run
+    later jobs whose groups do have room, so one busy group does not
+    idle the pool. Bytes a job writes are metered through a token
+    bucket per group with a bytes_per_sec, which stalls the job (and so
+    its transfer) while the group is over its rate.'''
+
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Condition, Lock, local
+from time import monotonic, sleep
+
+from runreport import phase
+
+_CURRENT = local()
+
+
+class TokenBucket():
+    '''bytes_per_sec refilled continuously, holding at most burst.
+    Callers may overdraw; the next caller waits out the debt.'''
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else rate)
+        self.tokens = self.burst
+        self.stamp = monotonic()
+        self.waited = 0.  # seconds callers were told to wait, in all
+        self.lock = Lock()
+
+    def reserve(self, count):
+        '''Take count tokens; return the seconds to wait before using
+        them.'''
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            self.tokens -= count
+            wait = max(0., -self.tokens / self.rate)
+            self.waited += wait
+            return wait
+
+
+class ResourceGroup():
+    '''A named concurrency cap and optional bandwidth limit.'''
+
+    def __init__(self, name, max_jobs=None, bytes_per_sec=None,
+                 burst_bytes=None):
+        if max_jobs is not None and int(max_jobs) < 1:
+            raise ValueError('resource group %s: max_jobs must be at '
+                             'least 1' % name)
+        if bytes_per_sec is not None and float(bytes_per_sec) <= 0:
+            raise ValueError('resource group %s: bytes_per_sec must be '
+                             'positive' % name)
+        self.name = name
+        self.max_jobs = None if max_jobs is None else int(max_jobs)
+        self.bucket = None
+        if bytes_per_sec is not None:
+            self.bucket = TokenBucket(bytes_per_sec, burst_bytes)
+        self.running = 0
+        self.peak = 0
+
+    def __repr__(self):
+        return 'ResourceGroup(%r, %r)' % (self.name, self.max_jobs)
+
+    def has_room(self):
+        '''True when another job may start.'''
+        return self.max_jobs is None or self.running < self.max_jobs
+
+    @property
+    def throttled(self):
+        '''Seconds jobs of this group spent stalled for bandwidth.'''
+        return 0. if self.bucket is None else self.bucket.waited
+
+
+def parse_groups(settings):
+    '''Build {name: ResourceGroup} from a RESOURCE_GROUPS section.
+    Raise ValueError on bad settings.'''
+    groups = OrderedDict()
+    for name, group in (settings or {}).items():
+        if not isinstance(group, dict):
+            raise ValueError('resource group %s must be an object' % name)
+        unknown = set(group) - {'max_jobs', 'bytes_per_sec', 'burst_bytes'}
+        if unknown:
+            raise ValueError('resource group %s: unknown setting(s) %s' %
+                             (name, ', '.join(sorted(unknown))))
+        groups[name] = ResourceGroup(name, **group)
+    return groups
+
+
+def pop_groups(kwargs, groups):
+    '''Remove "resource_groups" from a job's kwargs and return the
+    tuple of names. Raise ValueError for groups not declared.'''
+    names = kwargs.pop('resource_groups', None) or ()
+    if isinstance(names, str):
+        names = (names,)
+    unknown = [name for name in names if name not in groups]
+    if unknown:
+        raise ValueError('unknown resource group(s) %s' %
+                         ', '.join(unknown))
+    return tuple(sorted(set(names)))
+
+
+class Scheduler():
+    '''Hand out jobs in their given order, skipping those whose groups
+    are full. Jobs are queued by the set of groups they belong to, so
+    picking the next job costs one look per distinct set, not per job.'''
+
+    def __init__(self, groups, job_groups):
+        self.groups = groups
+        self.remaining = len(job_groups)
+        self.condition = Condition()
+        self.queues = OrderedDict()
+        self.held = {}
+        for index, names in enumerate(job_groups):
+            self.queues.setdefault(names, []).append(index)
+        for queue in self.queues.values():
+            queue.reverse()  # pop() from the end takes the earliest
+
+    def try_take(self):
+        '''Claim the earliest job whose groups all have room; return its
+        index, or None when there is none right now.'''
+        with self.condition:
+            best = None
+            for names, queue in self.queues.items():
+                if queue and (best is None or queue[-1] < best[1]) and \
+                        all(self.groups[name].has_room() for name in names):
+                    best = (names, queue[-1])
+            if best is None:
+                return None
+            names, index = best
+            self.queues[names].pop()
+            self.remaining -= 1
+            self.held[index] = names
+            for name in names:
+                group = self.groups[name]
+                group.running += 1
+                group.peak = max(group.peak, group.running)
+            return index
+
+    def take(self):
+        '''Block until a job may start and return its index, or None
+        once every job has been handed out.'''
+        with self.condition:
+            while self.remaining:
+                index = self.try_take()
+                if index is not None:
+                    return index
+                self.condition.wait()
+            return None
+
+    def release(self, index):
+        '''Free the slots held by a finished job.'''
+        with self.condition:
+            for name in self.held.pop(index):
+                self.groups[name].running -= 1
+            self.condition.notify_all()
+
+
+@contextmanager
+def job_groups(groups):
+    '''Make groups (ResourceGroups) the current job's in this thread.'''
+    previous = getattr(_CURRENT, 'groups', ())
+    _CURRENT.groups = groups
+    try:
+        yield groups
+    finally:
+        _CURRENT.groups = previous
+
+
+def throttle(count):
+    '''Meter count bytes through the current job's bandwidth limits,
+    sleeping while any of its groups is over its rate. A no-op outside
+    a job or without limits.'''
+    wait = 0.
+    for group in getattr(_CURRENT, 'groups', ()):
+        if group.bucket is not None:
+            wait = max(wait, group.bucket.reserve(count))
+    if wait > 0:
+        with phase('throttle'):
+            sleep(wait)
+
+
+def scp_progress():
+    '''A progress(filename, size, sent) callback for scp.SCPClient that
+    throttle()s each file's bytes as they arrive.'''
+    sent_before = {}
+
+    def progress(filename, size, sent):
+        throttle(sent - sent_before.get(filename, 0))
+        sent_before[filename] = sent
+    return progress
@@ -0,0 +1,57 @@
+# THIS FILE MANANGED BY PUPPET.
+''' runengine.py
+
+    Execution engine for getconfs jobs: the classic
+    multiprocessing.dummy thread pool. Every collector blocks on its
+    transport, so each running job holds a thread.
+
+    It can take a resourcegroups.Scheduler, which decides which job
+    starts next so per-group caps hold.'''
+
+import threading
+from multiprocessing.dummy import Pool
+
+
+def _run_scheduled(worker, jobs, pool_size, scheduler):
+    '''Run worker over jobs on pool_size threads, each taking whichever
+    job scheduler allows next. Return results in job order.'''
+    results = [None] * len(jobs)
+    errors = []
+
+    def runner():
+        while True:
+            index = scheduler.take()
+            if index is None:
+                return
+            try:
+                results[index] = worker(jobs[index])
+            except Exception as err:  # re-raised below, as Pool.map does
+                errors.append(err)
+            finally:
+                scheduler.release(index)
+
+    threads = [threading.Thread(target=runner, daemon=True)
+               for _ in range(max(1, min(pool_size, len(jobs))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def run_jobs(worker, jobs, pool_size, scheduler=None):
+    '''Run worker over jobs in a thread pool, starting them in job
+    order (or as scheduler allows). Return results in job order.'''
+    if scheduler is not None:
+        return _run_scheduled(worker, jobs, pool_size, scheduler)
+    pool = Pool(processes=pool_size)
+    try:
+        # One job per task, so jobs start in the order given rather
+        # than in consecutive chunks per thread
+        results = pool.map(worker, jobs, chunksize=1)
+    finally:
+        pool.close()  # no more tasks
+        pool.join()   # wrap up current tasks
+    return results
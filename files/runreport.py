@@ -0,0 +1,258 @@
+# THIS FILE MANANGED BY PUPPET.
+''' runreport.py
+
+    Per-job phase timing and the end-of-run report. getconfs opens a
+    JobRecord around each job; collectors wrap their steps in phase()
+    and the record of the job running in the current thread picks the
+    timing up. Errors logged while a job runs mark it failed. At the
+    end of a run, records are written as JSON lines and as a Prometheus
+    textfile-collector file.'''
+
+import json
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from threading import Lock, local
+from time import time
+
+PHASES = ('dns', 'connect', 'auth', 'stat', 'transfer', 'throttle',
+          'postprocess', 'write')
+
+_CURRENT = local()
+_RECORDS = []
+_RECORDS_LOCK = Lock()
+
+
+class JobRecord():
+    '''Timing, outcome and byte count of one job.'''
+
+    def __init__(self, section, host, device_type=None, **extra):
+        self.section = section
+        self.host = host
+        self.device_type = device_type
+        self.collector = None
+        self.started = None
+        self.duration = None
+        self.phases = OrderedDict()
+        self.outcome = 'ok'
+        self.error = None
+        self.bytes = 0
+        self.changed = 0
+        self.skipped = 0
+        self.extra = extra
+
+    def start(self):
+        '''Mark the job started.'''
+        self.started = time()
+
+    def finish(self):
+        '''Mark the job finished and keep the record for the report.'''
+        self.duration = time() - self.started
+        with _RECORDS_LOCK:
+            _RECORDS.append(self)
+
+    def add_phase(self, name, seconds):
+        '''Add seconds to a phase; phases may repeat within a job.'''
+        self.phases[name] = self.phases.get(name, 0.) + seconds
+
+    def fail(self, error, outcome='error'):
+        '''Mark the job failed, keeping the first error seen.'''
+        if self.outcome == 'ok':
+            self.outcome = outcome
+            self.error = str(error)
+
+    def as_dict(self):
+        '''JSON-serializable form of the record.'''
+        data = OrderedDict([
+            ('section', self.section),
+            ('host', self.host),
+            ('device_type', self.device_type),
+            ('collector', self.collector),
+            ('started', self.started),
+            ('duration', self.duration),
+            ('outcome', self.outcome),
+            ('error', self.error),
+            ('bytes', self.bytes),
+            ('changed', self.changed),
+            ('skipped', self.skipped),
+            ('phases', self.phases),
+        ])
+        data.update(self.extra)
+        return data
+
+
+def current():
+    '''The JobRecord of the job running in this thread, or None.'''
+    return getattr(_CURRENT, 'record', None)
+
+
+@contextmanager
+def job(record):
+    '''Time a blocking job, making record current for this thread.'''
+    _CURRENT.record = record
+    record.start()
+    try:
+        yield record
+    except Exception as err:
+        record.fail(err)
+        raise
+    finally:
+        _CURRENT.record = None
+        record.finish()
+
+
+@contextmanager
+def phase(name):
+    '''Time a step of the current job. A no-op outside a job.'''
+    record = current()
+    start = time()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record.add_phase(name, time() - start)
+
+
+def add_bytes(count, changed=False):
+    '''Count bytes fetched by the current job.'''
+    record = current()
+    if record is not None:
+        record.bytes += count
+        if changed:
+            record.changed += 1
+
+
+def add_skipped(count=1):
+    '''Count transfers the current job skipped as still fresh.'''
+    record = current()
+    if record is not None:
+        record.skipped += count
+
+
+def fail(error, outcome='error'):
+    '''Mark the current job failed.'''
+    record = current()
+    if record is not None:
+        record.fail(error, outcome)
+
+
+class OutcomeHandler(logging.Handler):
+    '''Mark the current job failed when anything logs an ERROR.
+    Collectors catch and log their own exceptions, so this is how most
+    failures reach the report.'''
+
+    def __init__(self, level=logging.ERROR):
+        super().__init__(level)
+
+    def emit(self, record):
+        fail(record.getMessage())
+
+
+def install_outcome_handler():
+    '''Attach OutcomeHandler to the root logger. Console output stays
+    up to the loggers' own handlers.'''
+    root = logging.getLogger()
+    if not any(isinstance(hdl, OutcomeHandler) for hdl in root.handlers):
+        root.addHandler(OutcomeHandler())
+
+
+def collect_records():
+    '''Return and forget the records of finished jobs.'''
+    with _RECORDS_LOCK:
+        records = list(_RECORDS)
+        del _RECORDS[:]
+    return records
+
+
+def _atomic_text(fname, text):
+    '''Write text to fname via a temp file in the same directory.'''
+    # confoutput imports this module, so import it only when needed
+    from confoutput import write_text
+
+    # textfile collectors run as another user
+    write_text(fname, text, 0o644)
+
+
+def write_jsonl(fname, records, summary=None):
+    '''Write one JSON object per job, plus an optional summary line.'''
+    lines = [json.dumps(rec.as_dict()) for rec in records]
+    if summary is not None:
+        lines.append(json.dumps(dict(summary, type='summary')))
+    _atomic_text(fname, ''.join(line + '\n' for line in lines))
+
+
+def _label(value):
+    '''Escape a Prometheus label value.'''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def prometheus_text(records, run_start, run_end, extra=None):
+    '''Render run metrics in Prometheus text exposition format.
+    extra is a list of (name, help, type, [(labels dict, value)]).'''
+    by_type = OrderedDict()
+    for rec in sorted(records, key=lambda r: str(r.device_type)):
+        by_type.setdefault(str(rec.device_type), []).append(rec)
+
+    metrics = [
+        ('getconfs_last_run_timestamp_seconds',
+         'When the last getconfs run finished.', 'gauge',
+         [({}, run_end)]),
+        ('getconfs_run_duration_seconds',
+         'Wall time of the last getconfs run.', 'gauge',
+         [({}, run_end - run_start)]),
+        ('getconfs_jobs',
+         'Jobs in the last run by device_type and outcome.', 'gauge',
+         [({'device_type': dtype, 'outcome': outcome},
+           sum(1 for rec in recs if rec.outcome == outcome))
+          for dtype, recs in by_type.items()
+          for outcome in sorted(set(rec.outcome for rec in recs))]),
+        ('getconfs_job_duration_seconds_sum',
+         'Total job time in the last run by device_type.', 'gauge',
+         [({'device_type': dtype}, sum(rec.duration or 0. for rec in recs))
+          for dtype, recs in by_type.items()]),
+        ('getconfs_job_duration_seconds_max',
+         'Slowest job in the last run by device_type.', 'gauge',
+         [({'device_type': dtype}, max(rec.duration or 0. for rec in recs))
+          for dtype, recs in by_type.items()]),
+        ('getconfs_phase_seconds_sum',
+         'Total time per job phase in the last run by device_type.',
+         'gauge',
+         [({'device_type': dtype, 'phase': name},
+           sum(rec.phases.get(name, 0.) for rec in recs))
+          for dtype, recs in by_type.items()
+          for name in PHASES
+          if any(name in rec.phases for rec in recs)]),
+        ('getconfs_fetched_bytes',
+         'Bytes fetched in the last run by device_type.', 'gauge',
+         [({'device_type': dtype}, sum(rec.bytes for rec in recs))
+          for dtype, recs in by_type.items()]),
+        ('getconfs_changed_files',
+         'Files changed in the last run by device_type.', 'gauge',
+         [({'device_type': dtype}, sum(rec.changed for rec in recs))
+          for dtype, recs in by_type.items()]),
+        ('getconfs_skipped_transfers',
+         'Transfers skipped as unchanged in the last run by device_type.',
+         'gauge',
+         [({'device_type': dtype}, sum(rec.skipped for rec in recs))
+          for dtype, recs in by_type.items()]),
+    ] + list(extra or [])
+
+    lines = []
+    for name, helptext, mtype, samples in metrics:
+        lines.append('# HELP %s %s' % (name, helptext))
+        lines.append('# TYPE %s %s' % (name, mtype))
+        for labels, value in samples:
+            if labels:
+                lines.append('%s{%s} %s' % (name, ','.join(
+                    '%s="%s"' % (key, _label(val))
+                    for key, val in sorted(labels.items())), repr(value)))
+            else:
+                lines.append('%s %s' % (name, repr(value)))
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus(fname, records, run_start, run_end, extra=None):
+    '''Write a Prometheus textfile-collector file atomically.'''
+    _atomic_text(fname, prometheus_text(records, run_start, run_end,
+                                        extra))
@@ -0,0 +1,54 @@
+# THIS FILE MANANGED BY PUPPET.
+''' runstate.py
+
+    Last outcome of every job, kept as JSON between runs, so getconfs
+    can re-run just the jobs that failed (--retry-failed) or just those
+    matching a glob (--only) instead of the whole getconfs.json. Each
+    run updates the sections it ran and leaves the others as they
+    were.'''
+
+from fnmatch import fnmatchcase
+
+from confoutput import load_json, save_json
+
+
+def matches(patterns, *values):
+    '''True when any value (section, host, device_type) matches any
+    glob in patterns.'''
+    return any(fnmatchcase(str(value), pattern)
+               for pattern in patterns for value in values
+               if value is not None)
+
+
+class RunState():
+    '''Outcome of each job (section) at its last run, persisted as JSON.'''
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.jobs = {}
+        self.load()
+
+    def load(self):
+        '''Read the state file, if there is one.'''
+        self.jobs = load_json(self.fname, 'jobs') or {}
+
+    def save(self):
+        '''Write the state file atomically.'''
+        save_json(self.fname, {'jobs': self.jobs})
+
+    def failed(self):
+        '''Sections whose last run did not end "ok".'''
+        return set(section for section, entry in self.jobs.items()
+                   if entry.get('outcome') != 'ok')
+
+    def update(self, records):
+        '''Store the outcomes of finished runreport.JobRecords.'''
+        for rec in records:
+            self.jobs[rec.section] = {
+                'host': rec.host,
+                'device_type': rec.device_type,
+                'outcome': rec.outcome,
+                'error': rec.error,
+                'finished': round((rec.started or 0.) +
+                                  (rec.duration or 0.), 3),
+            }
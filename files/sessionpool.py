@@ -0,0 +1,220 @@
+# THIS FILE MANANGED BY PUPPET.
+''' sessionpool.py
+
+    Shared Netmiko session pool. Jobs that talk to the same device
+    (an SCP section, an *sshcmd section and an esx.conf section, say)
+    borrow one connection instead of each paying for the TCP handshake,
+    key exchange, auth and enable() again.
+
+    Sessions are keyed by host, port, device_type and credentials. At
+    most per_host sessions are open to a host at once; idle sessions
+    are closed after idle_timeout seconds, or as soon as getconfs has
+    no more jobs for their host.'''
+
+import hashlib
+from contextlib import contextmanager
+from threading import Condition, Thread
+from time import time
+
+from runreport import phase
+
+PER_HOST = 2
+IDLE_TIMEOUT = 60.
+
+
+def session_key(nm_kwargs):
+    '''Pool key for a set of ConnectHandler() kwargs.'''
+    secrets = '\0'.join(str(nm_kwargs.get(name))
+                        for name in ('password', 'secret', 'key_file'))
+    return (nm_kwargs['host'],
+            nm_kwargs.get('port'),
+            nm_kwargs['device_type'],
+            nm_kwargs.get('username'),
+            hashlib.sha256(secrets.encode('utf-8')).hexdigest())
+
+
+def _connect(**nm_kwargs):
+    '''Open a Netmiko connection (imported lazily).'''
+    from netmiko import ConnectHandler
+    return ConnectHandler(**nm_kwargs)
+
+
+def _disconnect(conn):
+    '''Close a connection, ignoring errors from dead transports.'''
+    try:
+        conn.disconnect()
+    except Exception:
+        pass
+
+
+def _disconnect_all(conns):
+    '''Close connections side by side; Netmiko's disconnect() spends
+    seconds on its exit handshake.'''
+    threads = [Thread(target=_disconnect, args=(conn,)) for conn in conns]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+class SessionPool():
+    '''Thread-safe pool of Netmiko connections.'''
+
+    def __init__(self, per_host=PER_HOST, idle_timeout=IDLE_TIMEOUT,
+                 connect=_connect):
+        self.per_host = per_host
+        self.idle_timeout = idle_timeout
+        self.connect = connect
+        self.cond = Condition()
+        self.idle = {}       # key -> [(connection, idle since)]
+        self.open = {}       # host -> open (busy + idle) sessions
+        self.remaining = {}  # host -> jobs still to run, if known
+
+    def _pop_closable(self, host=None, expired_only=True):
+        '''Remove idle sessions that should close (expired ones, or any
+        for host) and return their connections. Call with cond held.'''
+        now = time()
+        closing = []
+        for key in list(self.idle):
+            keep = []
+            for conn, since in self.idle[key]:
+                if (host is not None and key[0] == host) or \
+                        (expired_only and now - since > self.idle_timeout):
+                    closing.append(conn)
+                    self.open[key[0]] -= 1
+                else:
+                    keep.append((conn, since))
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+        if closing:
+            self.cond.notify_all()
+        return closing
+
+    def _pop_idle_for_host(self, host):
+        '''Remove one idle session of any key for host, to free a slot.
+        Call with cond held.'''
+        for key in list(self.idle):
+            if key[0] == host:
+                conn, _ = self.idle[key].pop(0)
+                if not self.idle[key]:
+                    del self.idle[key]
+                self.open[host] -= 1
+                return conn
+        return None
+
+    def borrow(self, nm_kwargs):
+        '''Return (key, connection), reusing an idle session if one
+        matches, else opening one once the host has a free slot.'''
+        key = session_key(nm_kwargs)
+        host = key[0]
+        while True:
+            conn = None
+            closing = []
+            with self.cond:
+                while True:
+                    closing.extend(self._pop_closable())
+                    if self.idle.get(key):
+                        conn, _ = self.idle[key].pop()
+                        if not self.idle[key]:
+                            del self.idle[key]
+                        break
+                    if self.open.get(host, 0) < max(1, self.per_host):
+                        self.open[host] = self.open.get(host, 0) + 1
+                        break
+                    victim = self._pop_idle_for_host(host)
+                    if victim is not None:
+                        closing.append(victim)
+                        continue
+                    self.cond.wait(self.idle_timeout)
+            _disconnect_all(closing)
+
+            if conn is None:
+                try:
+                    with phase('connect'):
+                        conn = self.connect(**nm_kwargs)
+                except BaseException:
+                    with self.cond:
+                        self.open[host] -= 1
+                        self.cond.notify_all()
+                    raise
+                return key, conn
+
+            if conn.is_alive():
+                return key, conn
+            # Stale idle session: drop it and try again
+            _disconnect(conn)
+            with self.cond:
+                self.open[host] -= 1
+                self.cond.notify_all()
+
+    def release(self, key, conn, broken=False):
+        '''Give a connection back; close it if broken or if no more jobs
+        for its host are expected.'''
+        host = key[0]
+        with self.cond:
+            done = self.remaining.get(host) == 0
+            if broken or done:
+                self.open[host] -= 1
+            else:
+                self.idle.setdefault(key, []).append((conn, time()))
+            self.cond.notify_all()
+        if broken or done:
+            _disconnect(conn)
+
+    @contextmanager
+    def session(self, **nm_kwargs):
+        '''Borrow a connection for the duration of a with block. A
+        connection whose block raised is closed, not reused.'''
+        key, conn = self.borrow(nm_kwargs)
+        try:
+            yield conn
+        except BaseException:
+            self.release(key, conn, broken=True)
+            raise
+        self.release(key, conn)
+
+    def expect_jobs(self, hosts):
+        '''Register how many jobs will run per host, e.g. from a
+        collections.Counter, so sessions close after the last one.'''
+        with self.cond:
+            self.remaining.update(hosts)
+
+    def job_done(self, host):
+        '''Note that a job for host finished; close its idle sessions
+        once no more are expected.'''
+        with self.cond:
+            if host not in self.remaining:
+                return
+            self.remaining[host] = max(0, self.remaining[host] - 1)
+            closing = []
+            if self.remaining[host] == 0:
+                closing = self._pop_closable(host=host, expired_only=False)
+        _disconnect_all(closing)
+
+    def close_all(self):
+        '''Close every idle session.'''
+        with self.cond:
+            closing = [conn for sessions in self.idle.values()
+                       for conn, _ in sessions]
+            for key, sessions in self.idle.items():
+                self.open[key[0]] -= len(sessions)
+            self.idle.clear()
+            self.cond.notify_all()
+        _disconnect_all(closing)
+
+
+POOL = SessionPool()
+
+
+def configure(per_host=PER_HOST, idle_timeout=IDLE_TIMEOUT):
+    '''Set the shared pool's limits.'''
+    POOL.per_host = per_host
+    POOL.idle_timeout = idle_timeout
+
+
+def session(**nm_kwargs):
+    '''Borrow a connection from the shared pool; see
+    SessionPool.session().'''
+    return POOL.session(**nm_kwargs)
@@ -0,0 +1,47 @@
+# THIS FILE MANANGED BY PUPPET.
+''' sharding.py
+
+    Split getconfs jobs across collector nodes with rendezvous (highest
+    random weight) hashing. Every node hashes each device's host with
+    each node name and keeps the devices it scores highest on, so all
+    nodes agree on the split without talking to each other, and adding
+    or removing one of N nodes moves only about 1/N of the devices.
+
+    Hashing by host rather than section keeps every job for one device
+    on one node, where they can share SSH sessions.'''
+
+import hashlib
+
+
+def parse_shard(spec):
+    '''Turn "K/N" (1 <= K <= N) into (node name K, node names 1..N).'''
+    try:
+        index, count = (int(part) for part in spec.split('/'))
+    except ValueError:
+        raise ValueError('shard must look like K/N, not %r' % spec)
+    if not 1 <= index <= count:
+        raise ValueError('shard %r: K must be between 1 and N' % spec)
+    return str(index), [str(num) for num in range(1, count + 1)]
+
+
+def parse_nodes(nodes, node):
+    '''Check a node list (comma-separated or a list) and this node's
+    name; return (node, nodes).'''
+    if isinstance(nodes, str):
+        nodes = nodes.split(',')
+    nodes = sorted(set(name.strip() for name in nodes if name.strip()))
+    if node not in nodes:
+        raise ValueError('node %r is not in the node list (%s)' %
+                         (node, ', '.join(nodes)))
+    return node, nodes
+
+
+def weight(node, key):
+    '''Rendezvous weight of key on node; stable across runs and hosts.'''
+    digest = hashlib.sha256(('%s\0%s' % (node, key)).encode('utf-8'))
+    return int.from_bytes(digest.digest()[:8], 'big')
+
+
+def owner(key, nodes):
+    '''The node that key belongs to.'''
+    return max(nodes, key=lambda node: (weight(node, key), node))
@@ -1,19 +1,138 @@
 # THIS FILE MANANGED BY PUPPET.
-'''Set up logging, SOMTS-style'''
+'''Set up logging, SOMTS-style.
 
+All loggers set up here share one QueueHandler/QueueListener pipeline.
+Callers only pay for putting a record on a queue; a single listener
+thread routes each record to its logger's log file, keeping at most
+MAX_OPEN_FILES of those files open at a time.'''
+
+import atexit
 import logging
+import logging.handlers
+from collections import OrderedDict
+from queue import Queue
+from threading import Lock
+
+FORMAT = "\t".join(['%(asctime)s ' +
+                    '%(pathname)s:%(lineno)d',
+                    '%(levelname)s',
+                    '%(message)s',])
+MAX_OPEN_FILES = 64
+
+
+class RoutingHandler(logging.Handler):
+    '''Write each record to the log file registered for its logger name.
+    File handlers are opened on demand and the least recently used one
+    is closed once more than max_open are open.'''
+
+    def __init__(self, max_open=MAX_OPEN_FILES, max_bytes=0,
+                 backup_count=7, when=None):
+        super().__init__()
+        self.routes = {}               # logger name -> log file
+        self.handlers = OrderedDict()  # log file -> handler, LRU first
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.when = when
+        self.formatter = logging.Formatter(FORMAT)
+
+    def add_route(self, logger_name, log_file):
+        '''Send records from logger_name to log_file.'''
+        self.routes[logger_name] = str(log_file)
+
+    def make_handler(self, log_file):
+        '''Open a (possibly rotating) file handler for log_file. By
+        default, rotation is left to logrotate.'''
+        if self.when:
+            handler = logging.handlers.TimedRotatingFileHandler(
+                log_file, when=self.when, backupCount=self.backup_count,
+                delay=True)
+        elif self.max_bytes:
+            handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=self.max_bytes,
+                backupCount=self.backup_count, delay=True)
+        else:
+            handler = logging.handlers.WatchedFileHandler(log_file,
+                                                          delay=True)
+        handler.setFormatter(self.formatter)
+        return handler
+
+    def handler_for(self, log_file):
+        '''Return the open handler for log_file, evicting the least
+        recently used handler when over max_open.'''
+        handler = self.handlers.pop(log_file, None)
+        if handler is None:
+            handler = self.make_handler(log_file)
+        self.handlers[log_file] = handler
+
+        while len(self.handlers) > max(1, self.max_open):
+            _, oldest = self.handlers.popitem(last=False)
+            oldest.close()
+        return handler
+
+    def emit(self, record):
+        '''Only ever called from the listener thread.'''
+        log_file = self.routes.get(record.name)
+        if log_file is not None:
+            self.handler_for(log_file).handle(record)
+
+    def close(self):
+        '''Close every open log file.'''
+        while self.handlers:
+            _, handler = self.handlers.popitem()
+            handler.close()
+        super().close()
+
+
+_QUEUE = Queue(-1)
+_ROUTER = RoutingHandler()
+_LISTENER = None
+_LOCK = Lock()
+
+
+def configure(max_open=MAX_OPEN_FILES, max_bytes=0, backup_count=7,
+              when=None):
+    '''Set the open file cap and optional size (max_bytes) or time (when,
+    as for TimedRotatingFileHandler) rotation for the pipeline. Call
+    before setting up loggers.'''
+    _ROUTER.max_open = max_open
+    _ROUTER.max_bytes = max_bytes
+    _ROUTER.backup_count = backup_count
+    _ROUTER.when = when
+
+
+def start():
+    '''Start the listener thread, if it is not running.'''
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is None:
+            _LISTENER = logging.handlers.QueueListener(_QUEUE, _ROUTER)
+            _LISTENER.start()
+            atexit.register(stop)
+
+
+def stop():
+    '''Drain the queue, stop the listener and close log files.'''
+    global _LISTENER
+    with _LOCK:
+        if _LISTENER is not None:
+            _LISTENER.stop()
+            _LISTENER = None
+            atexit.unregister(stop)
+    _ROUTER.close()
+
 
 def setup_logger(logger_name, log_file, level=logging.INFO):
     '''Set up a logging instance to a file'''
     logger = logging.getLogger(logger_name)
-    formatter = logging.Formatter("\t".join(['%(asctime)s ' +
-                                             '%(pathname)s:%(lineno)d',
-                                             '%(levelname)s',
-                                             '%(message)s',]))
-    file_handler = logging.FileHandler(log_file, mode='a')
-    file_handler.setFormatter(formatter)
+    _ROUTER.add_route(logger_name, log_file)
+
+    # Only ever attach one queue handler, however often we are called
+    if not any(getattr(handler, 'queue', None) is _QUEUE
+               for handler in logger.handlers):
+        logger.addHandler(logging.handlers.QueueHandler(_QUEUE))
 
     logger.setLevel(level)
-    logger.addHandler(file_handler)
+    start()
 
     return logger
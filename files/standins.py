@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+''' standins.py
+
+    Local stand-ins for the devices getconfs collects from, so getconfs
+    can be exercised and benchmarked without real hardware. Not deployed
+    by Puppet. Every stand-in takes a per-round-trip latency and a
+    config payload size:
+
+    * SSH/SCP answering like a Cisco IOS device in enable mode, plus
+      SFTP stat() of its files (collectscp, collectsshcmd)
+    * SSH answering like a Q-flex modem speaking PUP, with uuencoded
+      tgz `getcurrentconfig` output (collectqflex)
+    * HTTP with the Advantech and Pepperl+Fuchs export endpoints,
+      which honour If-None-Match (collectadvantech, collectpepperlfuchs)
+    * HTTPS with the pfSense diag_backup.php CSRF login flow and the
+      Peplink MANGA API (collectpfsense, collectpeplink)
+    * telnet answering like a MediaCento on port 24
+      (collectmediacento)
+    * a "blackhole" port whose connection attempts hang, like a
+      powered-off device behind a firewall that drops packets
+
+    With --volatile, configs and show output carry lines that change on
+    every request, as real devices' do: IOS "Last configuration change"
+    and "ntp clock-period" lines, interface counters, a pfSense
+    revision time and indentation that varies, and Peplink blobs of
+    random bytes.
+
+    Stand-ins listen on all addresses, so every 127.x.y.z address on
+    the loopback can play a different device. Run them with
+
+        python3 files/standins.py serve --help
+
+    Needs paramiko (SSH) and cryptography (TLS), which netmiko pulls in.'''
+
+import binascii
+import email.utils
+import hashlib
+import io
+import logging
+import re
+import secrets
+import socket
+import socketserver
+import ssl
+import sys
+import tarfile
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from tempfile import NamedTemporaryFile
+from urllib.parse import parse_qs, urlparse
+
+import paramiko
+
+DEFAULT_PORTS = {
+    'ssh': 2222,
+    'qflex': 2223,
+    'http': 8080,
+    'https': 8443,
+    'telnet': 2424,
+    'blackhole': 2099,
+}
+
+
+def payload(kind, size, seed=''):
+    '''Deterministic config text of about size bytes.'''
+    lines = ['! %s stand-in config %s' % (kind, seed)]
+    total = len(lines[0]) + 1
+    num = 0
+    while total < size:
+        line = ('interface GigabitEthernet0/%i\n'
+                ' description stand-in %s port %i\n'
+                ' switchport access vlan %i' % (num, seed, num, num % 4094))
+        lines.append(line)
+        total += len(line) + 1
+        num += 1
+    return '\n'.join(lines) + '\n'
+
+
+def uuencode_tgz(member_name, data):
+    '''Return a tgz holding one member, uuencoded like Q-flex
+    `getcurrentconfig` output.'''
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode='w:gz') as tar:
+        info = tarfile.TarInfo(member_name)
+        info.size = len(data)
+        info.mtime = 0
+        tar.addfile(info, io.BytesIO(data))
+    raw = buf.getvalue()
+
+    lines = ['begin 644 config.tgz']
+    for start in range(0, len(raw), 45):
+        lines.append(binascii.b2a_uu(raw[start:start + 45])
+                     .decode('ascii').rstrip('\n'))
+    lines.extend(['`', 'end'])
+    return '\n'.join(lines)
+
+
+class Farm():
+    '''Settings shared by all stand-ins.'''
+
+    def __init__(self, latency=0., payload_size=20000, volatile=False):
+        self.latency = latency
+        self.payload_size = payload_size
+        self.volatile = volatile
+        self.started = int(time.time())  # mtime of every served config
+        self.lock = threading.Lock()
+        self.counters = {}
+
+    def delay(self, since=None):
+        '''Simulate one network round trip, or what is left of it since
+        the request arrived at since.'''
+        if self.latency:
+            elapsed = 0. if since is None else time.time() - since
+            time.sleep(max(0., self.latency - elapsed))
+
+    def count(self, name):
+        '''Count a served request.'''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def header(self, kind):
+        '''Lines that change with every request (fixed width, so file
+        sizes stay the same), or '' unless volatile.'''
+        if not self.volatile:
+            return ''
+        now = time.time()
+        with self.lock:
+            self.counters['volatile'] = tick = \
+                self.counters.get('volatile', 0) + 1
+        if kind == 'show':
+            return ('Uptime is %010i seconds\n'
+                    ' %010i packets input, %012i bytes\n' %
+                    (now - self.started, tick * 7919, tick * 7919 * 64))
+        return ('! Last configuration change at %s by admin\n'
+                'ntp clock-period %010i\n' %
+                (time.strftime('%H:%M:%S UTC %a %b %d %Y', time.gmtime(now)),
+                 36000000 + tick % 1000))
+
+
+# SSH ###############################################################
+
+class CiscoPersonality():
+    '''Answer CLI commands like IOS in enable mode.'''
+
+    prompt = 'standin#'
+
+    def __init__(self, farm):
+        self.farm = farm
+
+    def respond(self, cmd, local_ip):
+        '''Output for one CLI command.'''
+        if cmd in ('', 'enable') or cmd.startswith('terminal ') or \
+                cmd.startswith('!'):
+            return ''
+        if cmd.startswith('show') or cmd.startswith('more'):
+            self.farm.count('ssh_show')
+            return self.farm.header('show') + \
+                payload('ios', self.farm.payload_size, local_ip)
+        return "% Invalid input detected at '^' marker.\n"
+
+    def file_data(self, path, local_ip):
+        '''Content served to `scp -f path`.'''
+        self.farm.count('scp_get')
+        return (self.farm.header('ios') +
+                payload('ios', self.farm.payload_size,
+                        '%s %s' % (local_ip, path))).encode('utf-8')
+
+
+class QflexPersonality(CiscoPersonality):
+    '''Answer PUP commands like a Teledyne Paradise Q-flex.'''
+
+    prompt = 'pup@qflex:~$ '
+
+    def respond(self, cmd, local_ip):
+        if cmd == 'getcurrentconfig':
+            self.farm.count('qflex_getcurrentconfig')
+            conf = ''.join('<set name="Stand%i" value="%s" />\n' % (
+                num, local_ip) for num in range(
+                    max(1, self.farm.payload_size // 40)))
+            return uuencode_tgz('default.conf', conf.encode('utf-8'))
+        if cmd == 'getcurrent':
+            self.farm.count('qflex_getcurrent')
+            return ''.join('%i=%s\n' % (num, local_ip) for num in range(
+                max(1, self.farm.payload_size // 20)))
+        return ''
+
+
+class _StatSFTP(paramiko.SFTPServerInterface):
+    '''SFTP that can only stat() the files `scp -f` would serve.'''
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.personality = server.personality
+        self.local_ip = server.local_ip
+
+    def stat(self, path):
+        farm = self.personality.farm
+        farm.count('sftp_stat')
+        attrs = paramiko.SFTPAttributes()
+        attrs.st_size = len((farm.header('ios') +
+                             payload('ios', farm.payload_size,
+                                     '%s %s' % (self.local_ip, path)))
+                            .encode('utf-8'))
+        attrs.st_mode = 0o100644
+        attrs.st_mtime = attrs.st_atime = farm.started
+        return attrs
+
+    lstat = stat
+
+
+class _SSHServer(paramiko.ServerInterface):
+    '''Accept any password; serve a shell or `scp -f`.'''
+
+    def __init__(self, personality, local_ip):
+        self.personality = personality
+        self.local_ip = local_ip
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, term, width, height,
+                                  pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        threading.Thread(target=self.shell, args=(channel,),
+                         daemon=True).start()
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        command = command.decode('utf-8', 'replace')
+        if not command.startswith('scp ') or ' -f' not in command:
+            return False
+        threading.Thread(target=self.scp_source,
+                         args=(channel, command.split()[-1]),
+                         daemon=True).start()
+        return True
+
+    def shell(self, chan):
+        '''Line-at-a-time CLI with command echo, like a device pty.'''
+        farm = self.personality.farm
+        prompt = self.personality.prompt
+        try:
+            chan.sendall(('\r\n' + prompt).encode('utf-8'))
+            buf = b''
+            while True:
+                data = chan.recv(4096)
+                if not data:
+                    break
+                arrived = time.time()
+                buf += data
+                while True:
+                    match = re.search(b'\r\n|\n|\r', buf)
+                    if match is None:
+                        break
+                    line = buf[:match.start()].decode('utf-8', 'replace')
+                    buf = buf[match.end():]
+                    cmd = line.strip()
+                    if cmd in ('exit', 'logout', 'quit'):
+                        chan.close()
+                        return
+                    out = self.personality.respond(cmd, self.local_ip)
+                    if out and not out.endswith('\n'):
+                        out += '\n'
+                    # Lines typed ahead share one round trip
+                    farm.delay(arrived)
+                    chan.sendall((line + '\r\n' + out + prompt)
+                                 .replace('\n', '\r\n')
+                                 .replace('\r\r\n', '\r\n')
+                                 .encode('utf-8'))
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            chan.close()
+
+    def scp_source(self, chan, path):
+        '''Serve one file with the scp source-side protocol.'''
+        data = self.personality.file_data(path, self.local_ip)
+        try:
+            self.personality.farm.delay()
+            chan.recv(1)  # ready
+            chan.sendall(('C0644 %i %s\n' % (
+                len(data), path.split('/')[-1].split(':')[-1]))
+                         .encode('utf-8'))
+            chan.recv(1)  # header ack
+            chan.sendall(data)
+            chan.sendall(b'\x00')
+            chan.recv(1)  # data ack
+            chan.send_exit_status(0)
+        except (EOFError, OSError, paramiko.SSHException):
+            pass
+        finally:
+            chan.close()
+
+
+class SSHStandin():
+    '''paramiko-based SSH listener with one personality.'''
+
+    def __init__(self, personality, port, host_key=None):
+        self.personality = personality
+        self.host_key = host_key or paramiko.RSAKey.generate(2048)
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', port))
+        self.sock.listen(1024)
+
+    def serve_forever(self):
+        '''Accept connections until the process exits.'''
+        while True:
+            client, _ = self.sock.accept()
+            threading.Thread(target=self.handle, args=(client,),
+                             daemon=True).start()
+
+    def handle(self, client):
+        '''Run one SSH transport.'''
+        transport = paramiko.Transport(client)
+        transport.add_server_key(self.host_key)
+        transport.set_subsystem_handler('sftp', paramiko.SFTPServer,
+                                        _StatSFTP)
+        try:
+            transport.start_server(server=_SSHServer(
+                self.personality, client.getsockname()[0]))
+        except (EOFError, OSError, paramiko.SSHException):
+            transport.close()
+            return
+        self.personality.farm.count('ssh_connect')
+
+
+# HTTP ##############################################################
+
+PFSENSE_FORM = '''<html><body><form method="post">
+<input type='hidden' name='__csrf_magic' value="%s" />
+<input name="usernamefld" /><input name="passwordfld" />
+</form></body></html>
+'''
+
+
+class _HTTPHandler(BaseHTTPRequestHandler):
+    '''Advantech, Pepperl+Fuchs, pfSense and Peplink endpoints.'''
+
+    protocol_version = 'HTTP/1.1'
+    farm = None
+    sessions = {}
+    sessions_lock = threading.Lock()
+
+    def log_message(self, *args):  # keep the farm quiet
+        pass
+
+    def send_body(self, body, ctype='text/plain', status=200, headers=None):
+        '''Send a complete response.'''
+        self.farm.delay()
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_config(self, kind):
+        '''Send a device config with an ETag and Last-Modified, or a 304
+        if the client already has it.'''
+        body = self.config(kind)
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        headers = {'ETag': etag,
+                   'Last-Modified': email.utils.formatdate(self.farm.started,
+                                                           usegmt=True)}
+        if self.headers.get('If-None-Match') == etag:
+            self.farm.count('%s_not_modified' % kind)
+            return self.send_body(b'', status=304, headers=headers)
+        self.farm.count(kind)
+        return self.send_body(body, headers=headers)
+
+    def config(self, kind):
+        '''Payload for this device.'''
+        return payload(kind, self.farm.payload_size,
+                       self.connection.getsockname()[0]).encode('utf-8')
+
+    def session(self):
+        '''pfSense session state from the cookie, or None.'''
+        cookie = self.headers.get('Cookie', '')
+        match = re.search(r'PHPSESSID=(\w+)', cookie)
+        if match is None:
+            return None
+        with self.sessions_lock:
+            return self.sessions.get(match.group(1))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == '/cgi-bin/result.cgi' and \
+                query.get('types') == ['export']:
+            return self.send_config('advantech')
+        if url.path == '/cgi-bin/index.cgi' and \
+                query.get('func') == ['doexport']:
+            return self.send_config('advantech')
+        if url.path == '/goforms/ConfigGet':
+            return self.send_config('pepperlfuchs')
+        if url.path == '/diag_backup.php':
+            sid, csrf = secrets.token_hex(8), 'sid:%s,1' % secrets.token_hex(8)
+            with self.sessions_lock:
+                self.sessions[sid] = {'csrf': csrf, 'auth': False}
+            return self.send_body((PFSENSE_FORM % csrf).encode('utf-8'),
+                                  'text/html',
+                                  headers={'Set-Cookie': 'PHPSESSID=%s' % sid})
+        if url.path == '/cgi-bin/MANGA/download_config.cgi':
+            if 'bauth=' not in self.headers.get('Cookie', ''):
+                return self.send_body(b'', status=401)
+            self.farm.count('peplink')
+            if self.farm.volatile:  # encrypted; new bytes every time
+                body = secrets.token_bytes(self.farm.payload_size)
+            else:
+                body = self.config('peplink')
+            return self.send_body(b'\x00PEPLINK' + body,
+                                  'application/octet-stream')
+        return self.send_body(b'not found', status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        form = parse_qs(self.rfile.read(length).decode('utf-8'))
+        field = lambda name: form.get(name, [None])[0]
+        url = urlparse(self.path)
+
+        if url.path == '/diag_backup.php':
+            state = self.session()
+            if state is None or field('__csrf_magic') != state['csrf']:
+                return self.send_body(b'CSRF check failed', status=403)
+            state['csrf'] = 'sid:%s,2' % secrets.token_hex(8)
+            if field('login'):
+                state['auth'] = True
+                return self.send_body(
+                    (PFSENSE_FORM % state['csrf']).encode('utf-8'),
+                    'text/html')
+            if field('download') and state['auth']:
+                self.farm.count('pfsense')
+                indent, revision = '  ', ''
+                if self.farm.volatile:
+                    indent = '    ' if self.farm.counters['pfsense'] % 2 \
+                        else '  '
+                    revision = '%s<revision><time>%i</time></revision>\n' % (
+                        indent, time.time())
+                xml = ('<?xml version="1.0"?>\n<pfsense>\n%s%s</pfsense>\n' %
+                       (revision, ''.join(
+                           '%s<rule>%i</rule>\n' % (indent, num)
+                           for num in range(
+                               max(1, self.farm.payload_size // 20)))))
+                return self.send_body(xml.encode('utf-8'), 'application/xml')
+            return self.send_body(b'forbidden', status=403)
+
+        if url.path == '/cgi-bin/MANGA/api.cgi' and field('func') == 'login':
+            return self.send_body(b'{"stat":"ok"}', 'application/json',
+                                  headers={'Set-Cookie': 'bauth=standin'})
+        return self.send_body(b'not found', status=404)
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    '''http.server.ThreadingHTTPServer is Python 3.7+.'''
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def self_signed_context():
+    '''Server SSL context with a throwaway self-signed certificate.'''
+    from datetime import datetime, timedelta
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'standin')])
+    now = datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()).serial_number(x509.random_serial_number()) \
+        .not_valid_before(now - timedelta(days=1)) \
+        .not_valid_after(now + timedelta(days=30)) \
+        .sign(key, hashes.SHA256())
+
+    with NamedTemporaryFile(suffix='.pem') as pem:
+        pem.write(key.private_bytes(serialization.Encoding.PEM,
+                                    serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()))
+        pem.write(cert.public_bytes(serialization.Encoding.PEM))
+        pem.flush()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(pem.name)
+    return context
+
+
+def http_standin(farm, port, tls=False):
+    '''Build the HTTP(S) stand-in server.'''
+    handler = type('HTTPHandler', (_HTTPHandler,), {'farm': farm})
+    server = ThreadingHTTPServer(('0.0.0.0', port), handler)
+    if tls:
+        server.socket = self_signed_context().wrap_socket(server.socket,
+                                                          server_side=True)
+    return server
+
+
+# Telnet ############################################################
+
+class _TelnetHandler(socketserver.StreamRequestHandler):
+    '''MediaCento: `login: `, no password, then a `#` shell.'''
+
+    farm = None
+
+    def readline(self):
+        '''Read a command line, ignoring telnet option negotiation.'''
+        line = self.rfile.readline()
+        return re.sub(rb'\xff[\xfb-\xfe].|\xff.', b'', line) \
+            .decode('utf-8', 'replace').strip()
+
+    def handle(self):
+        self.farm.delay()
+        self.wfile.write(b'login: ')
+        self.readline()
+        self.farm.delay()
+        self.wfile.write(b'\r\n# ')
+        cmd = self.readline()
+        self.farm.count('mediacento')
+        dump = '\n'.join('stand_in_%i=%s' % (num, self.client_address[0])
+                         for num in range(max(1, self.farm.payload_size //
+                                              24)))
+        self.farm.delay()
+        self.wfile.write(('%s\r\n%s\r\n# ' % (cmd, dump)).encode('utf-8'))
+        self.readline()  # wait for the client to hang up
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    '''Threaded TCP server for the telnet stand-in.'''
+    allow_reuse_address = True
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def telnet_standin(farm, port):
+    '''Build the MediaCento telnet stand-in server.'''
+    handler = type('TelnetHandler', (_TelnetHandler,), {'farm': farm})
+    return ThreadingTCPServer(('0.0.0.0', port), handler)
+
+
+class Blackhole():
+    '''A listener that never accepts. Once its backlog is full, Linux
+    drops further SYNs, so connecting hangs until the client gives up.'''
+
+    def __init__(self, port):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('0.0.0.0', port))
+        self.sock.listen(0)
+        self.fillers = []
+        for _ in range(3):  # fill the backlog
+            filler = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            filler.setblocking(False)
+            filler.connect_ex(('127.0.0.1', port))
+            self.fillers.append(filler)
+
+    def serve_forever(self):
+        '''Hold the sockets open; never accept.'''
+        threading.Event().wait()
+
+
+# Main ##############################################################
+
+def start(farm, ports):
+    '''Start every stand-in with a port in ports in daemon threads.
+    Return the server objects.'''
+    servers = []
+    host_key = paramiko.RSAKey.generate(2048)
+    if ports.get('ssh'):
+        servers.append(SSHStandin(CiscoPersonality(farm), ports['ssh'],
+                                  host_key))
+    if ports.get('qflex'):
+        servers.append(SSHStandin(QflexPersonality(farm), ports['qflex'],
+                                  host_key))
+    if ports.get('http'):
+        servers.append(http_standin(farm, ports['http']))
+    if ports.get('https'):
+        servers.append(http_standin(farm, ports['https'], tls=True))
+    if ports.get('telnet'):
+        servers.append(telnet_standin(farm, ports['telnet']))
+    if ports.get('blackhole'):
+        servers.append(Blackhole(ports['blackhole']))
+
+    for server in servers:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    return servers
+
+
+def get_arguments():
+    '''Get/set command-line options'''
+    parser = ArgumentParser()
+    sub = parser.add_subparsers(dest='command')
+    serve = sub.add_parser('serve', help='Run stand-ins until killed.')
+    serve.add_argument('--latency', type=float, default=0.,
+                       help='Seconds added to each round trip.')
+    serve.add_argument('--payload-size', type=int, default=20000,
+                       help='Approximate config size in bytes.')
+    serve.add_argument('--volatile', action='store_true',
+                       help='Vary timestamps and counters per request.')
+    for name, port in sorted(DEFAULT_PORTS.items()):
+        serve.add_argument('--%s-port' % name, type=int, default=port,
+                           help='0 disables. Default: %i.' % port)
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a command is required')
+    return args
+
+
+def main():
+    '''Serve stand-ins until interrupted; print READY once listening.'''
+    args = get_arguments()
+    # Clients hanging up mid-session is normal here; don't log it.
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+    farm = Farm(latency=args.latency, payload_size=args.payload_size,
+                volatile=args.volatile)
+    start(farm, {name: getattr(args, '%s_port' % name)
+                 for name in DEFAULT_PORTS})
+    print('READY', flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
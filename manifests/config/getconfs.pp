@@ -1,9 +1,17 @@
-# SCP (via Netmiko) config grabber class.
+# SCP (via Netmiko) config grabber class. With shard_nodes (the
+# confcollect::hostname of every collector node sharing one
+# getconfs_settings), each node collects and commits only its share of
+# the devices. log_max_bytes or log_rotate_when (e.g. 'midnight') make
+# getconfs rotate its own logs, keeping log_backups of each.
 class confcollect::config::getconfs(
-  Optional[Stdlib::Absolutepath]          $repodir  = undef,
-  Hash                                    $settings = {},
-  Optional[Variant[String,Integer,Array]] $hour     = undef,
-  Optional[Variant[String,Integer,Array]] $minute   = undef,
+  Optional[Stdlib::Absolutepath]          $repodir         = undef,
+  Hash                                    $settings        = {},
+  Optional[Variant[String,Integer,Array]] $hour            = undef,
+  Optional[Variant[String,Integer,Array]] $minute          = undef,
+  Array[String]                           $shard_nodes     = [],
+  Optional[Integer[0]]                    $log_max_bytes   = undef,
+  Optional[String]                        $log_rotate_when = undef,
+  Optional[Integer[0]]                    $log_backups     = undef,
 ) {
   include confcollect
 
@@ -40,6 +48,9 @@ class confcollect::config::getconfs(
     "${confcollect::_python_pyvenv}/getconfs.py"          => {
       source => 'puppet:///modules/confcollect/getconfs.py',
     },
+    "${confcollect::_python_pyvenv}/artifactstore.py"     => {
+      source => 'puppet:///modules/confcollect/artifactstore.py',
+    },
     "${confcollect::_python_pyvenv}/collectadvantech.py"  => {
       source => 'puppet:///modules/confcollect/collectadvantech.py',
     },
@@ -69,6 +80,54 @@ class confcollect::config::getconfs(
     "${confcollect::_python_pyvenv}/collectsshcmd.py"        => {
       source => 'puppet:///modules/confcollect/collectsshcmd.py',
     },
+    "${confcollect::_python_pyvenv}/collectregistry.py"   => {
+      source => 'puppet:///modules/confcollect/collectregistry.py',
+    },
+    "${confcollect::_python_pyvenv}/confoutput.py"        => {
+        source  => 'puppet:///modules/confcollect/confoutput.py',
+    },
+    "${confcollect::_python_pyvenv}/extsort.py"           => {
+        source  => 'puppet:///modules/confcollect/extsort.py',
+    },
+    "${confcollect::_python_pyvenv}/freshness.py"         => {
+        source  => 'puppet:///modules/confcollect/freshness.py',
+    },
+    "${confcollect::_python_pyvenv}/httpoutput.py"        => {
+        source  => 'puppet:///modules/confcollect/httpoutput.py',
+    },
+    "${confcollect::_python_pyvenv}/jobhistory.py"        => {
+        source  => 'puppet:///modules/confcollect/jobhistory.py',
+    },
+    "${confcollect::_python_pyvenv}/normalize.py"         => {
+        source  => 'puppet:///modules/confcollect/normalize.py',
+    },
+    "${confcollect::_python_pyvenv}/postprocess.py"       => {
+        source  => 'puppet:///modules/confcollect/postprocess.py',
+    },
+    "${confcollect::_python_pyvenv}/reachability.py"      => {
+        source  => 'puppet:///modules/confcollect/reachability.py',
+    },
+    "${confcollect::_python_pyvenv}/resolver.py"          => {
+        source  => 'puppet:///modules/confcollect/resolver.py',
+    },
+    "${confcollect::_python_pyvenv}/resourcegroups.py"    => {
+        source  => 'puppet:///modules/confcollect/resourcegroups.py',
+    },
+    "${confcollect::_python_pyvenv}/runreport.py"         => {
+        source  => 'puppet:///modules/confcollect/runreport.py',
+    },
+    "${confcollect::_python_pyvenv}/runstate.py"          => {
+        source  => 'puppet:///modules/confcollect/runstate.py',
+    },
+    "${confcollect::_python_pyvenv}/runengine.py"         => {
+        source  => 'puppet:///modules/confcollect/runengine.py',
+    },
+    "${confcollect::_python_pyvenv}/sessionpool.py"       => {
+        source  => 'puppet:///modules/confcollect/sessionpool.py',
+    },
+    "${confcollect::_python_pyvenv}/sharding.py"          => {
+        source  => 'puppet:///modules/confcollect/sharding.py',
+    },
     "${confcollect::_python_pyvenv}/gitcheck.py"          => {
         source  => 'puppet:///modules/confcollect/gitcheck.py',
     },
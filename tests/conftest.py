@@ -0,0 +1,48 @@
+''' conftest.py
+
+    Shared fixtures. The modules under test live in files/, as they are
+    deployed flat into the getconfs venv.'''
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'files'))
+
+
+def git(cwd, *args):
+    '''Run git in cwd; return its stdout.'''
+    return subprocess.run(('git',) + args, cwd=str(cwd), check=True,
+                          stdout=subprocess.PIPE,
+                          universal_newlines=True).stdout
+
+
+@pytest.fixture
+def origin(tmp_path, monkeypatch):
+    '''A bare repo with one commit on master; returns a function that
+    makes a new clone of it under tmp_path.'''
+    for var, value in (('GIT_AUTHOR_NAME', 'test'),
+                       ('GIT_AUTHOR_EMAIL', 'test@example.com'),
+                       ('GIT_COMMITTER_NAME', 'test'),
+                       ('GIT_COMMITTER_EMAIL', 'test@example.com'),
+                       ('GIT_CONFIG_NOSYSTEM', '1'),
+                       ('HOME', str(tmp_path))):
+        monkeypatch.setenv(var, value)
+    bare = tmp_path / 'origin.git'
+    git(tmp_path, 'init', '-q', '--bare', '-b', 'master', str(bare))
+    seed = tmp_path / 'seed'
+    git(tmp_path, 'clone', '-q', str(bare), str(seed))
+    (seed / 'README').write_text('configs\n')
+    git(seed, 'add', 'README')
+    git(seed, 'commit', '-q', '-m', 'seed')
+    git(seed, 'push', '-q', 'origin', 'HEAD:master')
+
+    def clone(name):
+        dest = tmp_path / name
+        git(tmp_path, 'clone', '-q', str(bare), str(dest))
+        return dest
+    clone.bare = bare
+    return clone
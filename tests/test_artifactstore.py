@@ -0,0 +1,126 @@
+''' test_artifactstore.py'''
+
+import io
+import os
+import random
+
+import pytest
+
+import artifactstore
+import confoutput
+from artifactstore import ArtifactStore, job_store, read_pointer
+from normalize import job_filters
+
+
+def config(lines, seed=1):
+    '''A text config of about 60 bytes per line.'''
+    rand = random.Random(seed)
+    return b''.join(b'interface Gi%i/%i\n description %08x\n' %
+                    (num // 48, num % 48, rand.getrandbits(32))
+                    for num in range(lines // 2))
+
+
+def restored(store, pointer):
+    '''The content behind pointer.'''
+    out = io.BytesIO()
+    store.restore(pointer, out)
+    return out.getvalue()
+
+
+def put(store, tmp_path, name, data):
+    '''Store data as file name; return its pointer.'''
+    fname = tmp_path / name
+    fname.write_bytes(data)
+    return store.put_file(str(fname))
+
+
+def test_chunks_are_bounded_and_restore(tmp_path):
+    store = ArtifactStore(str(tmp_path / 'store'))
+    data = config(200000)
+    pointer = put(store, tmp_path, 'a.cfg', data)
+    assert restored(store, pointer) == data
+    sizes = [len(chunk) for chunk in store.split(io.BytesIO(data))]
+    assert sum(sizes) == len(data)
+    assert all(artifactstore.MIN_CHUNK <= size <= artifactstore.CHUNK_SIZE
+               for size in sizes[:-1])
+    assert len(pointer['chunks']) == len(sizes)
+
+
+@pytest.mark.parametrize('edit', ['insert', 'delete'])
+def test_edit_only_adds_the_chunks_around_it(tmp_path, edit):
+    store = ArtifactStore(str(tmp_path / 'store'))
+    lines = config(200000).splitlines(True)
+    first = put(store, tmp_path, 'a.cfg', b''.join(lines))
+    if edit == 'insert':
+        lines.insert(100, b'! a new line\n')
+    else:
+        del lines[100:110]
+    second = put(store, tmp_path, 'b.cfg', b''.join(lines))
+
+    assert restored(store, second) == b''.join(lines)
+    assert len(set(second['chunks']) - set(first['chunks'])) <= 2
+    assert store.stats['chunks_reused'] >= len(second['chunks']) - 2
+
+
+def test_data_without_line_ends_is_cut_at_chunk_size(tmp_path):
+    store = ArtifactStore(str(tmp_path / 'store'), chunk_size=4096,
+                          min_chunk=1024)
+    data = bytes(range(256)).replace(b'\n', b'') * 100
+    assert [len(chunk) for chunk in store.split(io.BytesIO(data))] == \
+        [4096] * 6 + [len(data) - 6 * 4096]
+    assert restored(store, put(store, tmp_path, 'a.bin', data)) == data
+
+
+def test_empty_file(tmp_path):
+    store = ArtifactStore(str(tmp_path / 'store'))
+    pointer = put(store, tmp_path, 'a.cfg', b'')
+    assert pointer['chunks'] == [] and restored(store, pointer) == b''
+
+
+def temp_files(top):
+    '''Names of the temp files left under top.'''
+    return [name for _, _, names in os.walk(str(top)) for name in names
+            if name.endswith('.tmp')]
+
+
+@pytest.mark.parametrize('filters', [None, [{'drop': '^x'}]])
+def test_commit_file_cleans_up_when_the_store_fails(tmp_path, monkeypatch,
+                                                    filters):
+    def broken(self, fname):
+        raise OSError('store is full')
+
+    monkeypatch.setattr(ArtifactStore, 'put_file', broken)
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    tmpname = repo / '.a.cfg.tmp'
+    tmpname.write_bytes(b'\0binary\n')
+    with job_filters(filters, None), \
+            job_store((str(tmp_path / 'store'), 0)):
+        with pytest.raises(OSError):
+            confoutput.commit_file(str(tmpname), str(repo / 'a.cfg'))
+    # Only the caller's own temp file is left, for the caller to remove
+    assert temp_files(repo) == ([] if filters else ['.a.cfg.tmp'])
+    assert not (repo / 'a.cfg').exists()
+
+
+def test_commit_file_cleans_up_when_the_pointer_fails(tmp_path,
+                                                      monkeypatch):
+    def broken(*args):
+        raise OSError('disk full')
+
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    tmpname = repo / '.a.cfg.tmp'
+    tmpname.write_bytes(b'\0binary\n')
+    with job_store((str(tmp_path / 'store'), 0)):
+        monkeypatch.setattr(confoutput, '_replace', broken)
+        with pytest.raises(OSError):
+            confoutput.commit_file(str(tmpname), str(repo / 'a.cfg'))
+    assert temp_files(repo) == []
+
+    monkeypatch.undo()
+    tmpname.write_bytes(b'\0binary\n')
+    with job_store((str(tmp_path / 'store'), 0)):
+        assert confoutput.commit_file(str(tmpname), str(repo / 'a.cfg'))
+    assert read_pointer((repo / 'a.cfg').read_bytes())['size'] == 8
+    assert temp_files(repo) == []
@@ -0,0 +1,103 @@
+''' test_collectsshcmd.py'''
+
+import io
+
+import pytest
+from netmiko.ssh_exception import NetMikoTimeoutException
+
+import collectsshcmd
+from collectsshcmd import batch_commands, stream_command
+
+PROMPT = 'sw1#'
+OUTPUT = {'show clock': '12:00:00.000 UTC Sun Oct 18 2026\n',
+          'show version': 'IOS 15.2\nuptime is 1 week\n',
+          'terminal length 0': ''}
+
+
+class FakeConn():
+    '''Just what the streaming code uses of a Netmiko connection to a
+    CLI that answers each line written with (maybe) its echo, the
+    command's output and the prompt, in chunks of size characters,
+    after lag empty reads. before is there ahead of the first reply.'''
+    protocol = 'telnet'
+    ansi_escape_codes = False
+
+    def __init__(self, echo=True, size=7, before='', lag=0):
+        self.echo = echo
+        self.size = size
+        self.sent = before
+        self.replies = ''
+        self.lag = lag
+
+    @staticmethod
+    def normalize_cmd(command):
+        return command + '\n'
+
+    def write_channel(self, text):
+        for line in text.splitlines():
+            reply = OUTPUT.get(line, '% Invalid input\n' if
+                               line[:1] != '!' else '')
+            if self.echo:
+                reply = line + '\n' + reply
+            self.replies += (reply + PROMPT).replace('\n', '\r\n')
+
+    def read_channel(self):
+        if not self.sent:
+            if self.lag:
+                self.lag -= 1
+                return ''
+            self.sent, self.replies = self.replies, ''
+        text, self.sent = self.sent[:self.size], self.sent[self.size:]
+        return text
+
+
+@pytest.fixture(autouse=True)
+def echo_wait(monkeypatch):
+    '''Less waiting for devices that neither echo nor answer.'''
+    monkeypatch.setattr(collectsshcmd, 'ECHO_WAIT', 0.5)
+
+
+def stream(conn, command):
+    '''What stream_command() writes for command.'''
+    filep = io.BytesIO()
+    stream_command(conn, command, filep, PROMPT, timeout=0.5)
+    return filep.getvalue().decode()
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+@pytest.mark.parametrize('echo', [True, False])
+def test_stream_with_and_without_echo(echo, size):
+    for command, output in OUTPUT.items():
+        # As send_command() has it: a blank line after each section
+        assert stream(FakeConn(echo, size), command) == \
+            '# %s\n%s\n' % (command, output or '\n')
+
+
+@pytest.mark.parametrize('echo', [True, False])
+@pytest.mark.parametrize('before', ['\r\n' + PROMPT,
+                                    '\r\n%s\r\n%s' % (PROMPT, PROMPT)])
+def test_prompt_left_over_from_find_prompt(echo, before):
+    # As when find_prompt() sent a second return on a slow link
+    conn = FakeConn(echo, before=before, lag=20)
+    assert stream(conn, 'show clock') == \
+        '# show clock\n%s\n' % OUTPUT['show clock']
+
+
+def test_silence_before_the_prompt_times_out():
+    conn = FakeConn()
+    conn.write_channel = lambda text: None
+    with pytest.raises(NetMikoTimeoutException):
+        stream(conn, 'show clock')
+
+
+@pytest.mark.parametrize('size', [1, 7, 4096])
+def test_batch(size):
+    filep = io.BytesIO()
+    commands = ['terminal length 0', 'show clock', 'show version']
+    out = batch_commands(FakeConn(size=size), commands, filep, PROMPT,
+                         timeout=0.5)
+    assert filep.getvalue().decode() == \
+        '# terminal length 0\n\n\n' \
+        '# show clock\n%s\n# show version\n%s\n' % (
+            OUTPUT['show clock'], OUTPUT['show version'])
+    assert [section[0] for section in out.sections] == commands
@@ -0,0 +1,169 @@
+''' test_freshness.py'''
+
+import logging
+from contextlib import contextmanager
+from shutil import copyfile
+
+import pytest
+
+import collectscp
+import confoutput
+import freshness
+import runreport
+import sessionpool
+from freshness import Policy, job_policy, parse_stat_types, pop_stat
+
+
+@pytest.mark.parametrize('kwargs, stat', [
+    ({'device_type': 'linux'}, True),
+    ({'device_type': 'vmware_esx'}, True),
+    ({'device_type': 'cisco_ios'}, False),
+    ({'device_type': 'Linux'}, False),
+    ({'device_type': 'cisco_ios', 'sftp_stat': True}, True),
+    ({'device_type': 'linux', 'sftp_stat': False}, False),
+    ({}, False),
+])
+def test_stat_is_opt_in_per_device_type(kwargs, stat):
+    assert pop_stat(kwargs, ('linux', 'vmware*')) is stat
+    assert 'sftp_stat' not in kwargs
+
+
+def test_bad_stat_settings():
+    assert parse_stat_types(None) == ()
+    for setting in ('linux', {'linux': True}, ['linux', 1]):
+        with pytest.raises(ValueError):
+            parse_stat_types(setting)
+    with pytest.raises(ValueError):
+        pop_stat({'sftp_stat': 'yes'}, ())
+
+
+class FakeSCP():
+    '''SCPClient stand-in copying a local file.'''
+    source = None
+    gets = 0
+
+    def __init__(self, transport, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def get(self, remote_path, local_path, **kwargs):
+        '''"Transfer" the source file.'''
+        FakeSCP.gets += 1
+        copyfile(FakeSCP.source, local_path)
+
+
+class FakeConn():
+    '''Just what collectscp uses of a Netmiko connection.'''
+
+    class remote_conn():
+        @staticmethod
+        def get_transport():
+            return None
+
+    @staticmethod
+    def enable():
+        pass
+
+
+@pytest.fixture
+def device(tmp_path, monkeypatch):
+    '''Run collectscp.cfgworker() against a fake device whose file is
+    tmp_path/remote.cfg and whose stat is set through the returned
+    dict. Return a function running one job under a policy; it gives
+    the job's phases.'''
+    remote = tmp_path / 'remote.cfg'
+    remote.write_bytes(b'hostname sw1\n')
+    FakeSCP.source, FakeSCP.gets = str(remote), 0
+    stat = {'reply': (13, 1000000000), 'calls': 0}
+
+    def remote_stat(transport, host, remote_filename, logger):
+        stat['calls'] += 1
+        return stat['reply']
+
+    @contextmanager
+    def session(**kwargs):
+        yield FakeConn()
+
+    monkeypatch.setattr(collectscp, 'SCPClient', FakeSCP)
+    monkeypatch.setattr(collectscp, 'remote_stat', remote_stat)
+    monkeypatch.setattr(sessionpool, 'session', session)
+    repo = tmp_path / 'repo'
+    repo.mkdir()
+    confoutput.open_stage(str(repo))
+
+    def run(policy):
+        record = runreport.JobRecord('sw1', 'sw1')
+        with runreport.job(record), job_policy(policy):
+            collectscp.cfgworker('sw1', logging.DEBUG,
+                                 destination_dir=str(repo),
+                                 log_dir=str(tmp_path))
+        return record
+
+    yield run, stat
+    confoutput.close_stages()
+    runreport.collect_records()
+
+
+def test_no_stat_unless_opted_in(device):
+    run, stat = device
+    assert 'stat' not in run(Policy()).phases
+    run(Policy())
+    assert stat['calls'] == 0
+    assert FakeSCP.gets == 2
+
+
+def test_unchanged_remote_file_is_skipped(device):
+    run, stat = device
+    record = run(Policy(stat=True))
+    assert 'stat' in record.phases and 'connect' not in record.phases
+    assert FakeSCP.gets == 1
+
+    record = run(Policy(stat=True))
+    assert record.skipped == 1
+    assert FakeSCP.gets == 1
+
+    stat['reply'] = (13, 1000000001)
+    run(Policy(stat=True))
+    assert FakeSCP.gets == 2
+    assert stat['calls'] == 3
+
+
+def test_mtime_in_the_second_of_the_stat_is_not_trusted(device,
+                                                        monkeypatch):
+    run, stat = device
+    monkeypatch.setattr(collectscp, 'time', lambda: 1000000000.7)
+    run(Policy(stat=True))
+    run(Policy(stat=True))  # an edit within that second may be missed
+    assert FakeSCP.gets == 2
+
+    monkeypatch.setattr(collectscp, 'time', lambda: 1000000001.2)
+    run(Policy(stat=True))
+    run(Policy(stat=True))
+    assert FakeSCP.gets == 3
+
+
+def test_always_never_stats(device):
+    run, stat = device
+    run(Policy('always', stat=True))
+    assert stat['calls'] == 0
+
+
+def test_remember_remote(tmp_path):
+    fname = tmp_path / 'a.cfg'
+    fname.write_bytes(b'x\n')
+    stage = confoutput.open_stage(str(tmp_path))
+    try:
+        stage.record(str(fname), confoutput.hash_file(str(fname)))
+        freshness.remember_remote(str(fname), 2, 100, stat_time=100.5)
+        assert 'remote_mtime' not in stage.meta(str(fname))
+        freshness.remember_remote(str(fname), 2, 100, stat_time=101.)
+        assert stage.meta(str(fname))['remote_mtime'] == 100
+        assert freshness.remote_unchanged(str(fname), 2, 100)
+        assert not freshness.remote_unchanged(str(fname), 3, 100)
+    finally:
+        confoutput.close_stages()
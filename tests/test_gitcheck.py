@@ -0,0 +1,199 @@
+''' test_gitcheck.py'''
+
+import logging
+import threading
+
+import pytest
+from git import GitCommandError, Repo
+
+import confoutput
+import gitcheck
+from conftest import git
+from gitcheck import git_commit_paths_pull_push, pull_push, push_stats
+
+LOGGER = logging.getLogger('test_gitcheck')
+
+
+def committed_files(repo):
+    '''Files in the origin's master, as a clone of repo sees it.'''
+    git(repo, 'fetch', '-q')
+    return git(repo, 'ls-tree', '-r', '--name-only',
+               'origin/master').split()
+
+
+def collect(repo, name, text):
+    '''Write a file the way a collector does and save the manifest.'''
+    confoutput.open_stage(str(repo))
+    confoutput.write_output(str(repo / name), text)
+    return confoutput.close_stages()[confoutput.open_stage(
+        str(repo)).repo_dir]
+
+
+def test_commits_only_the_given_paths(origin):
+    repo = origin('node')
+    (repo / 'stray.txt').write_text('not from a collector\n')
+    (repo / 'a.cfg').write_text('a\n')
+
+    stats = git_commit_paths_pull_push(str(repo), ['a.cfg'], LOGGER)
+
+    assert stats['committed'] and stats['pushed']
+    assert committed_files(repo) == ['README', 'a.cfg']
+
+
+def test_changes_of_a_run_without_git_go_with_the_next(origin):
+    repo = origin('node')
+    assert collect(repo, 'old.cfg', 'old\n') == ['old.cfg']
+
+    # Next run: only new.cfg changed, but old.cfg is still pending
+    changed = collect(repo, 'new.cfg', 'new\n')
+    paths = sorted(set(changed).union(confoutput.pending_paths(str(repo))))
+    assert paths == ['new.cfg', 'old.cfg']
+
+    stats = git_commit_paths_pull_push(str(repo), paths, LOGGER)
+    confoutput.clear_pending(str(repo), paths)
+
+    assert stats['committed'] and stats['pushed']
+    assert committed_files(repo) == ['README', 'new.cfg', 'old.cfg']
+    assert confoutput.pending_paths(str(repo)) == []
+
+
+def test_paths_left_staged_are_committed(origin):
+    repo = origin('node')
+    (repo / 'staged.cfg').write_text('staged\n')
+    git(repo, 'add', 'staged.cfg')
+    (repo / 'b.cfg').write_text('b\n')
+
+    stats = git_commit_paths_pull_push(str(repo), ['b.cfg'], LOGGER)
+
+    assert stats['committed'] and stats['pushed']
+    assert committed_files(repo) == ['README', 'b.cfg', 'staged.cfg']
+
+
+def commit(repo, name, text):
+    '''Commit one file locally, without pushing.'''
+    (repo / name).write_text(text)
+    git(repo, 'add', name)
+    git(repo, 'commit', '-q', '-m', name)
+
+
+def test_concurrent_pushes_all_land(origin):
+    clones = [origin('node%i' % node) for node in range(6)]
+    results = {}
+
+    def run(node, repo):
+        (repo / ('node%i.cfg' % node)).write_text('%i\n' % node)
+        results[node] = git_commit_paths_pull_push(
+            str(repo), ['node%i.cfg' % node], LOGGER, tries=30, base=0.05)
+
+    threads = [threading.Thread(target=run, args=(node, repo))
+               for node, repo in enumerate(clones)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(stats['pushed'] for stats in results.values())
+    assert committed_files(clones[0]) == \
+        ['README'] + ['node%i.cfg' % node for node in range(6)]
+    log = git(clones[0], 'log', '--format=%s', 'origin/master').split('\n')
+    assert len([line for line in log if line]) == 7
+
+
+class FlakyGit():
+    '''Wraps a Repo's git, running before[command] (once) ahead of the
+    first call of that command.'''
+
+    def __init__(self, git_cmd, **before):
+        self.git_cmd = git_cmd
+        self.before = before
+
+    def __getattr__(self, name):
+        method = getattr(self.git_cmd, name)
+        hook = self.before.pop(name, None)
+        if hook is None:
+            return method
+
+        def call(*args, **kwargs):
+            hook()
+            return method(*args, **kwargs)
+        return call
+
+
+class FlakyRepo():
+    '''A Repo whose git is a FlakyGit.'''
+
+    def __init__(self, repo, **before):
+        self.git_dir = repo.git_dir
+        self.working_tree_dir = repo.working_tree_dir
+        self.git = FlakyGit(repo.git, **before)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    '''Record backoff sleeps instead of sleeping.'''
+    slept = []
+    monkeypatch.setattr(gitcheck, 'sleep', slept.append)
+    return slept
+
+
+def test_rejected_push_is_retried(origin, no_sleep):
+    mine, other = origin('mine'), origin('other')
+    commit(mine, 'mine.cfg', 'mine\n')
+
+    def other_pushes_first():
+        commit(other, 'other.cfg', 'other\n')
+        git(other, 'push', '-q')
+
+    stats = push_stats()
+    with Repo(str(mine)) as repo:
+        pull_push(FlakyRepo(repo, push=other_pushes_first), LOGGER, stats)
+
+    assert stats['pushed'] and stats['attempts'] == 2
+    assert stats['rejected'] == 1 and stats['errors'] == 0
+    assert len(no_sleep) == 1 and stats['backoff'] == no_sleep[0]
+    assert committed_files(mine) == ['README', 'mine.cfg', 'other.cfg']
+
+
+def test_failed_pull_is_retried(origin, no_sleep):
+    mine = origin('mine')
+    commit(mine, 'mine.cfg', 'mine\n')
+
+    def origin_unreachable():
+        raise GitCommandError(['git', 'pull'], 128,
+                              b'fatal: Could not read from remote')
+
+    stats = push_stats()
+    with Repo(str(mine)) as repo:
+        pull_push(FlakyRepo(repo, pull=origin_unreachable), LOGGER, stats)
+
+    assert stats['pushed'] and stats['attempts'] == 2
+    assert stats['errors'] == 1 and stats['rejected'] == 0
+    assert len(no_sleep) == 1
+    assert committed_files(mine) == ['README', 'mine.cfg']
+
+
+def test_gives_up_after_tries(origin, no_sleep):
+    mine = origin('mine')
+    commit(mine, 'mine.cfg', 'mine\n')
+    git(mine, 'remote', 'set-url', 'origin', str(mine / 'missing.git'))
+
+    stats = push_stats()
+    with Repo(str(mine)) as repo, pytest.raises(GitCommandError):
+        pull_push(repo, LOGGER, stats, tries=3)
+    assert stats['attempts'] == 3 and stats['errors'] == 3
+    assert len(no_sleep) == 2 and not stats['pushed']
+
+
+def test_rebase_conflict_is_aborted_not_retried(origin, no_sleep):
+    mine, other = origin('mine'), origin('other')
+    commit(other, 'README', 'theirs\n')
+    git(other, 'push', '-q')
+    commit(mine, 'README', 'mine\n')
+
+    stats = push_stats()
+    with Repo(str(mine)) as repo, pytest.raises(GitCommandError):
+        pull_push(repo, LOGGER, stats)
+    assert stats['attempts'] == 1 and no_sleep == []
+    assert not (mine / '.git' / 'rebase-merge').exists()
+    assert not (mine / '.git' / 'rebase-apply').exists()
+    assert (mine / 'README').read_text() == 'mine\n'
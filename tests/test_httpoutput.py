@@ -0,0 +1,133 @@
+''' test_httpoutput.py'''
+
+import tracemalloc
+
+import pytest
+
+import confoutput
+from httpoutput import save_response
+
+
+class FakeResponse():
+    '''Just what save_response() uses of a requests.Response made with
+    stream=True. The body can only be read through iter_content().'''
+
+    def __init__(self, chunks, encoding=None, status_code=200,
+                 headers=None):
+        self.chunks = chunks
+        self.encoding = encoding
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.chunk_sizes = []
+
+    @property
+    def ok(self):
+        '''As requests has it.'''
+        return self.status_code < 400
+
+    @property
+    def content(self):
+        '''Reading the whole body is what streaming avoids.'''
+        raise AssertionError('body read whole')
+
+    text = content
+
+    def iter_content(self, chunk_size):
+        '''The body in its chunks, which may be a generator.'''
+        self.chunk_sizes.append(chunk_size)
+        return iter(self.chunks)
+
+
+def split(data, size):
+    '''data in chunks of size bytes.'''
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def test_large_body_is_streamed(tmp_path):
+    chunk = b'interface Gi0/1\n description x\n' * 32768  # 1 MiB
+    response = FakeResponse(chunk for _ in range(32))
+    fname = tmp_path / 'big.cfg'
+
+    tracemalloc.start()
+    try:
+        assert save_response(response, str(fname), text=False)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    assert response.chunk_sizes == [confoutput.CHUNK_SIZE]
+    assert fname.stat().st_size == 32 * len(chunk)
+    assert peak < 8 * len(chunk)  # a few chunks, not the 32 MiB body
+
+
+@pytest.mark.parametrize('encoding, body', [
+    ('utf-8', 'ntp server 10.0.0.1 # café\n'.encode('utf-8')),
+    ('UTF8', b'not valid utf-8: \xff\xfe\n'),
+    ('ascii', b'hostname sw1\n'),
+    ('US-ASCII', b'hostname sw1\n'),
+])
+def test_utf8_and_ascii_pass_through(tmp_path, encoding, body):
+    fname = tmp_path / 'a.cfg'
+    assert save_response(FakeResponse(split(body, 5), encoding),
+                         str(fname))
+    assert fname.read_bytes() == body
+
+
+@pytest.mark.parametrize('encoding, text', [
+    ('ISO-8859-1', 'snmp-server location Bodø café\n'),
+    ('shift_jis', '設定ファイル\nホスト名 sw1\n'),
+    ('utf-16', 'hostname sw1\nlocation Zürich\n'),
+    ('gb18030', '配置 文件\n'),
+])
+@pytest.mark.parametrize('size', [1, 3, 4096])
+def test_other_charsets_are_decoded(tmp_path, encoding, text, size):
+    fname = tmp_path / 'a.cfg'
+    body = text.encode(encoding)
+    assert save_response(FakeResponse(split(body, size), encoding),
+                         str(fname))
+    assert fname.read_bytes() == text.encode('utf-8')
+
+
+def test_truncated_multibyte_character_is_replaced(tmp_path):
+    fname = tmp_path / 'a.cfg'
+    body = '設定'.encode('shift_jis')[:-1]
+    assert save_response(FakeResponse(split(body, 1), 'shift_jis'),
+                         str(fname))
+    assert fname.read_bytes() == '設�'.encode('utf-8')
+
+
+def test_encoding_is_guessed_from_the_first_chunk(tmp_path):
+    fname = tmp_path / 'a.cfg'
+    body = b'hostname sw1\nlogging host 10.0.0.1\n' * 10
+    assert save_response(FakeResponse(split(body, 64)), str(fname))
+    assert fname.read_bytes() == body
+
+
+def test_binary_bodies_are_not_decoded(tmp_path):
+    fname = tmp_path / 'a.conf'
+    body = bytes(range(256)) * 4
+    assert save_response(FakeResponse(split(body, 100), 'ISO-8859-1'),
+                         str(fname), text=False)
+    assert fname.read_bytes() == body
+
+
+def test_empty_body(tmp_path):
+    fname = tmp_path / 'a.cfg'
+    assert save_response(FakeResponse([]), str(fname))
+    assert fname.read_bytes() == b''
+
+
+def test_unchanged_body_is_not_rewritten(tmp_path):
+    fname = tmp_path / 'a.cfg'
+    fname.write_bytes(b'hostname sw1\n')
+    assert not save_response(FakeResponse([b'hostname sw1\n'], 'utf-8'),
+                             str(fname))
+
+
+def test_not_modified_leaves_the_file(tmp_path):
+    fname = tmp_path / 'a.cfg'
+    fname.write_bytes(b'hostname sw1\n')
+    response = FakeResponse([], status_code=304)
+    assert not save_response(response, str(fname))
+    assert response.chunk_sizes == []
+    assert fname.read_bytes() == b'hostname sw1\n'
@@ -0,0 +1,75 @@
+''' test_jobhistory.py'''
+
+import pytest
+
+from jobhistory import DEFAULT_PRIOR, JobHistory, makespan, prior
+from runreport import JobRecord
+
+
+class CountingDict(dict):
+    '''A dict counting full scans of its values.'''
+    scans = 0
+
+    def values(self):
+        CountingDict.scans += 1
+        return super().values()
+
+
+def record(section, device_type, seconds, outcome='ok'):
+    '''A finished JobRecord.'''
+    rec = JobRecord(section, section, device_type=device_type)
+    rec.duration = seconds
+    rec.outcome = outcome
+    return rec
+
+
+@pytest.fixture
+def history(tmp_path):
+    '''A JobHistory with three known jobs.'''
+    history = JobHistory(str(tmp_path / 'history.json'))
+    history.update([record('a', 'cisco_ios', 10.),
+                    record('b', 'cisco_ios', 20.),
+                    record('c', 'pfsense', 4.)])
+    return history
+
+
+def test_estimates(history):
+    assert history.estimate('a', 'cisco_ios') == (10., 'history')
+    assert history.estimate('new', 'cisco_ios') == (15., 'device_type')
+    assert history.estimate('new', 'pfsense') == (4., 'device_type')
+    assert history.estimate('new', 'qflex') == (120., 'prior')
+    assert history.estimate('new', 'linux') == (DEFAULT_PRIOR, 'prior')
+
+
+def test_averages_are_computed_once(history):
+    history.jobs = CountingDict(history.jobs)
+    history.averages = None
+    CountingDict.scans = 0
+    for num in range(1000):
+        history.estimate('new%i' % num, ('cisco_ios', 'linux')[num % 2])
+    assert CountingDict.scans == 1
+
+
+def test_update_refreshes_averages(history):
+    assert history.estimate('new', 'cisco_ios')[0] == 15.
+    history.update([record('d', 'cisco_ios', 30.),
+                    record('e', 'cisco_ios', 99., 'unreachable')])
+    assert history.estimate('new', 'cisco_ios')[0] == 20.
+    history.update([record('a', 'cisco_ios', 20.)])
+    assert history.jobs['a'] == {'seconds': 13., 'device_type': 'cisco_ios',
+                                 'runs': 2}
+
+    history.save()
+    history = JobHistory(history.fname)
+    assert history.estimate('new', 'cisco_ios')[0] == pytest.approx(21.)
+
+
+def test_priors_match_case():
+    assert prior('cisco_iossshcmd') == 30.
+    assert prior('QFLEX') == DEFAULT_PRIOR
+
+
+def test_makespan():
+    assert makespan([], 4) == 0.
+    assert makespan([10., 5., 5.], 2) == 10.
+    assert makespan([5., 5., 10.], 2) == 15.
@@ -0,0 +1,112 @@
+''' test_normalize.py'''
+
+import pytest
+
+import confoutput
+import normalize
+from normalize import Normalizer, job_filters, parse_rules, pop_filters
+
+
+def run(specs, data, size=None):
+    '''Feed data through a Normalizer in chunks of size (default: all
+    at once); return the output.'''
+    size = size or max(1, len(data))
+    normalizer = Normalizer(specs)
+    out = b''.join(normalizer.feed(data[start:start + size])
+                   for start in range(0, len(data), size))
+    return out + normalizer.close()
+
+
+@pytest.mark.parametrize('size', [None, 1, 3])
+@pytest.mark.parametrize('specs, data, expected', [
+    ([{'drop': '^ntp clock-period '}],
+     b'hostname a\r\nntp clock-period 17179\r\nend',
+     b'hostname a\r\nend'),
+    ([{'drop': '^! Last configuration change'}],
+     b'! Last configuration change at 10:01\n!\n',
+     b'!\n'),
+    ([{'replace': r'(\d+) packets input', 'with': r'N packets input'}],
+     b' 5 packets input, 9 bytes\nx\n',
+     b' N packets input, 9 bytes\nx\n'),
+    ([{'replace': r'(?P<key>\w+)=\d+', 'with': r'\g<key>=N'}],
+     b'a=1 b=2\r\n', b'a=N b=N\r\n'),
+    ([{'replace': r' +$'}], b'a  \nb\n', b'a\nb\n'),
+    (['sort'], b'b\nc\na', b'a\nb\nc\n'),
+    (['sort'], b'', b''),
+    (['xml'],
+     b'<?xml version="1.0"?>\n<pfsense>  <a x="1"><b>t u</b></a>'
+     b'<!-- c --></pfsense>\n',
+     b'<?xml version="1.0" encoding="utf-8"?>\n<pfsense>\n\t<a x="1">\n'
+     b'\t\t<b>t u</b>\n\t</a>\n\t<!-- c -->\n</pfsense>\n'),
+    ([{'xml': True, 'indent': '  '}], b'<r><k/></r>',
+     b'<?xml version="1.0" encoding="utf-8"?>\n<r>\n  <k/>\n</r>\n'),
+    (['xml', {'drop': '^\t*<time>'}],
+     b'<r>\n    <time>1</time><k/>\n</r>',
+     b'<?xml version="1.0" encoding="utf-8"?>\n<r>\n\t<k/>\n</r>\n'),
+])
+def test_filters(specs, data, expected, size):
+    assert run(specs, data, size) == expected
+
+
+def test_xml_rejects_other_content():
+    with pytest.raises(ValueError):
+        run(['xml'], b'hostname a\n')
+
+
+@pytest.mark.parametrize('spec', [
+    'bogus',
+    {'drop': '('},
+    {'drop': 1},
+    {'drop': 'a', 'replace': 'b'},
+    {'drop': 'a', 'with': 'b'},
+    {'replace': 'a', 'with': r'\2'},
+    ['sort'],
+])
+def test_bad_filters(spec):
+    with pytest.raises(ValueError):
+        parse_rules({'cisco_ios': [spec]})
+
+
+def test_first_matching_glob_wins():
+    rules = parse_rules({'cisco_ios*': [{'drop': 'a'}],
+                         '*sshcmd': [{'drop': 'b'}],
+                         '*': ['sort']})
+    assert pop_filters({'device_type': 'cisco_ios_sshcmd'}, rules) == \
+        ([{'drop': 'a'}], None)
+    assert pop_filters({'device_type': 'hp_sshcmd'}, rules) == \
+        ([{'drop': 'b'}], None)
+    assert pop_filters({'device_type': 'pfsense'}, rules) == \
+        (['sort'], None)
+
+
+def test_globs_match_case():
+    rules = parse_rules({'cisco_ios': ['sort']})
+    assert pop_filters({'device_type': 'CISCO_IOS'}, rules) == ([], None)
+
+
+def test_section_settings_win():
+    rules = parse_rules({'cisco_ios': ['sort']})
+    kwargs = {'device_type': 'cisco_ios', 'normalize': [],
+              'raw_dir': '/raw'}
+    assert pop_filters(kwargs, rules) == ([], '/raw')
+    assert kwargs == {'device_type': 'cisco_ios'}
+    with pytest.raises(ValueError):
+        pop_filters({'normalize': 'sort'}, rules)
+
+
+def test_raw_dir_keeps_what_was_fetched(tmp_path):
+    repo = tmp_path / 'repo'
+    raw = tmp_path / 'raw'
+    (repo / 'ios').mkdir(parents=True)
+    confoutput.open_stage(str(repo))
+    try:
+        with job_filters([{'drop': '^ntp '}], str(raw)):
+            assert normalize.raw_dir() == str(raw)
+            confoutput.write_output(str(repo / 'ios' / 'a.cfg'),
+                                    'hostname a\nntp clock-period 1\n')
+    finally:
+        confoutput.close_stages()
+    assert (repo / 'ios' / 'a.cfg').read_bytes() == b'hostname a\n'
+    assert (raw / 'ios' / 'a.cfg').read_bytes() == \
+        b'hostname a\nntp clock-period 1\n'
+    assert normalize.normalizer() is None
@@ -0,0 +1,105 @@
+''' test_reachability.py'''
+
+import logging
+import socket
+import sys
+from argparse import Namespace
+
+import pytest
+
+import getconfs
+import reachability
+import runreport
+from collectregistry import target_port
+
+LOGGER = logging.getLogger('test_reachability')
+
+
+@pytest.fixture
+def listener():
+    '''A local port that accepts connections.'''
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(8)
+    yield sock.getsockname()[1]
+    sock.close()
+
+
+@pytest.fixture
+def closed_port():
+    '''A local port nothing listens on.'''
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+@pytest.mark.parametrize('kwargs, port', [
+    ({'device_type': 'advantech'}, 80),
+    ({'device_type': 'mediacento'}, 24),
+    ({'device_type': 'peplink'}, 443),
+    ({'device_type': 'pfsense'}, 443),
+    ({'device_type': 'cisco_ios'}, 22),
+    ({'device_type': 'cisco_ios_sshcmd'}, 22),
+    ({'device_type': 'pfsense', 'port': '8443'}, 8443),
+])
+def test_port_comes_from_the_job_or_its_collector(kwargs, port):
+    assert target_port(kwargs) == port
+
+
+def test_sweep(listener, closed_port):
+    errors = reachability.sweep([('127.0.0.1', listener),
+                                 ('127.0.0.1', closed_port),
+                                 ('127.0.0.1', listener)], timeout=2)
+    assert errors[('127.0.0.1', listener)] is None
+    assert errors[('127.0.0.1', closed_port)]
+    assert len(errors) == 2
+
+
+def test_dead_hosts_back_off_and_recover(tmp_path):
+    fname = str(tmp_path / 'dead.json')
+    target = ('sw1', 22)
+    dead = reachability.DeadHosts(fname, base=60)
+    assert dead.due(target, now=1000)
+
+    assert dead.failed(target, 'refused', now=1000)['next_probe'] == 1060
+    assert not dead.due(target, now=1059)
+    assert dead.failed(target, 'refused', now=1060)['next_probe'] == 1180
+    dead.save()
+
+    dead = reachability.DeadHosts(fname, base=60)
+    assert dead.entry(target)['failures'] == 2
+    assert dead.due(target, now=1180)
+    dead.alive(target)
+    assert dead.entry(target) is None
+    assert reachability.backoff(100) == reachability.BACKOFF_MAX
+
+
+def test_preflight_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['getconfs.py'])
+    assert getconfs.get_arguments().preflight_timeout == 0
+
+
+def test_preflight_skips_dead_targets(tmp_path, listener, closed_port):
+    args = Namespace(dead_hosts=str(tmp_path / 'dead.json'),
+                     log_dir=str(tmp_path), retry_failed=False, only=[],
+                     preflight_timeout=2)
+    up = (('127.0.0.1',), {'device_type': 'cisco_ios', 'port': listener},
+          {'section': 'up'})
+    down = (('127.0.0.1',), {'device_type': 'cisco_ios',
+                             'port': closed_port}, {'section': 'down'})
+    runreport.collect_records()
+
+    assert getconfs.preflight(args, [up, down], LOGGER) == [up]
+    records = runreport.collect_records()
+    assert [(rec.section, rec.outcome) for rec in records] == \
+        [('down', 'unreachable')]
+
+    # Cached: not probed again, still skipped
+    dead = reachability.DeadHosts(args.dead_hosts)
+    assert dead.entry(('127.0.0.1', closed_port))['failures'] == 1
+    assert getconfs.preflight(args, [up, down], LOGGER) == [up]
+    dead = reachability.DeadHosts(args.dead_hosts)
+    assert dead.entry(('127.0.0.1', closed_port))['failures'] == 1
+    runreport.collect_records()
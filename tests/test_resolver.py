@@ -0,0 +1,96 @@
+''' test_resolver.py'''
+
+import logging
+import socket
+import sys
+
+import pytest
+
+import getconfs
+import resolver
+import runreport
+
+LOGGER = logging.getLogger('test_resolver')
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    '''Make resolver's real getaddrinfo() answer from a dict of names,
+    counting lookups.'''
+    names = {'sw1.test': '192.0.2.1', 'sw2.test': '192.0.2.2',
+             socket.gethostname(): '192.0.2.100'}
+    calls = []
+    real = socket.getaddrinfo
+
+    def fake(host, port, family=0, type=0, proto=0, flags=0):
+        calls.append(host)
+        if flags & socket.AI_NUMERICHOST:
+            return real(host, port, family, type, proto, flags)
+        if host not in names:
+            raise socket.gaierror(socket.EAI_NONAME, 'unknown ' + host)
+        return real(names[host], port, family, type, proto,
+                    flags | socket.AI_NUMERICHOST)
+
+    monkeypatch.setattr(resolver, '_GETADDRINFO', fake)
+    resolver.configure()
+    yield calls
+    resolver.uninstall()
+    resolver.configure()
+
+
+def test_pinning_is_off_by_default(monkeypatch):
+    monkeypatch.setattr(sys, 'argv', ['getconfs.py'])
+    assert not getconfs.get_arguments().pin_dns
+    assert not resolver.installed()
+
+
+def test_resolve_all_reports_failures(lookups):
+    errors = resolver.CACHE.resolve_all(
+        ['sw1.test', 'sw2.test', 'gone.test', '192.0.2.9', 'sw1.test'])
+    assert list(errors) == ['gone.test']
+    assert sorted(lookups) == ['gone.test', 'sw1.test', 'sw2.test']
+    assert resolver.CACHE.address('sw2.test') == '192.0.2.2'
+    with pytest.raises(socket.gaierror):
+        resolver.CACHE.address('gone.test')
+    assert len(lookups) == 3  # all answered from the cache
+
+
+def test_installed_getaddrinfo_answers_from_the_cache(lookups):
+    resolver.CACHE.resolve_all(['sw1.test'])
+    resolver.install()
+    assert resolver.installed()
+    infos = socket.getaddrinfo('sw1.test', 22, type=socket.SOCK_STREAM)
+    assert infos[0][4] == ('192.0.2.1', 22)
+    assert lookups == ['sw1.test', '192.0.2.1']
+    resolver.uninstall()
+    assert not resolver.installed()
+
+
+def test_entries_expire(lookups, monkeypatch):
+    now = [1000.]
+    monkeypatch.setattr(resolver, 'monotonic', lambda: now[0])
+    resolver.configure(ttl=10)
+    assert resolver.CACHE.address('sw1.test') == '192.0.2.1'
+    now[0] += 5
+    assert resolver.CACHE.address('sw1.test') == '192.0.2.1'
+    assert lookups == ['sw1.test']
+    now[0] += 6
+    assert resolver.CACHE.address('sw1.test') == '192.0.2.1'
+    assert lookups == ['sw1.test', 'sw1.test']
+
+
+def test_unresolved_hosts_are_skipped_with_a_warning(lookups, caplog):
+    jobs = [(('sw1.test',), {}, {'section': 'sw1'}),
+            (('gone.test',), {}, {'section': 'gone'})]
+    runreport.collect_records()
+    with caplog.at_level(logging.WARNING, LOGGER.name):
+        assert getconfs.pre_resolve(jobs, LOGGER) == jobs[:1]
+    warnings = [rec.getMessage() for rec in caplog.records
+                if rec.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert warnings[0].startswith(
+        'Skipping section gone: cannot resolve gone.test (')
+    assert [(rec.section, rec.outcome)
+            for rec in runreport.collect_records()] == \
+        [('gone', 'unresolved')]
+    assert resolver.local_address() == '192.0.2.100'
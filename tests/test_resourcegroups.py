@@ -0,0 +1,129 @@
+''' test_resourcegroups.py'''
+
+import threading
+import time
+
+import pytest
+
+import resourcegroups
+from resourcegroups import (ResourceGroup, Scheduler, TokenBucket,
+                            parse_groups)
+from runengine import run_jobs
+
+
+def test_cap_is_never_exceeded():
+    groups = parse_groups({'link': {'max_jobs': 2}, 'auth': {'max_jobs': 3}})
+    job_groups = [('link',), ('auth',), ('auth', 'link'), ()] * 10
+    running = dict.fromkeys(groups, 0)
+    peaks = dict.fromkeys(groups, 0)
+    lock = threading.Lock()
+
+    def worker(names):
+        with lock:
+            for name in names:
+                running[name] += 1
+                peaks[name] = max(peaks[name], running[name])
+        time.sleep(0.005)
+        with lock:
+            for name in names:
+                running[name] -= 1
+        return names
+
+    scheduler = Scheduler(groups, job_groups)
+    assert run_jobs(worker, job_groups, 16, scheduler) == job_groups
+    assert peaks['link'] <= 2 and peaks['auth'] <= 3
+    assert groups['link'].peak <= 2 and groups['auth'].peak <= 3
+    assert all(group.running == 0 for group in groups.values())
+
+
+def test_full_group_does_not_block_other_jobs():
+    groups = parse_groups({'link': {'max_jobs': 1}})
+    scheduler = Scheduler(groups, [('link',), ('link',), (), ('link',), ()])
+    assert scheduler.try_take() == 0
+    assert scheduler.try_take() == 2
+    assert scheduler.try_take() == 4
+    assert scheduler.try_take() is None
+    scheduler.release(0)
+    assert scheduler.try_take() == 1
+
+
+def test_release_wakes_waiters():
+    groups = parse_groups({'link': {'max_jobs': 1}})
+    scheduler = Scheduler(groups, [('link',), ('link',)])
+    assert scheduler.take() == 0
+    taken = []
+    waiter = threading.Thread(target=lambda: taken.append(scheduler.take()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive() and taken == []
+
+    scheduler.release(0)
+    waiter.join(5)
+    assert taken == [1]
+    scheduler.release(1)
+    assert scheduler.take() is None
+
+
+class Clock():
+    '''A monotonic() that only moves when told to.'''
+
+    def __init__(self):
+        self.now = 1000.
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_waits_out_the_debt(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resourcegroups, 'monotonic', clock)
+    bucket = TokenBucket(100, burst=100)
+
+    assert bucket.reserve(100) == 0.        # the burst
+    assert bucket.reserve(50) == pytest.approx(0.5)
+    assert bucket.reserve(50) == pytest.approx(1.0)  # queued behind it
+    clock.now += 1.0
+    assert bucket.reserve(0) == pytest.approx(0.)
+    assert bucket.reserve(10) == pytest.approx(0.1)
+    clock.now += 60
+    assert bucket.reserve(100) == 0.        # refilled, up to burst only
+    assert bucket.reserve(1) == pytest.approx(0.01)
+    assert bucket.waited == pytest.approx(0.5 + 1.0 + 0.1 + 0.01)
+
+
+def test_throttle_sleeps_for_the_slowest_group(monkeypatch):
+    clock = Clock()
+    slept = []
+    monkeypatch.setattr(resourcegroups, 'monotonic', clock)
+    monkeypatch.setattr(resourcegroups, 'sleep', slept.append)
+    fast = ResourceGroup('fast', bytes_per_sec=1000, burst_bytes=0)
+    slow = ResourceGroup('slow', bytes_per_sec=100, burst_bytes=0)
+
+    resourcegroups.throttle(100)  # outside a job: no limits
+    with resourcegroups.job_groups((fast, slow, ResourceGroup('cap', 1))):
+        resourcegroups.throttle(100)
+    assert slept == [pytest.approx(1.0)]
+    assert slow.throttled == pytest.approx(1.0)
+    assert fast.throttled == pytest.approx(0.1)
+
+
+@pytest.mark.parametrize('settings', [
+    {'a': {'max_jobs': 0}},
+    {'a': {'bytes_per_sec': 0}},
+    {'a': {'max_job': 1}},
+    {'a': 4},
+])
+def test_bad_groups(settings):
+    with pytest.raises(ValueError):
+        parse_groups(settings)
+
+
+def test_pop_groups():
+    groups = parse_groups({'a': {}, 'b': {}})
+    kwargs = {'resource_groups': ['b', 'a', 'b']}
+    assert resourcegroups.pop_groups(kwargs, groups) == ('a', 'b')
+    assert kwargs == {}
+    assert resourcegroups.pop_groups({'resource_groups': 'a'},
+                                     groups) == ('a',)
+    with pytest.raises(ValueError):
+        resourcegroups.pop_groups({'resource_groups': ['c']}, groups)